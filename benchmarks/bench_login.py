@@ -0,0 +1,188 @@
+"""
+Benchmark `LDAPLoginManager.ldap_login` against a simulated directory.
+
+Measures the throughput and p50/p90/p99 latency of direct-bind and
+bind/search logins for each thread count and USER_SEARCH list size, and
+writes the results as JSON so runs can be compared between commits::
+
+    python benchmarks/bench_login.py --json before.json
+    git checkout other-branch
+    python benchmarks/bench_login.py --json after.json --compare before.json
+
+With ``--directory memory`` the logins run against an indexed
+`flask_ldap_login.directory.MemoryDirectory`, which evaluates the search
+filters and scopes like a server, e.g. with 100k users::
+
+    python benchmarks/bench_login.py --directory memory --users 100000
+
+Requires the test dependencies (mock).
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import flask
+from mock import patch
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.bench import run_load
+from flask_ldap_login.directory import MemoryDirectory
+from flask_ldap_login.tests.fixture import SimulatedDirectory
+
+
+def int_list(value):
+    return [int(v) for v in value.split(',')]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def make_manager(mode, searches, threads, extra_config):
+    'A login manager for `mode` with `searches` USER_SEARCH entries, the last one matching'
+    if mode == 'direct':
+        config = dict(BIND_DN='uid=%(username)s,ou=people')
+    else:
+        user_search = [{'base': 'ou=nobody%d' % n, 'filter': 'uid=%(username)s'}
+                       for n in range(searches - 1)]
+        user_search.append({'base': 'ou=people', 'filter': 'uid=%(username)s'})
+        config = dict(BIND_DN='uid=user0,ou=people', BIND_AUTH='pass0',
+                      USER_SEARCH=user_search)
+    config['POOL_SIZE'] = threads
+    config.update(extra_config)
+
+    app = flask.Flask(__name__)
+    app.config.update(LDAP=config)
+    return LDAPLoginManager(app)
+
+
+def memory_directory(args):
+    'A `MemoryDirectory` with the users of `SimulatedDirectory` and the USER_SEARCH bases'
+    directory = MemoryDirectory(latency=args.latency / 1000.0,
+                                connect_latency=args.connect_latency / 1000.0)
+    for n in range(max(args.searches)):
+        directory.add('ou=nobody%d' % n, {'objectClass': [b'organizationalUnit'],
+                                          'ou': [b'nobody%d' % n]})
+    for n in range(args.users):
+        directory.add('uid=user%d,ou=people' % n, {'objectClass': [b'person'],
+                                                   'uid': [b'user%d' % n],
+                                                   'cn': [b'User %d' % n],
+                                                   'mail': [b'user%d@example.com' % n],
+                                                   'userPassword': [b'pass%d' % n]})
+    return directory
+
+
+def run(args):
+    # Injected failures would log a warning per failed server
+    logging.getLogger('flask_ldap_login').setLevel(logging.ERROR)
+    if args.directory == 'memory':
+        directory = memory_directory(args)
+    else:
+        directory = SimulatedDirectory(users=args.users, latency=args.latency / 1000.0,
+                                       connect_latency=args.connect_latency / 1000.0,
+                                       failure_rate=args.failure_rate, seed=args.seed)
+    credentials = [('user%d' % n, 'pass%d' % n) for n in range(args.users)]
+    extra_config = json.loads(args.config) if args.config else {}
+
+    results = []
+    with patch('ldap.initialize', side_effect=directory.initialize):
+        for mode in args.modes.split(','):
+            for searches in (args.searches if mode == 'search' else [0]):
+                for threads in args.threads:
+                    manager = make_manager(mode, searches, threads, extra_config)
+                    operations = dict(directory.operations)
+                    result = run_load(manager.ldap_login, credentials,
+                                      threads=threads, count=args.logins)
+                    result['mode'] = mode
+                    result['searches'] = searches
+                    result['operations'] = dict((name, count - operations[name])
+                                                for name, count in directory.operations.items())
+                    results.append(result)
+                    print("%-6s searches=%-2d threads=%-3d %8.1f logins/s  "
+                          "p50=%.2fms p99=%.2fms errors=%s"
+                          % (mode, searches, threads, result['throughput'] or 0,
+                             result['p50_ms'] or 0, result['p99_ms'] or 0,
+                             sum(result['errors'].values())), file=sys.stderr)
+    return results
+
+
+def run_key(result):
+    return result['mode'], result['searches'], result['threads']
+
+
+def compare(results, baseline):
+    'Print the throughput and p99 of `results` relative to the `baseline` run'
+    before = dict((run_key(r), r) for r in baseline['results'])
+    print("\nCompared with %s:" % (baseline.get('revision') or 'baseline'), file=sys.stderr)
+    for result in results:
+        old = before.get(run_key(result))
+        if old is None or not old['throughput'] or not old['p99_ms']:
+            continue
+        print("%-6s searches=%-2d threads=%-3d throughput %+6.1f%%  p99 %+6.1f%%"
+              % (result['mode'], result['searches'], result['threads'],
+                 100.0 * (result['throughput'] / old['throughput'] - 1),
+                 100.0 * (result['p99_ms'] / old['p99_ms'] - 1)), file=sys.stderr)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modes', default='direct,search',
+                        help='Comma separated login modes: direct, search (default: both)')
+    parser.add_argument('--threads', type=int_list, default=[1, 4, 16],
+                        help='Comma separated thread counts (default: 1,4,16)')
+    parser.add_argument('--searches', type=int_list, default=[1, 4],
+                        help='Comma separated USER_SEARCH list sizes (default: 1,4)')
+    parser.add_argument('--logins', type=int, default=2000, help='Logins per run (default: 2000)')
+    parser.add_argument('--directory', choices=('simulated', 'memory'), default='simulated',
+                        help='Directory stand-in: simulated (uid lookups only) or memory '
+                             '(indexed, real filters and scopes) (default: simulated)')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='Users in the directory (default: 1000)')
+    parser.add_argument('--latency', type=float, default=1.0,
+                        help='Latency of each operation in ms (default: 1)')
+    parser.add_argument('--connect-latency', type=float, default=5.0,
+                        help='Connection setup latency in ms (default: 5)')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Fraction of operations failing with SERVER_DOWN (default: 0)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the failure injection')
+    parser.add_argument('--config', help='Extra LDAP config as a JSON object')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='Compare with the results in PATH')
+    args = parser.parse_args()
+    if args.directory == 'memory' and args.failure_rate:
+        parser.error("--failure-rate requires the simulated directory")
+
+    report = {'revision': git_revision(),
+              'python': platform.python_version(),
+              'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'parameters': dict((k, v) for k, v in vars(args).items()
+                                 if k not in ('json', 'compare')),
+              'results': run(args)}
+
+    if args.compare:
+        with open(args.compare) as fd:
+            compare(report['results'], json.load(fd))
+
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as fd:
+            fd.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Replay a RECORD_PATH log of production LDAP traffic against `ldap_login`.
+
+The recorded binds and searches are answered by a `ReplayDirectory` with
+their recorded latencies while the recorded logins are replayed at their
+recorded pace (or faster with `--speed`), so configuration changes can be
+compared offline on real traffic::
+
+    python benchmarks/replay_login.py ldap.log --app myapp:app --json before.json
+    python benchmarks/replay_login.py ldap.log --app myapp:app --speed 4 \\
+        --config '{"LOGIN_CACHE_TTL": 60}' --json after.json
+
+Logins use the password 'replay' since passwords are not recorded: binds are
+answered by DN, so recorded successes and failures replay as such.
+"""
+from __future__ import print_function
+
+from argparse import ArgumentParser
+import json
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import flask
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.check import load_app
+from flask_ldap_login.replay import ReplayDirectory, read_log, run_replay, stand_in
+
+
+def load_config(args):
+    'The LDAP config of `--app` updated with `--config`'
+    config = {}
+    if args.app:
+        config.update(load_app(args.app).config.get('LDAP', {}))
+    if args.config:
+        config.update(json.loads(args.config))
+    # Replaying must not record again
+    config['RECORD_PATH'] = None
+    return config
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('log', help='RECORD_PATH log to replay')
+    parser.add_argument('--app', help='Flask application whose LDAP config to use, '
+                                      'as module:attribute')
+    parser.add_argument('--config', help='LDAP config (or overrides of the --app config) '
+                                         'as a JSON object')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Concurrent login threads (default: 8)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay the logins this many times faster than recorded, '
+                             '0 for back to back (default: 1)')
+    parser.add_argument('--latency-scale', type=float, default=1.0,
+                        help='Multiply the recorded latencies by this factor (default: 1)')
+    parser.add_argument('--json', metavar='PATH', help='Write the results to PATH')
+    args = parser.parse_args()
+
+    if not (args.app or args.config):
+        parser.error("--app or --config is required")
+
+    logging.getLogger('flask_ldap_login').setLevel(logging.ERROR)
+    directory = ReplayDirectory(read_log(args.log), latency_scale=args.latency_scale)
+    if not directory.logins:
+        parser.error("%s has no recorded logins" % args.log)
+
+    app = flask.Flask(__name__)
+    app.config.update(LDAP=load_config(args))
+    with stand_in(directory):
+        manager = LDAPLoginManager(app)
+        result = run_replay(manager.ldap_login, directory.logins,
+                            threads=args.threads, speed=args.speed)
+    result['directory'] = directory.stats()
+
+    lag = '' if result['lag_ms'] is None else ' lag=%.2fms' % result['lag_ms']
+    print("%d logins  %8.1f logins/s  p50=%.2fms p99=%.2fms%s errors=%s misses=%d"
+          % (len(directory.logins), result['throughput'] or 0, result['p50_ms'] or 0,
+             result['p99_ms'] or 0, lag, sum(result['errors'].values()),
+             directory.misses), file=sys.stderr)
+
+    output = json.dumps(result, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, 'w') as fd:
+            fd.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,24 @@ update the application like::
     The value of this setting can be anything that your LDAP library supports. 
     For instance, openldap may allow you to give a comma- or space-separated 
     list of URIs to try in sequence.
+
+:param SERVERS:
+    A list of server URIs to use instead of URI. Each new connection goes to
+    the available server with the lowest moving-average bind latency, servers
+    that fail are marked down with an exponential backoff, and a login that
+    fails with a transport error is retried on the next server.
+
+:param SERVER_BACKOFF:
+    Seconds a failed server is marked down, doubled for each consecutive
+    failure (default 1).
+
+:param SERVER_MAX_BACKOFF:
+    Maximum backoff in seconds (default 300).
+
+:param SERVER_PROBE_INTERVAL:
+    If set, a background thread binds to every server in SERVERS every this
+    many seconds to measure latency and detect failed or recovered servers
+    (default 0, disabled).
     
 :param BIND_DN:
     The distinguished name to use when binding to the LDAP server (with BIND_AUTH). 
@@ -38,34 +56,234 @@ update the application like::
      
         'application_key': 'ldap_key'   
 
+:param USER_ATTRIBUTES:
+    Without KEY_MAP, the attributes fetched for the userdata (default
+    `flask_ldap_login.plan.DEFAULT_USER_ATTRIBUTES`: uid, cn, sn, givenName,
+    displayName, mail, sAMAccountName and userPrincipalName), or '*' for all.
+
+:param LAZY_USERDATA:
+    If True, login results are `LazyUserData` mappings that decode each
+    attribute on first access instead of dicts (default False). They are not
+    dict instances, use their `to_dict()` for json or isinstance checks.
+
+:param ATTRIBUTE_CODECS:
+    With LAZY_USERDATA, a dict mapping ldap attribute names to a codec:
+    'str', 'int', 'bytes', 'guid', 'sid', 'time' or a callable taking the raw
+    value. objectGUID and objectSid are decoded as 'guid' and 'sid' by default.
+
+:param BINARY_ATTRIBUTES:
+    With LAZY_USERDATA and without KEY_MAP, attributes left out of the
+    userdata (default `flask_ldap_login.attributes.BINARY_ATTRIBUTES`: jpegPhoto,
+    certificates, ...).
+
+:param POOL_SIZE:
+    Maximum number of connections kept open by the login manager (default 10).
+    Set to 0 to open a new connection for every login.
+
+:param POOL_TIMEOUT:
+    Seconds a login waits for a free pooled connection (default 30).
+
+:param POOL_IDLE_TIMEOUT:
+    Unbind pooled connections that were idle for this many seconds (default 300).
+
+:param POOL_MAX_LIFETIME:
+    Unbind pooled connections older than this many seconds (default None).
+
+:param POOL_CHECK_INTERVAL:
+    Health check pooled connections idle for longer than this many seconds
+    before reusing them (default 60).
+
+:param PERSISTENT_SEARCH:
+    If True, USER_SEARCH lookups run on long-lived connections that stay bound
+    as BIND_DN, and user passwords are verified on a separate pooled connection
+    (default False). BIND_DN may not contain %(username)s in this mode.
+
+:param SEARCH_POOL_SIZE:
+    Number of persistent search connections (default 2).
+
+:param LOGIN_CACHE_TTL:
+    Cache successful logins for this many seconds (default 0, disabled).
+
+:param LOGIN_CACHE_SIZE:
+    Maximum number of cached logins (default 1024).
+
+:param CACHE_HASH_ITERATIONS:
+    PBKDF2 iterations used to hash cached credentials (default 10000).
+
+:param DN_CACHE_TTL:
+    Remember the DN found by USER_SEARCH for each username for this many
+    seconds (default 0, disabled).
+
+:param DN_CACHE_SIZE:
+    Maximum number of cached DNs (default 1024).
+
+:param CACHE_BACKEND:
+    Where the login and DN caches are kept: 'memory' (default, per process),
+    'file' (an SQLite database at CACHE_PATH shared by the processes of the
+    host) or a backend such as `flask_ldap_login.stores.RedisBackend(client)`.
+
+:param CACHE_PATH:
+    Path of the database of the 'file' CACHE_BACKEND.
+
+:param CACHE_SALT:
+    Salt of the hashed credentials in the login cache and key signing the
+    entries of shared caches, required to share them between processes
+    (default: random per process with the 'memory' backend, the application
+    SECRET_KEY otherwise).
+
+:param FAILURE_CACHE_TTL:
+    Remember failed username/password pairs for this many seconds and reject
+    them without contacting the directory (default 0, disabled).
+
+:param THROTTLE_THRESHOLD:
+    Reject logins for a username with `LoginThrottled` after this many failures
+    within THROTTLE_WINDOW seconds (default 0, disabled).
+
+:param THROTTLE_SOURCE_THRESHOLD:
+    Same as THROTTLE_THRESHOLD, counted per login source (e.g. client address).
+
+:param THROTTLE_WINDOW:
+    Length of the throttling window in seconds (default 300).
+
+:param ADAPTIVE_SEARCH_ORDER:
+    If True, try the USER_SEARCH entries that found the most users first
+    instead of using the configuration order (default False).
+
+:param PARALLEL_SEARCH:
+    If True, send all USER_SEARCH searches at once on one connection and bind
+    the matches in configuration order (default False).
+
+:param ASYNC_MODE:
+    How `ldap_login_async` talks to the directory: 'native' uses python-ldap's
+    asynchronous operations, 'executor' runs `ldap_login` in the event loop's
+    default executor (default 'native').
+
+:param EXPORT_PAGE_SIZE:
+    Entries requested per page by `iter_users` and `sync_users` (default 500).
+
+:param EXPORT_BATCH_SIZE:
+    Users passed per call to the `save_users` callback by `sync_users`
+    (default 1000).
+
+:param LOOKUP_CHUNK_SIZE:
+    Usernames merged into one search filter by `lookup_users` (default 100).
+
+:param GROUP_SEARCH:
+    A dict to add the direct and nested groups of the user to the login userdata.
+    It may contain 'method': 'memberOf' (read the user's memberOf attribute),
+    'member' (the default, search groups whose member_attr is the user DN) or
+    'in_chain' (Active Directory LDAP_MATCHING_RULE_IN_CHAIN), 'base' (required
+    unless the method is 'memberOf'), 'filter', 'scope', 'member_attr' (default
+    'member', e.g. 'uniqueMember'), 'nested' (default True), 'sizelimit'
+    (maximum entries of a group search, default 1000) and 'key', the userdata
+    key of the list of group DNs (default 'groups'). With USER_SEARCH, groups
+    are searched as BIND_DN.
+
+:param GROUP_CACHE_TTL:
+    Seconds the parent groups of a group are cached for nested group
+    resolution (default 300, 0 disables the cache).
+
+:param GROUP_CACHE_SIZE:
+    Maximum number of cached groups (default 10000).
+
+:param METRICS:
+    'memory' to keep histograms of the duration of each login phase and
+    counters of login outcomes in `LDAPLoginManager.metrics`, or a
+    `flask_ldap_login.metrics.Metrics` instance such as `PrometheusMetrics` or
+    `StatsdMetrics` (default None, disabled).
+
+:param LOGIN_TIMEOUT:
+    Seconds a login may spend on the directory, from checking out a
+    connection to the last bind, before it raises `ldap.TIMEOUT`
+    (default 0, no deadline).
+
+:param SEARCH_TIME_LIMIT:
+    Server side time limit in seconds of the USER_SEARCH searches
+    (default 10, 0 for none).
+
+:param BREAKER_THRESHOLD:
+    After this many consecutive logins failing because the directory is
+    unreachable or timed out, fail logins immediately with
+    `DirectoryUnavailable` (default 0, disabled).
+
+:param BREAKER_RESET_TIMEOUT:
+    Seconds the breaker stays open before a single login probes the
+    directory again (default 30).
+
+:param COALESCE_LOGINS:
+    If True, concurrent logins with the same username and password share
+    the result of the first one instead of contacting the directory each
+    (default False).
+
+:param COALESCE_TIMEOUT:
+    Seconds a coalesced login waits for the first one before logging in
+    separately (default LOGIN_TIMEOUT, or 30 without LOGIN_TIMEOUT).
+
+:param MAX_CONCURRENT_LOGINS:
+    Maximum number of logins contacting the directory at once, the others
+    wait in a queue (default 0, unlimited).
+
+:param LOGIN_QUEUE_SIZE:
+    Maximum number of logins waiting for their turn, further logins raise
+    `DirectoryBusy` at once (default 100).
+
+:param LOGIN_QUEUE_TIMEOUT:
+    Seconds a queued login waits before it raises `DirectoryBusy` (default 5).
+
+:param SAVE_USER_ON_CHANGE:
+    If True and a `load_user` callback is set, `LDAPLoginForm` only calls
+    `save_user` when the userdata of a user changed since it was last saved,
+    and gets the user object from `load_user` otherwise (default False).
+
+:param SAVE_USER_MAX_AGE:
+    Seconds after which a user is saved again even if its userdata did not
+    change (default 86400).
+
+:param SAVE_USER_CACHE_SIZE:
+    Maximum number of userdata fingerprints kept (default 10000).
+
+:param RECORD_PATH:
+    Append the logins and LDAP operations to this file, with redacted
+    results and without passwords, to replay them with
+    `flask_ldap_login.replay` (default None).
 
 """
+from contextlib import contextmanager
 import logging
+import time
 
-import flask
 import ldap
 
+from .admission import AdmissionControl
+from .breaker import CircuitBreaker
+from .cache import CredentialHasher, LoginCache, TTLCache, fingerprint
+from .errors import (AmbiguousUser, DirectoryBusy, DirectoryUnavailable, LoginThrottled,
+                     PoolExhausted, ServiceBindFailed)
+from .export import entry_username, or_filter, paged_search, username_attr
 from .forms import LDAPLoginForm
+from .groups import compile_group_search
+from .metrics import compile_metrics
+from .plan import attribute_name, compile_config, scalar
+from .pool import ConnectionPool, TRANSPORT_ERRORS, connection_deadline
+from .replay import Recorder
+from .servers import ServerSet, connection_uri
+from .singleflight import SingleFlight
+from .stores import compile_cache_backend
+from .stats import SearchStats
+from .throttle import FailureThrottle
+
+__all__ = ['LDAPLoginForm', 'LDAPLoginManager', 'scalar']
 
 log = logging.getLogger(__name__)
 
-def scalar(value):
-    """
-    Take return a value[0] if `value` is a list of length 1
-    """
-    if isinstance(value, (list, tuple)) and len(value) == 1:
-        return value[0]
-    return value
+_clock = getattr(time, 'monotonic', time.time)
 
+#: Size limit of the USER_SEARCH searches: a second entry makes the match ambiguous
+USER_SIZELIMIT = 2
 
-def _is_utf8(s):
-    try:
-        if isinstance(s, str):
-            us = s.decode('utf-8')
+#: Errors of reading the entry at a cached DN back that make the DN stale
+UNREADABLE_ENTRY = (ldap.NO_SUCH_OBJECT, ldap.INSUFFICIENT_ACCESS)
 
-        return True
-    except UnicodeDecodeError:
-        return False
 
 class LDAPLoginManager(object):
     '''
@@ -77,12 +295,32 @@ class LDAPLoginManager(object):
 
     def __init__(self, app=None):
 
-        if app is not None:
-            self.init_app(app)
-
         self._raise_errors = False
         self.conn = None
         self._save_user = None
+        self._save_users = None
+        self._load_user = None
+        self._pool = None
+        self._search_pool = None
+        self.login_cache = None
+        self.dn_cache = None
+        self.failure_cache = None
+        self._user_throttle = None
+        self._source_throttle = None
+        self._search_stats = None
+        self._servers = None
+        self._plan = None
+        self.group_cache = None
+        self._groups = None
+        self.metrics = None
+        self._breaker = None
+        self._flight = None
+        self._admission = None
+        self.user_fingerprints = None
+        self._recorder = None
+
+        if app is not None:
+            self.init_app(app)
 
     def set_raise_errors(self, state=True):
         '''
@@ -110,6 +348,195 @@ class LDAPLoginManager(object):
         if self.config.get('USER_SEARCH') and not isinstance(self.config['USER_SEARCH'], list):
             self.config['USER_SEARCH'] = [self.config['USER_SEARCH']]
 
+        self.config.setdefault('GROUP_CACHE_TTL', 300)
+        self.config.setdefault('GROUP_CACHE_SIZE', 10000)
+        self.group_cache = None
+        if self.config.get('GROUP_SEARCH') and self.config['GROUP_CACHE_TTL']:
+            self.group_cache = TTLCache(maxsize=self.config['GROUP_CACHE_SIZE'],
+                                        ttl=self.config['GROUP_CACHE_TTL'])
+        self._groups = compile_group_search(self.config.get('GROUP_SEARCH'), self.group_cache)
+        extra_attrs = self._groups.attrlist if self._groups is not None else ()
+
+        self._plan = compile_config(self.config, extra_attrs)
+        self.metrics = compile_metrics(self.config.get('METRICS'))
+
+        self.config.setdefault('RECORD_PATH', None)
+        if self._recorder is not None:
+            self._recorder.close()
+        self._recorder = (Recorder(self.config['RECORD_PATH'])
+                          if self.config['RECORD_PATH'] else None)
+
+        self.config.setdefault('SERVERS', [self.config['URI']])
+        self.config.setdefault('SERVER_BACKOFF', 1)
+        self.config.setdefault('SERVER_MAX_BACKOFF', 300)
+        self.config.setdefault('SERVER_PROBE_INTERVAL', 0)
+
+        if self._servers is not None:
+            self._servers.stop_probes()
+        self._servers = ServerSet(self.config['SERVERS'],
+                                  backoff=self.config['SERVER_BACKOFF'],
+                                  max_backoff=self.config['SERVER_MAX_BACKOFF'])
+        if self.config['SERVER_PROBE_INTERVAL']:
+            self._servers.start_probes(self._probe, self.config['SERVER_PROBE_INTERVAL'])
+
+        self.config.setdefault('POOL_SIZE', 10)
+        self.config.setdefault('POOL_TIMEOUT', 30)
+        self.config.setdefault('POOL_IDLE_TIMEOUT', 300)
+        self.config.setdefault('POOL_MAX_LIFETIME', None)
+        self.config.setdefault('POOL_CHECK_INTERVAL', 60)
+
+        self.config.setdefault('ADAPTIVE_SEARCH_ORDER', False)
+        self.config.setdefault('PARALLEL_SEARCH', False)
+        self.config.setdefault('PERSISTENT_SEARCH', False)
+        self.config.setdefault('SEARCH_POOL_SIZE', 2)
+
+        for pool in (self._pool, self._search_pool):
+            if pool is not None:
+                pool.close()
+
+        self._pool = self._make_pool(self.initialize, self.config['POOL_SIZE'])
+        self._search_pool = None
+
+        if self.config['PERSISTENT_SEARCH'] and self.config.get('USER_SEARCH'):
+            if '%(' in self.config['BIND_DN']:
+                raise ValueError("PERSISTENT_SEARCH requires a BIND_DN that does not "
+                                 "depend on the username, got %r" % self.config['BIND_DN'])
+            # Connections stay bound as BIND_DN so they can not be unpooled
+            self._search_pool = self._make_pool(self.initialize_search,
+                                                max(self.config['SEARCH_POOL_SIZE'], 1))
+
+        self._search_stats = SearchStats(self.config.get('USER_SEARCH') or [])
+
+        self.config.setdefault('LOGIN_CACHE_TTL', 0)
+        self.config.setdefault('LOGIN_CACHE_SIZE', 1024)
+        self.config.setdefault('CACHE_HASH_ITERATIONS', 10000)
+
+        self.config.setdefault('CACHE_BACKEND', 'memory')
+        self.config.setdefault('CACHE_SALT', None)
+
+        salt = self.config['CACHE_SALT']
+        if salt is None and self.config['CACHE_BACKEND'] != 'memory':
+            # Every process must hash credentials and sign entries the same way
+            salt = app.config.get('SECRET_KEY')
+            if not salt:
+                raise ValueError("A shared CACHE_BACKEND requires CACHE_SALT or the "
+                                 "application SECRET_KEY")
+        backend = compile_cache_backend(self.config['CACHE_BACKEND'],
+                                        self.config.get('CACHE_PATH'), secret=salt)
+        self._hasher = CredentialHasher(salt, iterations=self.config['CACHE_HASH_ITERATIONS'])
+
+        self.login_cache = None
+        if self.config['LOGIN_CACHE_TTL']:
+            store = backend('login', self.config['LOGIN_CACHE_SIZE'],
+                            self.config['LOGIN_CACHE_TTL'])
+            self.login_cache = LoginCache(store, self._hasher)
+
+        self.config.setdefault('DN_CACHE_TTL', 0)
+        self.config.setdefault('DN_CACHE_SIZE', 1024)
+
+        self.dn_cache = None
+        if self.config['DN_CACHE_TTL'] and self.config.get('USER_SEARCH'):
+            self.dn_cache = backend('dn', self.config['DN_CACHE_SIZE'],
+                                    self.config['DN_CACHE_TTL'])
+
+        self.config.setdefault('FAILURE_CACHE_TTL', 0)
+        self.config.setdefault('THROTTLE_THRESHOLD', 0)
+        self.config.setdefault('THROTTLE_SOURCE_THRESHOLD', 0)
+        self.config.setdefault('THROTTLE_WINDOW', 300)
+        self.config.setdefault('THROTTLE_SIZE', 10000)
+
+        self.failure_cache = None
+        if self.config['FAILURE_CACHE_TTL']:
+            self.failure_cache = TTLCache(maxsize=self.config['THROTTLE_SIZE'],
+                                          ttl=self.config['FAILURE_CACHE_TTL'])
+
+        self._user_throttle = self._source_throttle = None
+        if self.config['THROTTLE_THRESHOLD']:
+            self._user_throttle = FailureThrottle(self.config['THROTTLE_THRESHOLD'],
+                                                  self.config['THROTTLE_WINDOW'],
+                                                  self.config['THROTTLE_SIZE'])
+        if self.config['THROTTLE_SOURCE_THRESHOLD']:
+            self._source_throttle = FailureThrottle(self.config['THROTTLE_SOURCE_THRESHOLD'],
+                                                    self.config['THROTTLE_WINDOW'],
+                                                    self.config['THROTTLE_SIZE'])
+
+        self.config.setdefault('ASYNC_MODE', 'native')
+        if self.config['ASYNC_MODE'] not in ('native', 'executor'):
+            raise ValueError("ASYNC_MODE must be 'native' or 'executor', got %r"
+                             % (self.config['ASYNC_MODE'],))
+
+        self.config.setdefault('LOGIN_TIMEOUT', 0)
+        self.config.setdefault('SEARCH_TIME_LIMIT', 10)
+        self.config.setdefault('BREAKER_THRESHOLD', 0)
+        self.config.setdefault('BREAKER_RESET_TIMEOUT', 30)
+        self._breaker = None
+        if self.config['BREAKER_THRESHOLD']:
+            self._breaker = CircuitBreaker(self.config['BREAKER_THRESHOLD'],
+                                           self.config['BREAKER_RESET_TIMEOUT'])
+
+        self.config.setdefault('COALESCE_LOGINS', False)
+        self.config.setdefault('COALESCE_TIMEOUT', self.config['LOGIN_TIMEOUT'] or 30)
+        self._flight = None
+        if self.config['COALESCE_LOGINS']:
+            self._flight = SingleFlight(self.config['COALESCE_TIMEOUT'])
+
+        self.config.setdefault('MAX_CONCURRENT_LOGINS', 0)
+        self.config.setdefault('LOGIN_QUEUE_SIZE', 100)
+        self.config.setdefault('LOGIN_QUEUE_TIMEOUT', 5)
+        self._admission = None
+        if self.config['MAX_CONCURRENT_LOGINS']:
+            self._admission = AdmissionControl(self.config['MAX_CONCURRENT_LOGINS'],
+                                               self.config['LOGIN_QUEUE_SIZE'],
+                                               self.config['LOGIN_QUEUE_TIMEOUT'])
+
+        self.config.setdefault('SAVE_USER_ON_CHANGE', False)
+        self.config.setdefault('SAVE_USER_MAX_AGE', 86400)
+        self.config.setdefault('SAVE_USER_CACHE_SIZE', 10000)
+        self.user_fingerprints = None
+        if self.config['SAVE_USER_ON_CHANGE']:
+            self.user_fingerprints = TTLCache(maxsize=self.config['SAVE_USER_CACHE_SIZE'],
+                                              ttl=self.config['SAVE_USER_MAX_AGE'])
+
+        self.config.setdefault('EXPORT_PAGE_SIZE', 500)
+        self.config.setdefault('EXPORT_BATCH_SIZE', 1000)
+        self.config.setdefault('LOOKUP_CHUNK_SIZE', 100)
+
+    def _make_pool(self, factory, size):
+        return ConnectionPool(factory,
+                              size=size,
+                              timeout=self.config['POOL_TIMEOUT'],
+                              idle_timeout=self.config['POOL_IDLE_TIMEOUT'],
+                              max_lifetime=self.config['POOL_MAX_LIFETIME'],
+                              check_interval=self.config['POOL_CHECK_INTERVAL'],
+                              validate=self._server_available,
+                              on_transport_error=self._server_failed)
+
+    def _server_available(self, conn):
+        return self._servers.available(connection_uri(conn))
+
+    def _server_failed(self, conn):
+        self._servers.record_failure(connection_uri(conn))
+
+    def _probe(self, uri):
+        'Bind to `uri` and return the bind latency, used by SERVER_PROBE_INTERVAL'
+        conn = self._initialize(uri)
+        try:
+            start = _clock()
+            if '%(' in self.config['BIND_DN']:
+                conn.simple_bind_s('', '')
+            else:
+                conn.simple_bind_s(self.config['BIND_DN'], self.config['BIND_AUTH'])
+            return _clock() - start
+        finally:
+            conn.unbind_s()
+
+    def server_stats(self):
+        '''
+        Return a list with the state of each server in SERVERS: whether it is
+        up, its consecutive failures and moving average bind latency in seconds.
+        '''
+        return self._servers.stats()
+
     def format_results(self, results):
         """
         Format the ldap results object into somthing that is reasonable
@@ -120,11 +547,86 @@ class LDAPLoginManager(object):
         userobj = results[0][1]
         userobj['dn'] = userdn
 
-        keymap = self.config.get('KEY_MAP')
-        if keymap:
-            return {key:scalar(userobj.get(value)) for key, value in keymap.items() if _is_utf8(scalar(userobj.get(value))) }
+        return self._plan.format_userdata(userobj)
+
+    def _format_login(self, conn, results):
+        '''
+        `format_results` for a login on `conn`, adding the groups of the user
+        under the GROUP_SEARCH 'key' if GROUP_SEARCH is set.
+        '''
+        userdata = self.format_results(results)
+        if userdata is not None and self._groups is not None:
+            dn, attrs = results[0]
+            key = self.config['GROUP_SEARCH'].get('key', 'groups')
+            with self._group_connection(conn) as (group_conn, bind_dn):
+                userdata[key] = self._resolve_groups(group_conn, dn, attrs, bind_dn)
+        return userdata
+
+    @contextmanager
+    def _group_connection(self, conn):
+        '''
+        Yield the connection resolving the groups of the user logged in on
+        `conn`, and the DN to bind it as first (None if it is bound already).
+        Groups are searched as BIND_DN, on a PERSISTENT_SEARCH connection or on
+        `conn` rebound, so they do not depend on what the user may read. Direct
+        binds have no service account and search as the user.
+        '''
+        if not self.config.get('USER_SEARCH') or '%(' in self.config['BIND_DN']:
+            yield conn, None
+        elif self._search_pool is not None:
+            deadline = connection_deadline(conn)
+            search_conn = self._search_pool.acquire(self._remaining(deadline))
+            with self._search_pool.checked_out(search_conn), \
+                    self._deadline(search_conn, deadline):
+                yield search_conn, None
         else:
-            return {key:scalar(value) for key, value in userobj.items() if _is_utf8(scalar(value)) }
+            yield conn, self.config['BIND_DN']
+
+    def _resolve_groups(self, conn, dn, attrs, bind_dn=None):
+        '''
+        Resolve the groups of the user `dn` on `conn`, bound as `bind_dn`
+        before the first group search only: groups served from the group cache
+        cost no bind. Each search gets the time left of the login (or
+        SEARCH_TIME_LIMIT) as its time limit.
+        '''
+        pending_bind = [bind_dn] if bind_dn is not None else []
+
+        def prepare():
+            if pending_bind:
+                self._service_bind(conn, pending_bind.pop())
+            return self._search_limits(conn)['timeout']
+
+        start = _clock()
+        groups = self._groups.resolve(conn, dn, attrs, prepare)
+        self._timing('groups', start, server=connection_uri(conn))
+        return groups
+
+    def search_stats(self):
+        '''
+        Return a list with the searches, hits and moving average latency
+        (in seconds) of each USER_SEARCH entry, in configuration order.
+        '''
+        return self._search_stats.stats()
+
+    def _search_order(self):
+        'Indexes of the USER_SEARCH entries in the order they should be tried'
+        if self.config['ADAPTIVE_SEARCH_ORDER']:
+            return self._search_stats.order()
+        return range(len(self._plan.searches))
+
+    def invalidate(self, username):
+        '''
+        Forget any cached login and recorded failures for `username`,
+        e.g. after a password change.
+        '''
+        if self.login_cache is not None:
+            self.login_cache.invalidate(username)
+        if self.dn_cache is not None:
+            self.dn_cache.delete(username)
+        if self._user_throttle is not None:
+            self._user_throttle.reset(username)
+        if self.user_fingerprints is not None:
+            self.user_fingerprints.delete(username)
 
     def save_user(self, callback):
         '''
@@ -137,6 +639,155 @@ class LDAPLoginManager(object):
         self._save_user = callback
         return callback
 
+    def save_users(self, callback):
+        '''
+        This sets the callback used by `sync_users` to save users in bulk.
+        The function you set should take a list of ``(username, userdata)`` pairs.
+
+        :param callback: The callback for saving a batch of users.
+        '''
+
+        self._save_users = callback
+        return callback
+
+    def load_user(self, callback):
+        '''
+        This sets the callback used with SAVE_USER_ON_CHANGE to get the user
+        object of a login whose userdata did not change since it was saved.
+        The function you set should take a username and return the user
+        object, or None to save the user again.
+
+        :param callback: The callback for loading a saved user object.
+        '''
+
+        self._load_user = callback
+        return callback
+
+    def store_user(self, username, userdata):
+        '''
+        Return the user object for a successful login from the `save_user`
+        callback. With SAVE_USER_ON_CHANGE and a `load_user` callback, a user
+        whose userdata has the same fingerprint as when it was last saved is
+        loaded instead of saved again.
+        '''
+        if self.user_fingerprints is None or self._load_user is None:
+            return self._save_user(username, userdata)
+
+        digest = fingerprint(userdata)
+        if self.user_fingerprints.get(username) == digest:
+            user = self._load_user(username)
+            if user is not None:
+                log.debug("Userdata of %s unchanged, loaded the saved user", username)
+                return user
+
+        user = self._save_user(username, userdata)
+        if user is not None:
+            self.user_fingerprints.set(username, digest)
+        else:
+            self.user_fingerprints.delete(username)
+        return user
+
+    def iter_users(self, page_size=None):
+        '''
+        Yield the userdata of every user matched by USER_SEARCH, with
+        %(username)s replaced by '*'. Entries are fetched EXPORT_PAGE_SIZE
+        (or `page_size`) at a time with the paged results control.
+        '''
+        for _, userdata in self._iter_users(page_size):
+            yield userdata
+
+    def sync_users(self, batch_size=None, page_size=None):
+        '''
+        Feed every user matched by USER_SEARCH to the `save_users` callback in
+        batches of EXPORT_BATCH_SIZE (or `batch_size`) users, or one at a time
+        to the `save_user` callback if `save_users` is not set.
+        Returns the number of users exported.
+        '''
+        if self._save_users is None and self._save_user is None:
+            raise ValueError("sync_users requires a save_users or save_user callback")
+        batch_size = batch_size or self.config['EXPORT_BATCH_SIZE']
+
+        count = 0
+        batch = []
+        for username, userdata in self._iter_users(page_size):
+            count += 1
+            if self._save_users is None:
+                self._save_user(username, userdata)
+                continue
+            batch.append((username, userdata))
+            if len(batch) >= batch_size:
+                self._save_users(batch)
+                batch = []
+        if batch:
+            self._save_users(batch)
+        return count
+
+    def _iter_users(self, page_size=None):
+        'Yield ``(username, userdata)`` for every user matched by USER_SEARCH'
+        page_size = page_size or self.config['EXPORT_PAGE_SIZE']
+        ctx = {'username': '*', 'password': ''}
+
+        with self._service_connection() as conn:
+            for search in self._plan.searches:
+                attr = username_attr(search.filter)
+                entries = paged_search(conn, search.base, search.scope, search.filter % ctx,
+                                       attrlist=self._bulk_attrlist(attr), page_size=page_size)
+                for dn, attrs in entries:
+                    yield entry_username(attrs, attr), self.format_results([(dn, attrs)])
+
+    def lookup_users(self, usernames, chunk_size=None):
+        '''
+        Look up many users at once. The USER_SEARCH filter of each username is
+        merged into ``(|...)`` filters of LOOKUP_CHUNK_SIZE (or `chunk_size`)
+        usernames, run on one connection bound as BIND_DN.
+
+        Returns a ``(found, misses)`` tuple: a dict of username to userdata
+        and the list of usernames that were not found.
+        '''
+        chunk_size = chunk_size or self.config['LOOKUP_CHUNK_SIZE']
+        remaining = list(usernames)
+        found = {}
+
+        with self._service_connection() as conn:
+            for index in self._search_order():
+                if not remaining:
+                    break
+                search = self._plan.searches[index]
+                attr = username_attr(search.filter)
+                attrlist = self._bulk_attrlist(attr)
+                wanted = dict((username.lower(), username) for username in remaining)
+                for start in range(0, len(remaining), chunk_size):
+                    filt = or_filter(search.filter, remaining[start:start + chunk_size])
+                    log.debug("Lookup base=%s filter=%s", search.base, filt)
+                    for dn, attrs in conn.search_s(search.base, search.scope, filt,
+                                                   attrlist=attrlist):
+                        if dn is None:
+                            continue
+                        value = entry_username(attrs, attr)
+                        username = wanted.get(value.lower()) if value is not None else None
+                        if username is not None and username not in found:
+                            found[username] = self.format_results([(dn, attrs)])
+                remaining = [username for username in remaining if username not in found]
+
+        return found, remaining
+
+    @contextmanager
+    def _service_connection(self):
+        'Check out a pooled connection bound as BIND_DN for bulk operations'
+        if not self._plan.searches:
+            raise ValueError("Bulk operations require USER_SEARCH")
+        if '%(' in self.config['BIND_DN']:
+            raise ValueError("Bulk operations require a BIND_DN without %(username)s")
+        with self._pool.connection() as conn:
+            self._service_bind(conn, self.config['BIND_DN'])
+            yield conn
+
+    def _bulk_attrlist(self, attr):
+        'The attrlist with the username attribute `attr` added'
+        if self._plan.attrlist is None:
+            return None
+        return self._plan.attrlist + [attribute_name(attr)]
+
     @property
     def config(self):
         'LDAP config vars'
@@ -144,133 +795,689 @@ class LDAPLoginManager(object):
 
     @property
     def attrlist(self):
-        'Transform the KEY_MAP paramiter into an attrlist for ldap filters'
-        keymap = self.config.get('KEY_MAP')
-        if keymap:
-            # https://github.com/ContinuumIO/flask-ldap-login/issues/11
-            # https://continuumsupport.zendesk.com/agent/tickets/393
-            return [s.encode('utf-8') for s in keymap.values()]
-        else:
-            return None
+        'The KEY_MAP paramiter as an attrlist for ldap filters'
+        return self._plan.attrlist
 
 
     def bind_search(self, username, password):
         """
         Bind to BIND_DN/BIND_AUTH then search for user to perform lookup.
         """
+        results = self._bind_search(self.conn, username, password)
+
+        self._unbind(self.conn)
+
+        return self.format_results(results)
+
+    def _bind_search(self, conn, username, password):
+        """
+        Perform the bind/search lookup on `conn` and return the raw search results.
+        The connection is left open and bound as the user.
+
+        With PERSISTENT_SEARCH the search runs on a connection from the search
+        pool that stays bound as BIND_DN, and `conn` is only used for the
+        user bind.
+        """
 
         log.debug("Performing bind/search")
 
         ctx = {'username':username, 'password':password}
 
+        cached = self._cached_dn(ctx)
+        if cached is not None:
+            results = self._bind_cached_dn(conn, ctx, *cached)
+            if results:
+                return results
+
+        if self._search_pool is not None:
+            deadline = connection_deadline(conn)
+            search_conn = self._search_pool.acquire(self._remaining(deadline))
+            with self._search_pool.checked_out(search_conn), \
+                    self._deadline(search_conn, deadline):
+                return self._search_user(search_conn, conn, ctx)
+
+        user = self._service_dn(ctx)
+        self._service_bind(conn, user)
+
+        return self._search_user(conn, conn, ctx, bind_dn=user)
+
+    def _service_dn(self, ctx):
+        'BIND_DN filled in for the login `ctx`'
         user = self.config['BIND_DN'] % ctx
+        log.debug("Binding with the BIND_DN %s", user)
+        return user
 
-        bind_auth = self.config['BIND_AUTH']
+    def _service_bind(self, conn, user):
+        '''
+        Bind `conn` as the service account `user` with BIND_AUTH.
+        Raises `ServiceBindFailed` if the directory rejects the credentials.
+        '''
         try:
-            log.debug("Binding with the BIND_DN %s" % user)
-            self.conn.simple_bind_s(user, bind_auth)
+            self._bind(conn, user, self.config['BIND_AUTH'], phase='service_bind')
         except ldap.INVALID_CREDENTIALS:
-            msg = "Could not connect bind with the BIND_DN=%s" % user
-            log.debug(msg)
-            if self._raise_errors:
-                raise ldap.INVALID_CREDENTIALS(msg)
-            return None
+            self._service_bind_failed(user)
 
-        user_search = self.config.get('USER_SEARCH')
+    def _service_bind_failed(self, user):
+        msg = "Could not bind with the BIND_DN=%s" % user
+        log.warning(msg)
+        raise ServiceBindFailed(msg, bind_dn=user)
+
+    def _search_user(self, search_conn, conn, ctx, bind_dn=None):
+        """
+        Run the USER_SEARCH searches on `search_conn` and bind the users found on `conn`.
+        If both are the same connection it is rebound as `bind_dn` after a failed user bind.
+        """
+        if self.config['PARALLEL_SEARCH']:
+            searches = self._search_parallel(search_conn, ctx)
+        else:
+            searches = self._search_sequential(search_conn, ctx)
 
         results = None
         found_user = False
-        for search in user_search:
-            base = search['base']
-            filt = search['filter'] % ctx
-            scope = search.get('scope', ldap.SCOPE_SUBTREE)
-            log.debug("Search for base=%s filter=%s" % (base, filt))
-            results = self.conn.search_s(base, scope, filt, attrlist=self.attrlist)
+        for index, results in searches:
             if results:
                 found_user = True
-                log.debug("User with DN=%s found" % results[0][0])
+                log.debug("User with DN=%s found", results[0][0])
                 try:
-                    self.conn.simple_bind_s(results[0][0], password)
+                    self._bind(conn, results[0][0], ctx['password'])
                 except ldap.INVALID_CREDENTIALS:
-                    self.conn.simple_bind_s(user, bind_auth)
+                    if conn is search_conn:
+                        self._service_bind(conn, bind_dn)
                     log.debug("Username/password mismatch, continue search...")
                     results = None
                     continue
                 else:
-                    log.debug("Username/password OK")
+                    self._user_found(ctx, index, results)
                     break
-        if not results and self._raise_errors:
+        if not results:
+            self._user_not_found(found_user, ctx.get('ambiguous', False))
+
+        return results
+
+    def _user_found(self, ctx, index, results):
+        'The user found by USER_SEARCH entry `index` bound, remember its DN'
+        log.debug("Username/password OK")
+        if self.dn_cache is not None:
+            self.dn_cache.set(ctx['username'], (results[0][0], index))
+
+    def _user_not_found(self, found_user, ambiguous=False):
+        '''
+        Count a login whose USER_SEARCH found no user (or no user with that
+        password if `found_user`, or only `ambiguous` matches), and raise if
+        errors are raised
+        '''
+        if ambiguous and not found_user:
+            self._count('ambiguous')
+            if self._raise_errors:
+                raise AmbiguousUser("Several entries match the USER_SEARCH filter")
+            return
+        self._count('bad_password' if found_user else 'not_found')
+        if self._raise_errors:
+            user_search = self.config.get('USER_SEARCH')
             msg = "No users found matching search criteria: {}".format(user_search)
             if found_user:
                 msg = "Username/password mismatch"
             raise ldap.INVALID_CREDENTIALS(msg)
 
+    def _search_sequential(self, conn, ctx):
+        '''
+        Run the USER_SEARCH searches one at a time, only as far as they are consumed.
+        Yields ``(index, results)`` pairs.
+        '''
+        for index in self._search_order():
+            request = self._search_request(ctx, index)
+            limits = self._search_limits(conn)
+            start = _clock()
+            try:
+                results = conn.search_ext_s(*request, attrlist=self._plan.attrlist, **limits)
+            except ldap.SIZELIMIT_EXCEEDED as err:
+                results = err
+            yield index, self._search_done(conn, ctx, index, results, start)
+
+    def _search_parallel(self, conn, ctx):
+        '''
+        Send all USER_SEARCH searches on `conn` before waiting for any of them
+        and return a list of ``(index, results)`` pairs in search order.
+        '''
+        order = list(self._search_order())
+        limits = self._search_limits(conn)
+        start = _clock()
+        msgids = [conn.search_ext(*self._search_request(ctx, index, send=True),
+                                  attrlist=self._plan.attrlist, **limits)
+                  for index in order]
+
+        # Collect everything before returning: binding on `conn` while
+        # searches are outstanding would abandon them.
+        all_results = []
+        try:
+            for index, msgid in zip(order, msgids):
+                try:
+                    _, results, _, _ = conn.result3(msgid, timeout=self._apply_deadline(conn))
+                except ldap.SIZELIMIT_EXCEEDED as err:
+                    results = err
+                all_results.append((index, self._search_done(conn, ctx, index, results, start)))
+        except ldap.LDAPError:
+            self._abandon(conn, msgids[len(all_results) + 1:])
+            raise
+        return all_results
+
+    def _search_request(self, ctx, index, send=False):
+        'The ``(base, scope, filterstr)`` arguments of the search of USER_SEARCH entry `index`'
+        search = self._plan.searches[index]
+        filt = search.filter % ctx
+        log.debug("%s for base=%s filter=%s", "Send search" if send else "Search",
+                  search.base, filt)
+        return search.base, search.scope, filt
+
+    def _abandon(self, conn, msgids):
+        'Abandon the searches `msgids` left outstanding by a failed parallel search'
+        for msgid in msgids:
+            conn.abandon(msgid)
+
+    def _cached_dn(self, ctx):
+        '''
+        The ``(dn, index)`` DN_CACHE_TTL remembers for the user logging in
+        with `ctx` and the USER_SEARCH entry that found it, None if there is none
+        '''
+        if self.dn_cache is None:
+            return None
+        cached = self.dn_cache.get(ctx['username'])
+        if cached is None:
+            return None
+        if cached[1] >= len(self._plan.searches):
+            return self._stale_dn(ctx, cached[0])
+        return cached
+
+    def _bind_cached_dn(self, conn, ctx, dn, index):
+        '''
+        Bind as the cached DN, then read its entry on the user-bound `conn`:
+        a returning user needs neither the service bind nor the USER_SEARCH
+        searches. Returns None if the bind fails, or if the entry cannot be read
+        back (gone, no longer matching the USER_SEARCH filter or not readable by
+        the user) in which case the DN is also dropped from the cache.
+        '''
+        try:
+            self._bind(conn, dn, ctx['password'])
+        except ldap.INVALID_CREDENTIALS:
+            log.debug("Username/password mismatch for cached DN, fall back to search...")
+            return None
+
+        limits = self._search_limits(conn)
+        start = _clock()
+        try:
+            results = conn.search_ext_s(*self._cached_dn_request(ctx, dn, index),
+                                        attrlist=self._plan.attrlist, **limits)
+        except UNREADABLE_ENTRY:
+            results = None
+        return self._cached_dn_read(conn, ctx, dn, index, results, start)
+
+    def _cached_dn_request(self, ctx, dn, index):
+        'The ``(base, scope, filterstr)`` arguments of the search reading the cached `dn` back'
+        filt = self._plan.searches[index].filter % ctx
+        log.debug("Read cached DN=%s filter=%s", dn, filt)
+        return dn, ldap.SCOPE_BASE, filt
+
+    def _cached_dn_read(self, conn, ctx, dn, index, results, start):
+        '''
+        Record the read of the cached `dn` on `conn` started at `start`, and
+        return its `results`, None if it is stale
+        '''
+        self._timing('search', start, server=connection_uri(conn),
+                     base=self._plan.searches[index].base)
+        if not results:
+            return self._stale_dn(ctx, dn)
+        return results
+
+    def _stale_dn(self, ctx, dn):
+        'Drop the cached `dn` of the user logging in with `ctx`, return None'
+        log.debug("Cached DN=%s is stale", dn)
+        self.dn_cache.delete(ctx['username'])
+        return None
+
+    def _search_limits(self, conn):
+        '''
+        Keyword arguments of `search_ext` limiting a USER_SEARCH search on
+        `conn` to USER_SIZELIMIT entries and SEARCH_TIME_LIMIT seconds, or the
+        time left before the login deadline
+        '''
+        remaining = self._apply_deadline(conn)
+        timeout = self.config['SEARCH_TIME_LIMIT'] or -1
+        if remaining != -1 and (timeout == -1 or remaining < timeout):
+            timeout = remaining
+        return {'timeout': timeout, 'sizelimit': USER_SIZELIMIT}
+
+    def _user_entries(self, ctx, index, results):
+        '''
+        The entries in the `results` of USER_SEARCH entry `index`, without
+        search references. Several entries are an ambiguous match.
+        '''
+        entries = [entry for entry in results or () if entry[0] is not None]
+        if len(entries) > 1:
+            return self._ambiguous(ctx, index)
+        return entries
+
+    def _ambiguous(self, ctx, index):
+        'Log that USER_SEARCH entry `index` matched several entries, return no entries'
+        search = self._plan.searches[index]
+        log.warning("USER_SEARCH base=%s filter=%s matched several entries, ignoring them",
+                    search.base, search.filter % ctx)
+        ctx['ambiguous'] = True
+        return []
+
+    def _bind(self, conn, who, cred, phase='user_bind'):
+        'simple_bind_s on `conn`, recording the bind latency of its server'
+        self._apply_deadline(conn)
+        start = _clock()
+        try:
+            conn.simple_bind_s(who, cred)
+        except ldap.INVALID_CREDENTIALS:
+            self._bind_done(conn, start, phase)
+            raise
+        self._bind_done(conn, start, phase)
+
+    def _bind_done(self, conn, start, phase='user_bind'):
+        uri = connection_uri(conn)
+        elapsed = _clock() - start
+        self._servers.record_success(uri, elapsed)
+        if self.metrics is not None:
+            self.metrics.timing(phase, elapsed, server=uri)
+
+    def _search_done(self, conn, ctx, index, results, start):
+        '''
+        Record the search of USER_SEARCH entry `index` on `conn` started at
+        `start` and return the user entries of its `results`, none if it
+        raised ldap.SIZELIMIT_EXCEEDED instead
+        '''
+        if isinstance(results, ldap.SIZELIMIT_EXCEEDED):
+            results = self._ambiguous(ctx, index)
+        else:
+            results = self._user_entries(ctx, index, results)
+        elapsed = _clock() - start
+        self._search_stats.record(index, bool(results), elapsed)
+        if self.metrics is not None:
+            self.metrics.timing('search', elapsed, server=connection_uri(conn),
+                                base=self._plan.searches[index].base)
+        return results
+
+    def _login_deadline(self):
+        'Return the deadline of a login starting now, None without LOGIN_TIMEOUT'
+        if not self.config['LOGIN_TIMEOUT']:
+            return None
+        return _clock() + self.config['LOGIN_TIMEOUT']
+
+    def _remaining(self, deadline):
+        'Seconds left before `deadline`, None if there is no deadline'
+        if deadline is None:
+            return None
+        return max(deadline - _clock(), 0)
+
+    @contextmanager
+    def _deadline(self, conn, deadline):
+        'Apply the login `deadline` to the operations on the pooled connection `conn`'
+        if deadline is None:
+            yield conn
+            return
+        conn.deadline = deadline
+        try:
+            yield conn
+        finally:
+            conn.deadline = None
+            options = dict(self._plan.options)
+            default = options.get(ldap.OPT_TIMEOUT, -1)
+            conn.set_option(ldap.OPT_TIMEOUT, default)
+            conn.conn.timeout = default
+            conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self._network_timeout(options))
+
+    def _apply_deadline(self, conn):
+        '''
+        Limit the next operations on `conn`, including (re)connecting it, to
+        the time left before its login deadline, raising ldap.TIMEOUT if it
+        passed. Returns the timeout (-1 for none) to pass to asynchronous
+        operations.
+        '''
+        deadline = connection_deadline(conn)
+        if deadline is None:
+            return -1
+        remaining = deadline - _clock()
+        if remaining <= 0:
+            raise ldap.TIMEOUT({'desc': "Login deadline exceeded"})
+        conn.set_option(ldap.OPT_TIMEOUT, remaining)
+        conn.conn.timeout = remaining
+        network_timeout = self._network_timeout(dict(self._plan.options))
+        if network_timeout < 0 or remaining < network_timeout:
+            conn.set_option(ldap.OPT_NETWORK_TIMEOUT, remaining)
+        return remaining
+
+    def _network_timeout(self, options):
+        '''
+        The OPT_NETWORK_TIMEOUT of new connections: the configured option,
+        else LOGIN_TIMEOUT, else -1 (none)
+        '''
+        if ldap.OPT_NETWORK_TIMEOUT in options:
+            return options[ldap.OPT_NETWORK_TIMEOUT]
+        return self.config['LOGIN_TIMEOUT'] or -1
+
+    def _unbind(self, conn):
         log.debug("Unbind")
-        self.conn.unbind_s()
+        start = _clock()
+        conn.unbind_s()
+        self._timing('unbind', start, server=connection_uri(conn))
 
-        return self.format_results(results)
+    def _timing(self, phase, start, **labels):
+        'Report the duration of `phase` started at `start` to METRICS'
+        if self.metrics is not None:
+            self.metrics.timing(phase, _clock() - start, **labels)
+
+    def _count(self, outcome):
+        'Count a login `outcome` in METRICS'
+        if self.metrics is not None:
+            self.metrics.count(outcome)
+
+    def initialize_search(self):
+        'Create a new ldap connection bound as BIND_DN for PERSISTENT_SEARCH'
+        conn = self.initialize()
+        log.debug("Binding search connection with the BIND_DN %s", self.config['BIND_DN'])
+        try:
+            self._service_bind(conn, self.config['BIND_DN'])
+        except ldap.LDAPError:
+            self._unbind(conn)
+            raise
+        return conn
 
 
     def direct_bind(self, username, password):
         """
         Bind to username/password directly
         """
-        log.debug("Performing direct bind")
+        results = self._direct_bind(self.conn, username, password)
+        if results is None:
+            return None
+        self._unbind(self.conn)
+        return self.format_results(results)
 
-        ctx = {'username':username, 'password':password}
-        scope = self.config.get('SCOPE', ldap.SCOPE_SUBTREE)
-        user = self.config['BIND_DN'] % ctx
+    def _direct_bind(self, conn, username, password):
+        """
+        Perform the direct bind lookup on `conn` and return the raw search results.
+        """
+        log.debug("Performing direct bind")
 
+        user = self._service_dn({'username':username, 'password':password})
         try:
-            log.debug("Binding with the BIND_DN %s" % user)
-            self.conn.simple_bind_s(user, password)
+            self._bind(conn, user, password)
         except ldap.INVALID_CREDENTIALS:
-            if self._raise_errors:
-                raise ldap.INVALID_CREDENTIALS("Unable to do a direct bind with BIND_DN %s" % user)
-            return None
-        results = self.conn.search_s(user, scope, attrlist=self.attrlist)
-        self.conn.unbind_s()
-        return self.format_results(results)
+            return self._direct_bind_failed(user)
+        self._apply_deadline(conn)
+        start = _clock()
+        results = conn.search_s(user, self._plan.scope, attrlist=self._plan.attrlist)
+        self._timing('search', start, server=connection_uri(conn))
+        return results
+
+    def _direct_bind_failed(self, user):
+        self._count('bad_password')
+        if self._raise_errors:
+            raise ldap.INVALID_CREDENTIALS("Unable to do a direct bind with BIND_DN %s" % user)
+        return None
 
 
     def connect(self):
-        'initialize ldap connection and set options'
-        log.debug("Connecting to ldap server %s" % self.config['URI'])
-        self.conn = ldap.initialize(self.config['URI'])
-
-        # There are some settings that can't be changed at runtime without a context restart.
-        # It's possible to refresh the context and apply the settings by setting OPT_X_TLS_NEWCTX
-        # to 0, but this needs to be the last option set, and since the config dictionary is not
-        # sorted, this is not necessarily true. Sort the list of options so that if OPT_X_TLS_NEWCTX
-        # is present, it is applied last.
-        options = self.config.get('OPTIONS', {}).items()
-        options.sort(key=lambda x: x[0] == 'OPT_X_TLS_NEWCTX')
-
-        for opt, value in options:
-            if isinstance(opt, str):
-                opt = getattr(ldap, opt)
+        'initialize ldap connection and set options on `self.conn`'
+        self.conn = self.initialize()
+        return self.conn
 
-            try:
-                if isinstance(value, str):
-                    value = getattr(ldap, value)
-            except AttributeError:
-                pass
-            self.conn.set_option(opt, value)
+    def initialize(self, uri=None):
+        '''
+        Create a new ldap connection and set options.
+        By default the connection goes to the best available server in SERVERS.
+        '''
+        if uri is None:
+            uri = self._servers.select()
+        try:
+            return self._initialize(uri)
+        except TRANSPORT_ERRORS:
+            self._servers.record_failure(uri)
+            raise
+
+    def _initialize(self, uri):
+        log.debug("Connecting to ldap server %s", uri)
+        start = _clock()
+        conn = ldap.initialize(uri)
+        if self._recorder is not None:
+            conn = self._recorder.connection(conn, uri, start)
+
+        # Options were resolved and sorted by compile_options
+        for opt, value in self._plan.options:
+            conn.set_option(opt, value)
+        # Caps connecting outside of a login, _apply_deadline lowers it to
+        # the time left of the login
+        if self.config['LOGIN_TIMEOUT'] and ldap.OPT_NETWORK_TIMEOUT not in dict(self._plan.options):
+            conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.config['LOGIN_TIMEOUT'])
+        self._timing('connect', start, server=uri)
 
         if self.config.get('START_TLS'):
             log.debug("Starting TLS")
-            self.conn.start_tls_s()
+            start = _clock()
+            conn.start_tls_s()
+            self._timing('start_tls', start, server=uri)
 
-    def ldap_login(self, username, password):
+        return conn
+
+    def ldap_login(self, username, password, source=None):
         """
         Authenticate a user using ldap. This will return a userdata dict
         if successfull.
         ldap_login will return None if the user does not exist or if the credentials are invalid
+
+        A connection is checked out of the connection pool for the duration
+        of the login so concurrent logins never share a connection.
+        Successful logins are served from the login cache if LOGIN_CACHE_TTL is set.
+
+        :param source: optional identifier of the client (e.g. its address)
+            used for THROTTLE_SOURCE_THRESHOLD
+        :raises LoginThrottled: if too many logins failed for this username or source
+        :raises DirectoryUnavailable: if the circuit breaker is open
+        :raises DirectoryBusy: if MAX_CONCURRENT_LOGINS logins are already
+            contacting the directory and this one could not wait for its turn
         """
-        self.connect()
+        start = _clock()
+        try:
+            password_hash, cached, userdata = self._check_login(username, password, source)
+            if cached:
+                return userdata
+
+            try:
+                userdata = self._coalesced_login(username, password)
+            except ldap.LDAPError as err:
+                self._login_error(err, username, password_hash, source)
+                raise
+            self._directory_done(True)
+
+            return self._login_done(username, password_hash, source, userdata)
+        finally:
+            self._timing('login', start)
 
-        if self.config.get('USER_SEARCH'):
-            result = self.bind_search(username, password)
+    def ldap_login_async(self, username, password, source=None):
+        """
+        Coroutine version of `ldap_login` returning the same userdata (Python 3 only)::
+
+            userdata = await ldap_mgr.ldap_login_async(username, password)
+
+        See `flask_ldap_login.aio` for details.
+        """
+        from .aio import ldap_login
+        return ldap_login(self, username, password, source)
+
+    def _ldap_login(self, username, password):
+        '''
+        Perform the login against the directory. If a server fails the login
+        is retried on the next one, up to once per server in SERVERS, within
+        LOGIN_TIMEOUT.
+        '''
+        deadline = self._login_deadline()
+        for attempt in range(len(self._servers)):
+            try:
+                with self._pool.connection(self._remaining(deadline)) as conn, \
+                        self._deadline(conn, deadline):
+                    if self.config.get('USER_SEARCH'):
+                        results = self._bind_search(conn, username, password)
+                    else:
+                        results = self._direct_bind(conn, username, password)
+                    userdata = self._format_login(conn, results)
+            except TRANSPORT_ERRORS:
+                if not self._retry(attempt, deadline):
+                    raise
+            else:
+                return userdata
+
+    def _retry(self, attempt, deadline):
+        '''
+        Whether to retry a login whose `attempt` failed on a transport error
+        on the next server: once per server in SERVERS, before the `deadline`
+        '''
+        if attempt + 1 == len(self._servers) or self._remaining(deadline) == 0:
+            return False
+        log.debug("LDAP server failed, retrying login on another server")
+        return True
+
+    def _coalesced_login(self, username, password):
+        '''
+        `_ldap_login`, shared with the concurrent logins with the same
+        username and password if COALESCE_LOGINS is set.
+        '''
+        if self._flight is None:
+            return self._admitted_login(username, password)
+        return self._flight.do(self._flight.key(username, password),
+                               self._admitted_login, username, password)
+
+    def _admitted_login(self, username, password):
+        '`_ldap_login` once admitted within MAX_CONCURRENT_LOGINS'
+        if self._admission is None:
+            return self._ldap_login(username, password)
+        start = _clock()
+        self._admission.acquire()
+        self._timing('queue', start)
+        try:
+            return self._ldap_login(username, password)
+        finally:
+            self._admission.release()
+
+    def admission_stats(self):
+        '''
+        Return the number of logins in flight and queued, the admission
+        counters and wait times, None without MAX_CONCURRENT_LOGINS
+        '''
+        if self._admission is None:
+            return None
+        return self._admission.stats()
+
+    def coalesce_stats(self):
+        'Return the login coalescing statistics, None without COALESCE_LOGINS'
+        if self._flight is None:
+            return None
+        return self._flight.stats()
+
+    def _check_directory(self):
+        'Raise `DirectoryUnavailable` if the circuit breaker is open'
+        if self._breaker is not None and not self._breaker.allow():
+            self._count('unavailable')
+            raise DirectoryUnavailable("The LDAP directory is unavailable")
+
+    def _directory_done(self, answered):
+        'Report to the circuit breaker whether the directory `answered` a login'
+        if self._breaker is not None:
+            if answered:
+                self._breaker.record_success()
+            else:
+                self._breaker.record_failure()
+
+    def breaker_stats(self):
+        'Return the state of the circuit breaker, None without BREAKER_THRESHOLD'
+        if self._breaker is None:
+            return None
+        return self._breaker.stats()
+
+    def _check_login(self, username, password, source):
+        '''
+        Record the login with RECORD_PATH, apply throttling, the login caches
+        and the circuit breaker before contacting the directory.
+        Returns a ``(password_hash, cached, userdata)`` tuple where `cached` is
+        True if the result of the login is already known.
+        '''
+        if self._recorder is not None:
+            self._recorder.login(username)
+        password_hash, cached, userdata = self._check_caches(username, password, source)
+        if not cached:
+            self._check_directory()
+        return password_hash, cached, userdata
+
+    def _check_caches(self, username, password, source):
+        'Throttling and the login caches of `_check_login`'
+        if self._user_throttle is not None and self._user_throttle.blocked(username):
+            self._count('throttled')
+            raise LoginThrottled("Too many failed logins for this user", username=username)
+        if (self._source_throttle is not None and source is not None and
+                self._source_throttle.blocked(source)):
+            self._count('throttled')
+            raise LoginThrottled("Too many failed logins from this source", source=source)
+
+        if self.login_cache is None and self.failure_cache is None:
+            return None, False, None
+        password_hash = self._hasher(username, password)
+
+        if self.login_cache is not None:
+            userdata = self.login_cache.get(username, password_hash)
+            if userdata is not None:
+                log.debug("Login cache hit for %s", username)
+                self._count('cached')
+                return password_hash, True, userdata
+
+        if self.failure_cache is not None and self.failure_cache.get((username, password_hash)):
+            log.debug("Failure cache hit for %s", username)
+            self._count('cached')
+            if self._raise_errors:
+                raise ldap.INVALID_CREDENTIALS("Username/password recently failed")
+            return password_hash, True, None
+
+        return password_hash, False, None
+
+    def _login_error(self, err, username, password_hash, source):
+        'Book-keeping for a login whose directory part raised `err`'
+        if isinstance(err, DirectoryBusy):
+            self._count('rejected')
+        elif isinstance(err, PoolExhausted):
+            self._count('server_error')
+        elif isinstance(err, TRANSPORT_ERRORS):
+            self._directory_done(False)
+            self._count('server_error')
+        elif isinstance(err, ServiceBindFailed):
+            # The directory answered, but the service account is broken:
+            # the user's credentials were never checked
+            self._directory_done(True)
+            self._count('server_error')
+        elif isinstance(err, ldap.INVALID_CREDENTIALS):
+            self._directory_done(True)
+            self._login_failed(username, password_hash, source)
         else:
-            result = self.direct_bind(username, password)
-        return result
+            self._directory_done(True)
+            self._count('server_error')
+
+    def _login_failed(self, username, password_hash, source):
+        'Book-keeping for a failed login'
+        if self.failure_cache is not None:
+            self.failure_cache.set((username, password_hash), True)
+        if self._user_throttle is not None:
+            self._user_throttle.record(username)
+        if self._source_throttle is not None and source is not None:
+            self._source_throttle.record(source)
+
+    def _login_done(self, username, password_hash, source, userdata):
+        'Book-keeping after a login returned, `userdata` is None if it failed'
+        if userdata is None:
+            self._login_failed(username, password_hash, source)
+            return None
+
+        self._count('success')
+        if self._user_throttle is not None:
+            self._user_throttle.reset(username)
+        if self.login_cache is not None:
+            self.login_cache.set(username, password_hash, userdata)
+        return userdata
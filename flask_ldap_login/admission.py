@@ -0,0 +1,177 @@
+"""
+Admission control of logins contacting the directory (MAX_CONCURRENT_LOGINS).
+
+At most `limit` logins talk to the directory at once. The others wait in a
+bounded queue for a free slot and are rejected with `DirectoryBusy` when the
+queue is full or they waited too long, so an overload is turned away early
+instead of slowing every login down.
+"""
+from collections import deque
+import threading
+import time
+
+from .errors import DirectoryBusy
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class Waiter(object):
+    '''
+    A login queued for a slot. `release` hands the slot over directly (the
+    slot stays in flight) and calls `wake()`, or notifies the threads
+    blocked in `acquire` if `wake` is None.
+    '''
+
+    __slots__ = ('wake', 'start', 'granted', 'waited')
+
+    def __init__(self, wake=None):
+        self.wake = wake
+        self.start = _clock()
+        self.granted = False
+        self.waited = None
+
+
+class AdmissionControl(object):
+    '''
+    Bounded concurrency with a bounded FIFO wait queue.
+
+    Threads wait for a slot in `acquire`. Event loops, which must not block,
+    `enqueue` a callback woken by `release` and `expire` their waiter when
+    they stop waiting, see `flask_ldap_login.aio`.
+
+    :param limit: maximum number of admitted logins
+    :param queue_size: maximum number of logins waiting for a slot
+    :param timeout: seconds a login waits for a slot before it is rejected
+    '''
+
+    def __init__(self, limit, queue_size=0, timeout=5):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self.max_queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self._waiters = deque()
+        self._cond = threading.Condition(threading.Lock())
+
+    @property
+    def queued(self):
+        'Number of logins waiting for a slot'
+        return len(self._waiters)
+
+    def try_acquire(self):
+        'Take a slot if one is free right away, return whether it was taken'
+        with self._cond:
+            return self._try_acquire()
+
+    def _try_acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        return False
+
+    def _enqueue(self, wake):
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            raise DirectoryBusy("Too many logins in progress",
+                                in_flight=self.in_flight, queued=self.queued)
+        waiter = Waiter(wake)
+        self._waiters.append(waiter)
+        self.max_queued = max(self.max_queued, len(self._waiters))
+        return waiter
+
+    def acquire(self):
+        '''
+        Take a slot, waiting in the queue if none is free.
+        Returns the seconds waited.
+
+        :raises DirectoryBusy: if the queue is full or no slot was freed within `timeout`
+        '''
+        with self._cond:
+            if self._try_acquire():
+                return 0.0
+            waiter = self._enqueue(None)
+            deadline = waiter.start + self.timeout
+            while not waiter.granted:
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    self._expire(waiter)
+                    break
+                self._cond.wait(remaining)
+            return waiter.waited
+
+    def enqueue(self, wake):
+        '''
+        Take a slot without blocking: returns None if one was free, else the
+        queued `Waiter` whose `wake()` is called by the releasing thread once
+        a slot was handed to it. The caller must `expire` or `cancel` the
+        waiter if it stops waiting before that.
+
+        :raises DirectoryBusy: if the queue is full
+        '''
+        with self._cond:
+            if self._try_acquire():
+                return None
+            return self._enqueue(wake)
+
+    def expire(self, waiter):
+        '''
+        Reject `waiter` whose wait timed out, unless a slot was handed to it
+        in the meantime which the caller then owns.
+
+        :raises DirectoryBusy: if the waiter was still queued
+        '''
+        with self._cond:
+            self._expire(waiter)
+
+    def _expire(self, waiter):
+        if waiter.granted:
+            return
+        self._waiters.remove(waiter)
+        self.rejected += 1
+        self.timeouts += 1
+        raise DirectoryBusy("Timed out waiting for a login slot",
+                            in_flight=self.in_flight, queued=self.queued)
+
+    def cancel(self, waiter):
+        '''
+        Remove `waiter` from the queue. Returns False if a slot was handed to
+        it already, which the caller then owns.
+        '''
+        with self._cond:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            return True
+
+    def release(self):
+        'Give back a slot taken by `acquire` or `try_acquire`, handing it to the first waiter'
+        with self._cond:
+            if not self._waiters:
+                self.in_flight -= 1
+                return
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            waiter.waited = _clock() - waiter.start
+            self.admitted += 1
+            self.wait_time += waiter.waited
+            self.max_wait = max(self.max_wait, waiter.waited)
+            if waiter.wake is None:
+                self._cond.notify_all()
+                return
+        waiter.wake()
+
+    def stats(self):
+        'Return a dict with the current and maximum queue depth, counters and wait times'
+        with self._cond:
+            return {'limit': self.limit, 'in_flight': self.in_flight,
+                    'queued': self.queued, 'max_queued': self.max_queued,
+                    'admitted': self.admitted, 'rejected': self.rejected,
+                    'timeouts': self.timeouts,
+                    'avg_wait': self.wait_time / self.admitted if self.admitted else 0.0,
+                    'max_wait': self.max_wait}
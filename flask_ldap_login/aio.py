@@ -0,0 +1,438 @@
+"""
+Asyncio versions of the `LDAPLoginManager` login paths.
+
+This module requires Python 3. Use it through
+`LDAPLoginManager.ldap_login_async`::
+
+    userdata = await ldap_mgr.ldap_login_async(username, password)
+
+With ASYNC_MODE ``'native'`` (the default) binds and searches are sent with
+python-ldap's message-id based operations (`simple_bind`, `search_ext`) and
+their results read with `result3` when the connection's socket becomes
+readable, so the event loop is never blocked on the network. Only checking
+a connection out of the pool, which may need to connect, and resolving
+groups run in the default executor. A cancelled login gives back the
+connection checked out for it, after its group lookup if one is running.
+With ASYNC_MODE ``'executor'`` the synchronous `ldap_login` runs in the
+executor instead.
+
+The login algorithm itself is the one of `LDAPLoginManager`: the coroutines
+below only perform the network operations between the manager's steps.
+Both modes return exactly what `ldap_login` returns.
+"""
+import asyncio
+from functools import partial
+import logging
+import time
+
+import ldap
+
+from . import UNREADABLE_ENTRY
+from .pool import TRANSPORT_ERRORS, connection_deadline
+from .servers import connection_uri
+
+log = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
+#: Initial and maximum delay between two `result3` polls of a connection
+#: without a file descriptor. Connections with one are also polled after
+#: POLL_MAX_DELAY without becoming readable, as libldap may have buffered
+#: the response already.
+POLL_MIN_DELAY = 0.0005
+POLL_MAX_DELAY = 0.05
+
+
+def _add_reader(loop, conn, callback):
+    '''
+    Call `callback` whenever the socket of `conn` is readable. Returns its
+    file descriptor, None if `conn` has none (e.g. a stand-in directory) or
+    the loop cannot watch it (e.g. the Windows proactor loop).
+    '''
+    try:
+        fd = conn.fileno()
+        loop.add_reader(fd, callback)
+    except (AttributeError, NotImplementedError, TypeError, ValueError, ldap.LDAPError):
+        return None
+    return fd
+
+
+async def result(conn, msgid):
+    '''
+    Wait for all results of the operation `msgid` without blocking the event
+    loop: `result3` is called whenever the connection becomes readable, or
+    polled with increasing delays if its socket cannot be watched. The
+    operation is abandoned if the login deadline of `conn` passes.
+    '''
+    deadline = connection_deadline(conn)
+    loop = asyncio.get_event_loop()
+    readable = asyncio.Event()
+    fd = None
+    watching = False
+    delay = POLL_MIN_DELAY
+    try:
+        while True:
+            readable.clear()
+            rtype, rdata, _, _ = conn.result3(msgid, all=1, timeout=0)
+            if rtype is not None:
+                return rtype, rdata
+            if not watching:
+                # The operation was sent, so the connection has its socket
+                fd = _add_reader(loop, conn, readable.set)
+                watching = True
+            wait = POLL_MAX_DELAY if fd is not None else delay
+            if deadline is not None:
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    conn.abandon(msgid)
+                    raise ldap.TIMEOUT({'desc': "Login deadline exceeded"})
+                wait = min(wait, remaining)
+            try:
+                await asyncio.wait_for(readable.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, POLL_MAX_DELAY)
+    finally:
+        if fd is not None:
+            loop.remove_reader(fd)
+
+
+async def simple_bind(conn, who, cred):
+    'Asynchronous `simple_bind_s`'
+    await result(conn, conn.simple_bind(who, cred))
+
+
+async def bind(manager, conn, who, cred, phase='user_bind'):
+    'Asynchronous `LDAPLoginManager._bind`'
+    start = _clock()
+    try:
+        await simple_bind(conn, who, cred)
+    except ldap.INVALID_CREDENTIALS:
+        manager._bind_done(conn, start, phase)
+        raise
+    manager._bind_done(conn, start, phase)
+
+
+async def service_bind(manager, conn, user):
+    'Asynchronous `LDAPLoginManager._service_bind`'
+    try:
+        await bind(manager, conn, user, manager.config['BIND_AUTH'], phase='service_bind')
+    except ldap.INVALID_CREDENTIALS:
+        manager._service_bind_failed(user)
+
+
+async def search(conn, base, scope, filterstr='(objectClass=*)', attrlist=None, **kwargs):
+    'Asynchronous `search_ext_s`, or `search_s` without `kwargs`'
+    _, rdata = await result(conn, conn.search_ext(base, scope, filterstr, attrlist=attrlist,
+                                                  **kwargs))
+    return rdata
+
+
+async def ldap_login(manager, username, password, source=None):
+    'Coroutine version of `LDAPLoginManager.ldap_login`'
+    start = _clock()
+    try:
+        password_hash, cached, userdata = manager._check_login(username, password, source)
+        if cached:
+            return userdata
+
+        try:
+            userdata = await _coalesced_login(manager, username, password)
+        except ldap.LDAPError as err:
+            manager._login_error(err, username, password_hash, source)
+            raise
+        manager._directory_done(True)
+
+        return manager._login_done(username, password_hash, source, userdata)
+    finally:
+        manager._timing('login', start)
+
+
+async def _login(manager, username, password):
+    'Log in natively or in the executor according to ASYNC_MODE'
+    if manager.config['ASYNC_MODE'] == 'executor':
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, manager._admitted_login, username, password)
+
+    admission = manager._admission
+    if admission is None:
+        return await _ldap_login(manager, username, password)
+    start = _clock()
+    await _admit(admission)
+    manager._timing('queue', start)
+    try:
+        return await _ldap_login(manager, username, password)
+    finally:
+        admission.release()
+
+
+async def _admit(admission):
+    '''
+    Take a slot of `admission`, waiting on the event loop: the releasing
+    thread wakes the waiter through `call_soon_threadsafe`, so queued logins
+    hold no executor thread while the admitted ones need them.
+    '''
+    loop = asyncio.get_event_loop()
+    admitted = loop.create_future()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(_set_admitted, admitted)
+        except RuntimeError:
+            # The loop is closed, nobody will use the slot
+            admission.release()
+
+    waiter = admission.enqueue(wake)
+    if waiter is None:
+        return
+    try:
+        await asyncio.wait_for(admitted, admission.timeout)
+    except asyncio.TimeoutError:
+        # Raises DirectoryBusy unless the slot was handed over meanwhile
+        admission.expire(waiter)
+    except asyncio.CancelledError:
+        if not admission.cancel(waiter):
+            admission.release()
+        raise
+
+
+def _set_admitted(future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def _coalesced_login(manager, username, password):
+    '''
+    Asynchronous `LDAPLoginManager._coalesced_login`: concurrent logins with
+    the same credentials in one event loop await the first one's future.
+    '''
+    flight = manager._flight
+    if flight is None:
+        return await _login(manager, username, password)
+
+    loop = asyncio.get_event_loop()
+    key = loop, flight.key(username, password)
+    future = flight.futures.get(key)
+    if future is not None:
+        flight.coalesced += 1
+        try:
+            value = await asyncio.wait_for(asyncio.shield(future), flight.timeout)
+        except asyncio.TimeoutError:
+            flight.timed_out()
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise
+            # The first login was cancelled, not this one
+        except Exception as err:
+            flight.share(None, err)
+        else:
+            return flight.share(value)
+        return await _login(manager, username, password)
+
+    future = flight.futures[key] = loop.create_future()
+    try:
+        value = await _login(manager, username, password)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except BaseException as err:
+        future.set_exception(err)
+        # Mark the exception as retrieved in case there are no followers
+        future.exception()
+        raise
+    else:
+        future.set_result(value)
+        return value
+    finally:
+        del flight.futures[key]
+
+
+async def _ldap_login(manager, username, password):
+    'Asynchronous `LDAPLoginManager._ldap_login`'
+    loop = asyncio.get_event_loop()
+    pool = manager._pool
+    deadline = manager._login_deadline()
+    for attempt in range(len(manager._servers)):
+        try:
+            conn = await _acquire(pool, manager._remaining(deadline))
+            with pool.checked_out(conn), manager._deadline(conn, deadline):
+                if manager.config.get('USER_SEARCH'):
+                    results = await bind_search(manager, conn, username, password)
+                else:
+                    results = await direct_bind(manager, conn, username, password)
+                if manager._groups is not None:
+                    # Group resolution is synchronous, mostly served from the group cache
+                    userdata = await _finish(loop.run_in_executor(
+                        None, manager._format_login, conn, results))
+                else:
+                    userdata = manager.format_results(results)
+        except TRANSPORT_ERRORS:
+            if not manager._retry(attempt, deadline):
+                raise
+        else:
+            return userdata
+
+
+async def _acquire(pool, timeout):
+    '''
+    `pool.acquire` in the executor. If the awaiting login is cancelled the
+    executor still checks a connection out: it is given back to the pool
+    once acquired instead of leaking a pool slot.
+    '''
+    future = asyncio.get_event_loop().run_in_executor(None, pool.acquire, timeout)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        future.add_done_callback(partial(_release_acquired, pool))
+        raise
+
+
+def _release_acquired(pool, future):
+    if not future.cancelled() and future.exception() is None:
+        pool.release(future.result())
+
+
+async def _finish(future):
+    '''
+    Await the executor `future`. If the awaiting login is cancelled the
+    call keeps running in its thread, so the cancellation only propagates
+    once it finished and no longer uses the login's connection.
+    '''
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        while not future.done():
+            try:
+                await asyncio.wait([future])
+            except asyncio.CancelledError:
+                pass
+        raise
+
+
+async def bind_search(manager, conn, username, password):
+    'Asynchronous `LDAPLoginManager._bind_search`'
+    log.debug("Performing async bind/search")
+
+    ctx = {'username':username, 'password':password}
+
+    cached = manager._cached_dn(ctx)
+    if cached is not None:
+        results = await _bind_cached_dn(manager, conn, ctx, *cached)
+        if results:
+            return results
+
+    if manager._search_pool is not None:
+        pool = manager._search_pool
+        deadline = connection_deadline(conn)
+        search_conn = await _acquire(pool, manager._remaining(deadline))
+        with pool.checked_out(search_conn), manager._deadline(search_conn, deadline):
+            return await _search_user(manager, search_conn, conn, ctx)
+
+    user = manager._service_dn(ctx)
+    await service_bind(manager, conn, user)
+
+    return await _search_user(manager, conn, conn, ctx, bind_dn=user)
+
+
+async def _search_user(manager, search_conn, conn, ctx, bind_dn=None):
+    'Asynchronous `LDAPLoginManager._search_user`'
+    order = list(manager._search_order())
+    parallel_results = None
+    if manager.config['PARALLEL_SEARCH']:
+        parallel_results = await _search_parallel(manager, search_conn, ctx, order)
+
+    results = None
+    found_user = False
+    for position, index in enumerate(order):
+        if parallel_results is not None:
+            results = parallel_results[position]
+        else:
+            results = await _search_entry(manager, search_conn, ctx, index)
+        if results:
+            found_user = True
+            log.debug("User with DN=%s found", results[0][0])
+            try:
+                await bind(manager, conn, results[0][0], ctx['password'])
+            except ldap.INVALID_CREDENTIALS:
+                if conn is search_conn:
+                    await service_bind(manager, conn, bind_dn)
+                log.debug("Username/password mismatch, continue search...")
+                results = None
+                continue
+            else:
+                manager._user_found(ctx, index, results)
+                break
+    if not results:
+        manager._user_not_found(found_user, ctx.get('ambiguous', False))
+
+    return results
+
+
+async def _search_entry(manager, conn, ctx, index):
+    'Run the search of USER_SEARCH entry `index`'
+    request = manager._search_request(ctx, index)
+    limits = manager._search_limits(conn)
+    start = _clock()
+    try:
+        results = await search(conn, *request, attrlist=manager._plan.attrlist, **limits)
+    except ldap.SIZELIMIT_EXCEEDED as err:
+        results = err
+    return manager._search_done(conn, ctx, index, results, start)
+
+
+async def _search_parallel(manager, conn, ctx, order):
+    '''
+    Asynchronous `LDAPLoginManager._search_parallel` for the entries in `order`,
+    returns the list of their results.
+    '''
+    limits = manager._search_limits(conn)
+    start = _clock()
+    msgids = [conn.search_ext(*manager._search_request(ctx, index, send=True),
+                              attrlist=manager._plan.attrlist, **limits)
+              for index in order]
+
+    all_results = []
+    try:
+        for index, msgid in zip(order, msgids):
+            try:
+                _, results = await result(conn, msgid)
+            except ldap.SIZELIMIT_EXCEEDED as err:
+                results = err
+            all_results.append(manager._search_done(conn, ctx, index, results, start))
+    except ldap.LDAPError:
+        manager._abandon(conn, msgids[len(all_results) + 1:])
+        raise
+    return all_results
+
+
+async def _bind_cached_dn(manager, conn, ctx, dn, index):
+    'Asynchronous `LDAPLoginManager._bind_cached_dn`'
+    try:
+        await bind(manager, conn, dn, ctx['password'])
+    except ldap.INVALID_CREDENTIALS:
+        log.debug("Username/password mismatch for cached DN, fall back to search...")
+        return None
+
+    limits = manager._search_limits(conn)
+    start = _clock()
+    try:
+        results = await search(conn, *manager._cached_dn_request(ctx, dn, index),
+                               attrlist=manager._plan.attrlist, **limits)
+    except UNREADABLE_ENTRY:
+        results = None
+    return manager._cached_dn_read(conn, ctx, dn, index, results, start)
+
+
+async def direct_bind(manager, conn, username, password):
+    'Asynchronous `LDAPLoginManager._direct_bind`'
+    log.debug("Performing async direct bind")
+
+    user = manager._service_dn({'username':username, 'password':password})
+    try:
+        await bind(manager, conn, user, password)
+    except ldap.INVALID_CREDENTIALS:
+        return manager._direct_bind_failed(user)
+    start = _clock()
+    results = await search(conn, user, manager._plan.scope, attrlist=manager._plan.attrlist)
+    manager._timing('search', start, server=connection_uri(conn))
+    return results
@@ -0,0 +1,206 @@
+"""
+Lazy, typed decoding of ldap entries into userdata (LAZY_USERDATA).
+
+`LazyUserData` keeps the raw entry returned by the server and only decodes an
+attribute when it is first accessed, with the codec configured for it in
+ATTRIBUTE_CODECS. Binary attributes listed in BINARY_ATTRIBUTES are left out
+unless KEY_MAP asks for them explicitly.
+
+`LazyUserData` is a mapping but not a dict: use ``userdata.to_dict()`` where
+a real dict is needed, e.g. for `json.dumps` or ``isinstance(userdata, dict)``
+checks in a `save_user` callback.
+"""
+try:
+    from collections.abc import MutableMapping
+except ImportError:  # Python 2
+    from collections import MutableMapping
+from datetime import datetime, timedelta
+import struct
+import uuid
+
+from .plan import scalar
+
+#: Attributes skipped by default when no KEY_MAP is set
+BINARY_ATTRIBUTES = ('jpegPhoto', 'thumbnailPhoto', 'photo', 'audio',
+                     'userCertificate', 'cACertificate', 'userSMIMECertificate',
+                     'userPKCS12', 'objectGUID', 'objectSid', 'msExchMailboxSecurityDescriptor',
+                     'nTSecurityDescriptor')
+
+
+def _values(value):
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def decode_default(value):
+    'Like format_results: single values are unwrapped, values are left as returned'
+    return scalar(value)
+
+
+def decode_str(value):
+    'utf-8 strings'
+    return scalar([_text(v) for v in _values(value)])
+
+
+def decode_int(value):
+    'Integers'
+    return scalar([int(v) for v in _values(value)])
+
+
+def decode_bytes(value):
+    'Raw bytes'
+    return scalar(list(_values(value)))
+
+
+def decode_guid(value):
+    'Active Directory objectGUID into its string form'
+    return scalar([str(uuid.UUID(bytes_le=v)) for v in _values(value)])
+
+
+def _sid(value):
+    revision, count = struct.unpack('BB', value[:2])
+    authority = struct.unpack('>Q', b'\0\0' + value[2:8])[0]
+    subauthorities = struct.unpack('<%dI' % count, value[8:8 + 4 * count])
+    return 'S-%d-%d' % (revision, authority) + ''.join('-%d' % s for s in subauthorities)
+
+
+def decode_sid(value):
+    'Active Directory objectSid into its S-1-... string form'
+    return scalar([_sid(v) for v in _values(value)])
+
+
+def _generalized_time(value):
+    value = _text(value)
+    base, rest = value[:14], value[14:]
+    dt = datetime.strptime(base, '%Y%m%d%H%M%S')
+    if rest[:1] in ('.', ','):
+        digits = ''
+        rest = rest[1:]
+        while rest[:1].isdigit():
+            digits, rest = digits + rest[0], rest[1:]
+        if digits:
+            dt += timedelta(microseconds=int(round(float('0.' + digits) * 1e6)))
+    if rest[:1] in ('+', '-'):
+        sign = 1 if rest[0] == '+' else -1
+        offset = timedelta(hours=int(rest[1:3]), minutes=int(rest[3:5] or 0))
+        dt -= sign * offset
+    return dt
+
+
+def decode_time(value):
+    'LDAP generalized time into a naive UTC datetime'
+    return scalar([_generalized_time(v) for v in _values(value)])
+
+
+CODECS = {
+    'default': decode_default,
+    'str': decode_str,
+    'int': decode_int,
+    'bytes': decode_bytes,
+    'guid': decode_guid,
+    'sid': decode_sid,
+    'time': decode_time,
+}
+
+
+def compile_codecs(attribute_codecs):
+    '''
+    Resolve ATTRIBUTE_CODECS (attribute name to codec name or callable) into a
+    dict keyed by lower case attribute name.
+    '''
+    codecs = {'objectguid': decode_guid, 'objectsid': decode_sid}
+    for attr, codec in (attribute_codecs or {}).items():
+        if not callable(codec):
+            try:
+                codec = CODECS[codec]
+            except KeyError:
+                raise ValueError("Unknown codec %r for attribute %r in ATTRIBUTE_CODECS, "
+                                 "use one of %s or a callable"
+                                 % (codec, attr, ', '.join(sorted(CODECS))))
+        codecs[attr.lower()] = codec
+    return codecs
+
+
+class LazyUserData(MutableMapping):
+    '''
+    A dict-like userdata mapping decoding attributes of the raw entry on first access.
+    It is not a dict subclass, `to_dict` returns the decoded dict.
+
+    :param userobj: the raw ldap attributes (with 'dn' added)
+    :param keys: list of ``(key, attribute)`` pairs exposed by the mapping
+    :param codecs: dict of lower case attribute name to codec
+    '''
+
+    def __init__(self, userobj, keys, codecs):
+        self._userobj = userobj
+        self._attrs = dict(keys)
+        self._codecs = codecs
+        self._decoded = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._decoded[key]
+        except KeyError:
+            pass
+        attr = self._attrs[key]
+        value = self._userobj.get(attr)
+        if value is not None:
+            value = self._codecs.get(attr.lower(), decode_default)(value)
+        self._decoded[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._attrs.setdefault(key, key)
+        self._decoded[key] = value
+
+    def __delitem__(self, key):
+        del self._attrs[key]
+        self._decoded.pop(key, None)
+
+    def __iter__(self):
+        return iter(self._attrs)
+
+    def __len__(self):
+        return len(self._attrs)
+
+    def __contains__(self, key):
+        return key in self._attrs
+
+    def to_dict(self):
+        'Return a fully decoded dict'
+        return dict(self)
+
+    copy = to_dict
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_dict())
+
+
+def compile_lazy_formatter(keymap, attribute_codecs=None, binary_attributes=BINARY_ATTRIBUTES):
+    '''
+    Return a ``format_userdata(userobj)`` function returning `LazyUserData`.
+    Without KEY_MAP, every attribute of the entry but `binary_attributes` is
+    included: the keys are chosen from the attribute names only, so no value
+    is decoded before it is accessed.
+    '''
+    codecs = compile_codecs(attribute_codecs)
+    skip = frozenset(attr.lower() for attr in binary_attributes)
+
+    if keymap:
+        keys = tuple(keymap.items())
+
+        def format_userdata(userobj):
+            return LazyUserData(userobj, keys, codecs)
+    else:
+        def format_userdata(userobj):
+            keys = [(attr, attr) for attr in userobj if attr.lower() not in skip]
+            return LazyUserData(userobj, keys, codecs)
+
+    return format_userdata
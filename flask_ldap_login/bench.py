@@ -0,0 +1,95 @@
+"""
+Load generation and latency statistics for benchmarking logins.
+
+Used by the benchmark suite in ``benchmarks/`` against a simulated or
+replayed directory and by ``flask-ldap-login-check --bench`` against a real one.
+"""
+import itertools
+import math
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def percentile(values, p):
+    'Nearest-rank percentile `p` (0-100) of the sorted list `values`'
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def run_load(login, credentials, threads=1, count=None, duration=None):
+    '''
+    Call ``login(username, password)`` from `threads` threads, cycling through
+    the ``(username, password)`` pairs in `credentials`, `count` times or for
+    `duration` seconds, whichever ends first (1000 times if neither is given).
+
+    Returns a dict with the throughput in logins per second, the p50, p90 and
+    p99 and max latencies in milliseconds, the number of logins that returned
+    None (`failures`) and the number of exceptions by type (`errors`).
+    '''
+    if count is None and duration is None:
+        count = 1000
+    credentials = itertools.cycle(credentials)
+    remaining = itertools.count(count, -1) if count is not None else itertools.repeat(1)
+    lock = threading.Lock()
+    latencies = []
+    errors = {}
+    failures = [0]
+    start = _clock()
+    deadline = start + duration if duration is not None else None
+
+    def worker():
+        while True:
+            with lock:
+                if next(remaining) <= 0 or (deadline is not None and _clock() >= deadline):
+                    return
+                username, password = next(credentials)
+            start = _clock()
+            try:
+                userdata = login(username, password)
+            except Exception as err:
+                with lock:
+                    name = type(err).__name__
+                    errors[name] = errors.get(name, 0) + 1
+                continue
+            elapsed = _clock() - start
+            with lock:
+                latencies.append(elapsed)
+                if userdata is None:
+                    failures[0] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(threads, _clock() - start, latencies, failures[0], errors)
+
+
+def summarize(threads, seconds, latencies, failures, errors):
+    '''
+    The result dict of a load run of `seconds` seconds: `latencies` of the
+    logins that returned, how many of them returned None (`failures`) and
+    the number of exceptions by type (`errors`). `throughput` counts the
+    logins that returned, `success_throughput` only those returning userdata.
+    '''
+    latencies = sorted(latencies)
+    return {'threads': threads,
+            'logins': len(latencies) + sum(errors.values()),
+            'seconds': round(seconds, 3),
+            'throughput': round(len(latencies) / seconds, 1) if seconds else None,
+            'success_throughput': (round((len(latencies) - failures) / seconds, 1)
+                                   if seconds else None),
+            'p50_ms': _ms(percentile(latencies, 50)),
+            'p90_ms': _ms(percentile(latencies, 90)),
+            'p99_ms': _ms(percentile(latencies, 99)),
+            'max_ms': _ms(latencies[-1] if latencies else None),
+            'failures': failures,
+            'errors': errors}
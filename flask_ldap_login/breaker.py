@@ -0,0 +1,73 @@
+"""
+Circuit breaker failing logins fast while the directory is unavailable.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+
+class CircuitBreaker(object):
+    '''
+    Open after `threshold` consecutive failures (timeouts, server down) so
+    that logins fail immediately instead of waiting on the directory.
+
+    Once `reset_timeout` seconds passed the breaker is half-open: a single
+    login is let through as a probe. If it succeeds the breaker closes,
+    if it fails it opens again. A probe that did not report back within
+    `reset_timeout` is replaced by a new one.
+    '''
+
+    def __init__(self, threshold, reset_timeout=30):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        'True if a login may contact the directory'
+        now = _clock()
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if now - self.opened < self.reset_timeout:
+                    return False
+                log.info("Circuit breaker half-open, probing the directory")
+                self.state = HALF_OPEN
+            elif now - self._probe_started < self.reset_timeout:
+                return False
+            self._probe_started = now
+            return True
+
+    def record_success(self):
+        'The directory answered'
+        with self._lock:
+            if self.state != CLOSED:
+                log.info("Circuit breaker closed")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        'The directory did not answer'
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and
+                                           self.failures >= self.threshold):
+                if self.state == CLOSED:
+                    log.warning("Circuit breaker open after %d failures", self.failures)
+                self.state = OPEN
+                self.opened = _clock()
+
+    def stats(self):
+        'Return a dict with the state and consecutive failures'
+        with self._lock:
+            return {'state': self.state, 'failures': self.failures}
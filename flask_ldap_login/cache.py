@@ -0,0 +1,169 @@
+"""
+In-process caches used by the `LDAPLoginManager`.
+
+Passwords are never stored: cached logins are keyed by username and hold a
+salted PBKDF2 hash of the password that produced them.
+"""
+from collections import OrderedDict
+try:
+    from collections.abc import Mapping
+except ImportError:  # Python 2
+    from collections import Mapping
+import copy
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _feed(digest, value):
+    'Add `value` to `digest`, each value is tagged with its type and length'
+    if isinstance(value, Mapping):
+        digest.update(b'{')
+        for key in sorted(value):
+            _feed(digest, key)
+            _feed(digest, value[key])
+        digest.update(b'}')
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'[')
+        for item in value:
+            _feed(digest, item)
+        digest.update(b']')
+    else:
+        if isinstance(value, bytes):
+            tag = b'b'
+        else:
+            tag = _to_bytes(type(value).__name__)
+            value = _to_bytes(value if isinstance(value, type(u'')) else repr(value))
+        digest.update(tag + _to_bytes(':%d:' % len(value)) + value)
+
+
+def fingerprint(userdata):
+    'Return a stable SHA-256 hex digest of the `userdata` of a login'
+    digest = hashlib.sha256()
+    _feed(digest, userdata)
+    return digest.hexdigest()
+
+
+class TTLCache(object):
+    '''
+    A thread-safe mapping whose entries expire after `ttl` seconds. Once it
+    holds `maxsize` entries the least recently used one is evicted.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        'Return the value for `key` or `default` if it is missing or expired'
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                return default
+            if expires <= _clock():
+                self.expirations += 1
+                return default
+            # Re-insert as the most recently used entry
+            self._data[key] = expires, value
+            return value
+
+    def set(self, key, value, ttl=None):
+        'Store `value` for `key`, for `ttl` seconds if given'
+        expires = _clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = expires, value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        'Remove `key` from the cache'
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        'Remove all entries'
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        'Return a dict of cache statistics'
+        return {'size': len(self._data), 'maxsize': self.maxsize,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class CredentialHasher(object):
+    '''
+    Salted slow hash of a username/password pair, used to key cached logins.
+
+    :param salt: salt for the hash (random per process by default)
+    :param iterations: number of PBKDF2 iterations
+    '''
+
+    def __init__(self, salt=None, iterations=10000):
+        self.salt = os.urandom(16) if salt is None else _to_bytes(salt)
+        self.iterations = iterations
+
+    def __call__(self, username, password):
+        secret = _to_bytes(username) + b'\0' + _to_bytes(password)
+        return hashlib.pbkdf2_hmac('sha256', secret, self.salt, self.iterations)
+
+
+class LoginCache(object):
+    '''
+    Cache of successful `ldap_login` results.
+
+    Entries are keyed by username and store ``(password_hash, userdata)``.
+    A lookup only hits if the password hashes to the stored value.
+
+    :param store: the `TTLCache` holding the entries
+    :param hasher: the `CredentialHasher` producing password hashes
+    '''
+
+    def __init__(self, store, hasher=None):
+        self.store = store
+        self.hash = hasher or CredentialHasher()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username, password_hash):
+        'Return a copy of the cached userdata for these credentials or None'
+        entry = self.store.get(username)
+        if entry is None or not hmac.compare_digest(entry[0], password_hash):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def set(self, username, password_hash, userdata):
+        'Cache the `userdata` returned for a successful login'
+        self.store.set(username, (password_hash, copy.deepcopy(userdata)))
+
+    def invalidate(self, username):
+        'Forget the cached login of `username`'
+        self.store.delete(username)
+
+    def stats(self):
+        'Return a dict of hit/miss/eviction statistics'
+        stats = self.store.stats()
+        stats.update(hits=self.hits, misses=self.misses)
+        return stats
@@ -1,12 +1,125 @@
 """
 Check that application ldap creds are set up correctly.
+
+With --bench, load test the directory with the application's config instead:
+replay the logins of a credentials file (or repeat one login) from concurrent
+workers and report throughput, latency percentiles, errors and per-phase timings.
 """
 from argparse import ArgumentParser
 from pprint import pprint
 import getpass
+import json
+import sys
 
 from werkzeug.utils import import_string
 
+from .bench import run_load
+from .metrics import HistogramMetrics
+
+try:
+    from __builtin__ import raw_input as input  # Python 2
+except ImportError:
+    pass
+
+
+def load_app(app_module):
+    'Import the flask application `app_module` e.g. my.module:app'
+    if ':' in app_module:
+        import_name, appname = app_module.split(':', 1)
+    else:
+        import_name, appname = app_module, 'app'
+
+    module = import_string(import_name)
+    return getattr(module, appname)
+
+
+def read_credentials(path):
+    'Read ``username:password`` lines, skipping blank lines and # comments'
+    credentials = []
+    with open(path) as fd:
+        for line in fd:
+            line = line.rstrip('\r\n')
+            if not line.strip() or line.startswith('#'):
+                continue
+            username, sep, password = line.partition(':')
+            if not sep:
+                raise ValueError("Expected username:password in %s, got %r" % (path, line))
+            credentials.append((username, password))
+    if not credentials:
+        raise ValueError("No credentials in %s" % path)
+    return credentials
+
+
+def check_thresholds(result, args):
+    'Return the list of thresholds the bench `result` exceeded'
+    failed = []
+    logins = result['logins'] or 1
+    error_rate = (sum(result['errors'].values()) + result['failures']) / float(logins)
+    if args.max_p99 is not None and (result['p99_ms'] is None or result['p99_ms'] > args.max_p99):
+        failed.append("p99 latency %sms > %sms" % (result['p99_ms'], args.max_p99))
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        failed.append("error rate %.4f > %s" % (error_rate, args.max_error_rate))
+    if (args.min_throughput is not None
+            and (result['success_throughput'] or 0) < args.min_throughput):
+        failed.append("successful logins %s/s < %s/s"
+                      % (result['success_throughput'], args.min_throughput))
+    return failed
+
+
+def print_report(result, phases):
+    print("%(logins)d logins in %(seconds)ss with %(threads)d workers: "
+          "%(throughput)s logins/s, %(success_throughput)s successful logins/s" % result)
+    print("latency p50=%(p50_ms)sms p90=%(p90_ms)sms p99=%(p99_ms)sms max=%(max_ms)sms" % result)
+    print("returned None: %d" % result['failures'])
+    for name, count in sorted(result['errors'].items()):
+        print("error %s: %d" % (name, count))
+    if phases:
+        print("phases:")
+        for timing in phases:
+            labels = ' '.join('%s=%s' % (key, timing[key]) for key in ('server', 'base')
+                              if key in timing)
+            print("  %-12s count=%-6d avg=%.2fms p99<=%sms %s"
+                  % (timing['phase'], timing['count'], 1000 * timing['sum'] / timing['count'],
+                     1000 * timing['p99'], labels))
+
+
+def bench(app, args):
+    'Run the load test, return the exit status'
+    if args.credentials:
+        credentials = read_credentials(args.credentials)
+    else:
+        username = args.username or input('Username: ')
+        password = args.password or getpass.getpass()
+        credentials = [(username, password)]
+
+    manager = app.ldap_login_manager
+    manager.set_raise_errors()
+    if manager.metrics is None:
+        manager.metrics = HistogramMetrics()
+
+    count, duration = args.count, args.duration
+    if count is None and duration is None:
+        count = 100
+    result = run_load(manager.ldap_login, credentials, threads=args.workers,
+                      count=count, duration=duration)
+
+    phases = None
+    if isinstance(manager.metrics, HistogramMetrics):
+        snapshot = manager.metrics.snapshot()
+        phases = snapshot['timings']
+        result['phases'] = phases
+        result['outcomes'] = snapshot['outcomes']
+
+    print_report(result, phases)
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(result, fd, indent=2, sort_keys=True)
+
+    failed = check_thresholds(result, args)
+    for message in failed:
+        print("FAILED: %s" % message)
+    return 1 if failed else 0
+
 
 def main():
     parser = ArgumentParser(description=__doc__)
@@ -15,17 +128,31 @@ def main():
                         help='Python importible flask application e.g. my.module:app')
     parser.add_argument('-u', '--username', help='Ldap login with this username')
     parser.add_argument('-p', '--password', help='Ldap login with this password')
+
+    group = parser.add_argument_group('load testing')
+    group.add_argument('--bench', action='store_true', help='Run a load test')
+    group.add_argument('--credentials', metavar='FILE',
+                       help='File of username:password lines to replay '
+                            '(default: repeat the -u/-p login)')
+    group.add_argument('-w', '--workers', type=int, default=4,
+                       help='Concurrent workers (default: 4)')
+    group.add_argument('-n', '--count', type=int, help='Number of logins (default: 100)')
+    group.add_argument('-d', '--duration', type=float, help='Run for this many seconds')
+    group.add_argument('--max-p99', type=float, metavar='MS',
+                       help='Exit with status 1 if the p99 latency is above MS milliseconds')
+    group.add_argument('--max-error-rate', type=float, metavar='RATE',
+                       help='Exit with status 1 if more than RATE (0-1) of the logins failed')
+    group.add_argument('--min-throughput', type=float, metavar='N',
+                       help='Exit with status 1 if fewer than N logins per second succeeded')
+    group.add_argument('--json', metavar='PATH', help='Also write the results to PATH')
     args = parser.parse_args()
 
-    if ':' in args.app_module:
-        import_name, appname = args.app_module.split(':', 1)
-    else:
-        import_name, appname = args.app_module, 'app'
+    app = load_app(args.app_module)
 
-    module = import_string(import_name)
-    app = getattr(module, appname)
+    if args.bench:
+        sys.exit(bench(app, args))
 
-    username = args.username or raw_input('Username: ')
+    username = args.username or input('Username: ')
     password = args.password or getpass.getpass()
 
     app.ldap_login_manager.set_raise_errors()
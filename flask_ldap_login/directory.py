@@ -0,0 +1,825 @@
+"""
+An indexed in-memory directory loaded from LDIF, for tests and benchmarks.
+
+`MemoryDirectory` keeps its entries in dicts with equality indexes on the
+attributes logins search by (`DEFAULT_INDEXES`), evaluates RFC 4515 filters
+with base, one level and subtree scopes and checks simple binds against
+`userPassword` (cleartext or {SHA}, {SSHA}, {SHA256}, {SSHA256}, {SHA512},
+{SSHA512} hashes). Searches answered from an index stay well under a
+millisecond with 100k+ entries; filters no index applies to scan the scope.
+
+Use it in place of `ldap.initialize` with `flask_ldap_login.replay.stand_in`::
+
+    directory = MemoryDirectory.from_ldif('users.ldif')
+    with stand_in(directory):
+        ldap_mgr.ldap_login('alice', 'secret')
+
+Values are bytes as with python-ldap. Attribute names, DNs and values are
+matched case-insensitively, except with the caseExactMatch rule. Search
+bases that are not entries themselves but have entries below them (e.g. the
+suffix when the LDIF only holds users) are valid.
+"""
+import base64
+import hashlib
+import hmac
+import itertools
+import re
+import string
+import threading
+import time
+
+import ldap
+
+#: Attributes with an equality index by default
+DEFAULT_INDEXES = ('objectClass', 'uid', 'cn', 'mail', 'sAMAccountName', 'userPrincipalName',
+                   'member', 'uniqueMember', 'memberUid', 'memberOf')
+
+#: Attributes whose values are DNs, compared as DNs
+DN_ATTRIBUTES = frozenset(('member', 'uniquemember', 'memberof', 'manager', 'owner',
+                           'seealso', 'secretary', 'distinguishedname'))
+
+#: OIDs of the Active Directory matching rules
+BIT_AND = '1.2.840.113556.1.4.803'
+BIT_OR = '1.2.840.113556.1.4.804'
+IN_CHAIN = '1.2.840.113556.1.4.1941'
+
+CASE_EXACT = frozenset(('caseexactmatch', '2.5.13.5', 'caseexactia5match',
+                        '1.3.6.1.4.1.1466.109.114.1'))
+CASE_IGNORE = frozenset(('caseignorematch', '2.5.13.2', 'caseignoreia5match',
+                         '1.3.6.1.4.1.1466.109.114.2', 'distinguishednamematch', '2.5.13.1'))
+
+_HASHES = {'SHA': hashlib.sha1, 'SHA256': hashlib.sha256, 'SHA512': hashlib.sha512}
+
+_DN_SPECIALS = re.compile(r'([,+"\\<>;=])')
+
+_compare_digest = getattr(hmac, 'compare_digest', lambda a, b: a == b)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _unescape(text):
+    r'Replace the ``\XX`` hex and ``\c`` escapes of a DN or filter value'
+    if '\\' not in text:
+        return text
+    data = bytearray()
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char != '\\':
+            data.extend(char.encode('utf-8'))
+            pos += 1
+            continue
+        pair = text[pos + 1:pos + 3]
+        if len(pair) == 2 and all(c in string.hexdigits for c in pair):
+            data.append(int(pair, 16))
+            pos += 3
+        elif pair:
+            data.extend(pair[0].encode('utf-8'))
+            pos += 2
+        else:
+            raise ValueError("Trailing backslash in %r" % text)
+    return bytes(data).decode('utf-8')
+
+
+def _split_unescaped(text, separator):
+    'Split `text` on the `separator` characters that are not escaped'
+    if '\\' not in text:
+        return text.split(separator)
+    parts = []
+    start = pos = 0
+    while pos < len(text):
+        if text[pos] == '\\':
+            pos += 2
+            continue
+        if text[pos] == separator:
+            parts.append(text[start:pos])
+            start = pos + 1
+        pos += 1
+    parts.append(text[start:])
+    return parts
+
+
+def normalize_dn(dn):
+    '''
+    Normalized form of `dn` for comparisons: lower case, without insignificant
+    spaces, multi-valued RDNs sorted and special characters escaped one way.
+
+    :raises ValueError: if `dn` is not a valid DN
+    '''
+    text = _text(dn).strip()
+    if not text:
+        return ''
+    rdns = []
+    for rdn in _split_unescaped(text, ','):
+        avas = []
+        for ava in _split_unescaped(rdn, '+'):
+            attr, sep, value = ava.partition('=')
+            if not sep or not attr.strip():
+                raise ValueError("Invalid DN %r" % dn)
+            value = _unescape(value.strip())
+            value = _DN_SPECIALS.sub(r'\\\1', value)
+            avas.append('%s=%s' % (attr.strip().lower(), ' '.join(value.lower().split())))
+        rdns.append('+'.join(sorted(avas)))
+    return ','.join(rdns)
+
+
+def _parent(key):
+    'Normalized DN of the parent of the normalized DN `key`'
+    rdns = _split_unescaped(key, ',')
+    return ','.join(rdns[1:])
+
+
+def normalize_value(attr, value):
+    'Normalized form of the `value` of attribute `attr` (lower case) for equality matching'
+    if isinstance(value, bytes):
+        # Binary values (e.g. jpegPhoto) are only compared to each other
+        value = value.decode('utf-8', 'replace')
+    if attr in DN_ATTRIBUTES:
+        try:
+            return normalize_dn(value)
+        except ValueError:
+            pass
+    return ' '.join(value.lower().split())
+
+
+def check_password(stored, password):
+    '''
+    Whether `password` matches the `stored` userPassword value, either in
+    cleartext or hashed with one of the {SHA}, {SSHA}, {SHA256}, {SSHA256},
+    {SHA512} or {SSHA512} schemes
+    '''
+    stored = _to_bytes(stored)
+    password = _to_bytes(password)
+    if not stored.startswith(b'{'):
+        return _compare_digest(stored, password)
+    scheme, _, value = stored[1:].partition(b'}')
+    scheme = _text(scheme).upper()
+    if scheme == 'CLEARTEXT':
+        return _compare_digest(value, password)
+    salted = scheme.startswith('SSHA')
+    hashfunc = _HASHES.get(scheme[1:] if salted else scheme)
+    if hashfunc is None:
+        return False
+    try:
+        decoded = base64.b64decode(value)
+    except (TypeError, ValueError):
+        return False
+    size = hashfunc().digest_size
+    digest, salt = decoded[:size], decoded[size:] if salted else b''
+    return _compare_digest(hashfunc(password + salt).digest(), digest)
+
+
+#===============================================================================
+# RFC 4515 search filters
+#===============================================================================
+
+class _Node(object):
+    'A filter node: `match` tests an entry, `candidates` the keys an index allows or None'
+
+    def candidates(self, directory):
+        return None
+
+
+class _And(_Node):
+
+    def __init__(self, children):
+        self.children = children
+
+    def match(self, entry, directory):
+        return all(child.match(entry, directory) for child in self.children)
+
+    def candidates(self, directory):
+        sets = [keys for keys in (child.candidates(directory) for child in self.children)
+                if keys is not None]
+        if not sets:
+            return None
+        sets.sort(key=len)
+        return set(sets[0]).intersection(*sets[1:])
+
+
+class _Or(_Node):
+
+    def __init__(self, children):
+        self.children = children
+
+    def match(self, entry, directory):
+        return any(child.match(entry, directory) for child in self.children)
+
+    def candidates(self, directory):
+        keys = set()
+        for child in self.children:
+            child_keys = child.candidates(directory)
+            if child_keys is None:
+                return None
+            keys.update(child_keys)
+        return keys
+
+
+class _Not(_Node):
+
+    def __init__(self, child):
+        self.child = child
+
+    def match(self, entry, directory):
+        return not self.child.match(entry, directory)
+
+
+class _Present(_Node):
+
+    def __init__(self, attr):
+        self.attr = attr
+
+    def match(self, entry, directory):
+        return self.attr == 'objectclass' or self.attr in entry.names
+
+
+class _Equal(_Node):
+
+    def __init__(self, attr, value):
+        self.attr = attr
+        self.value = normalize_value(attr, value)
+
+    def match(self, entry, directory):
+        return self.value in entry.normalized(self.attr)
+
+    def candidates(self, directory):
+        return directory.lookup(self.attr, self.value)
+
+
+class _Substring(_Node):
+
+    def __init__(self, attr, initial, middle, final):
+        self.attr = attr
+        self.initial = normalize_value(None, initial)
+        self.middle = [normalize_value(None, value) for value in middle]
+        self.final = normalize_value(None, final)
+
+    def _match_value(self, value):
+        if not (value.startswith(self.initial) and value.endswith(self.final)):
+            return False
+        pos = len(self.initial)
+        end = len(value) - len(self.final)
+        for part in self.middle:
+            pos = value.find(part, pos, end)
+            if pos < 0:
+                return False
+            pos += len(part)
+        return pos <= end
+
+    def match(self, entry, directory):
+        return any(self._match_value(value) for value in entry.normalized(self.attr))
+
+
+class _Order(_Node):
+    'The >= and <= filters, comparing numbers numerically'
+
+    def __init__(self, attr, value, greater):
+        self.attr = attr
+        self.value = normalize_value(attr, value)
+        self.greater = greater
+
+    def _compare(self, value):
+        try:
+            left, right = int(value), int(self.value)
+        except ValueError:
+            left, right = value, self.value
+        return left >= right if self.greater else left <= right
+
+    def match(self, entry, directory):
+        return any(self._compare(value) for value in entry.normalized(self.attr))
+
+
+class _Extensible(_Node):
+    'Extensible match: case exact or ignore, the AD bitwise and in chain rules and :dn'
+
+    def __init__(self, attr, rule, value, dn_attrs):
+        if not attr:
+            raise ldap.FILTER_ERROR({'desc': "Bad search filter",
+                                     'info': "Extensible match without attribute"})
+        self.attr = attr
+        self.rule = rule
+        self.dn_attrs = dn_attrs
+        self.raw = _to_bytes(value)
+        self.value = normalize_value(attr, value)
+        self._chain = None
+        if rule in (BIT_AND, BIT_OR):
+            try:
+                self.bits = int(value)
+            except ValueError:
+                raise ldap.FILTER_ERROR({'desc': "Bad search filter",
+                                         'info': "Bitwise match of %r" % value})
+        elif rule not in (None, IN_CHAIN) and rule.lower() not in CASE_EXACT | CASE_IGNORE:
+            raise ldap.FILTER_ERROR({'desc': "Bad search filter",
+                                     'info': "Unsupported matching rule %s" % rule})
+
+    def _values(self, entry):
+        values = list(entry.normalized(self.attr))
+        if self.dn_attrs:
+            for rdn in _split_unescaped(entry.key, ','):
+                for ava in _split_unescaped(rdn, '+'):
+                    attr, _, value = ava.partition('=')
+                    if attr == self.attr:
+                        values.append(normalize_value(attr, _unescape(value)))
+        return values
+
+    def match(self, entry, directory):
+        if self.rule == IN_CHAIN:
+            return entry.key in self.candidates(directory)
+        if self.rule in (BIT_AND, BIT_OR):
+            for value in self._values(entry):
+                try:
+                    flags = int(value)
+                except ValueError:
+                    continue
+                if (flags & self.bits == self.bits if self.rule == BIT_AND
+                        else flags & self.bits):
+                    return True
+            return False
+        if self.rule is not None and self.rule.lower() in CASE_EXACT:
+            name = entry.names.get(self.attr)
+            return any(value == self.raw for value in entry.attrs.get(name, ()))
+        return self.value in self._values(entry)
+
+    def candidates(self, directory):
+        if self.rule == IN_CHAIN:
+            if self._chain is None:
+                self._chain = directory.chain(self.attr, self.value)
+            return self._chain
+        if self.rule is None and not self.dn_attrs:
+            return directory.lookup(self.attr, self.value)
+        return None
+
+
+def _filter_error(filterstr, info):
+    return ldap.FILTER_ERROR({'desc': "Bad search filter", 'info': "%s in %r" % (info, filterstr)})
+
+
+def _attribute(name, filterstr):
+    'Lower case attribute name without options'
+    name = name.strip().split(';')[0].lower()
+    if not name or not all(c.isalnum() or c in '-.' for c in name):
+        raise _filter_error(filterstr, "Bad attribute %r" % name)
+    return name
+
+
+def _parse_item(item, filterstr):
+    left, sep, value = item.partition('=')
+    if not sep or not left:
+        raise _filter_error(filterstr, "Bad item %r" % item)
+    try:
+        if left.endswith(':'):
+            parts = left[:-1].split(':')
+            attr = parts[0]
+            flags = [part.lower() for part in parts[1:]]
+            dn_attrs = 'dn' in flags
+            rules = [part for part in parts[1:] if part.lower() != 'dn']
+            if len(rules) > 1:
+                raise _filter_error(filterstr, "Bad extensible match %r" % item)
+            return _Extensible(_attribute(attr, filterstr) if attr else None,
+                               rules[0] if rules else None, _unescape(value), dn_attrs)
+        if left[-1] in '~<>':
+            attr = _attribute(left[:-1], filterstr)
+            if left[-1] == '~':
+                return _Equal(attr, _unescape(value))
+            return _Order(attr, _unescape(value), left[-1] == '>')
+        attr = _attribute(left, filterstr)
+        if value == '*':
+            return _Present(attr)
+        if '*' in value:
+            parts = [_unescape(part) for part in value.split('*')]
+            return _Substring(attr, parts[0], [part for part in parts[1:-1] if part], parts[-1])
+        return _Equal(attr, _unescape(value))
+    except ValueError as err:
+        raise _filter_error(filterstr, str(err))
+
+
+def _parse(text, pos, filterstr):
+    'Parse the filter starting at `pos`, return the node and the position after it'
+    if text[pos:pos + 1] != '(':
+        raise _filter_error(filterstr, "Expected '(' at %d" % pos)
+    pos += 1
+    op = text[pos:pos + 1]
+    if op in ('&', '|', '!'):
+        pos += 1
+        children = []
+        while text[pos:pos + 1] == '(':
+            child, pos = _parse(text, pos, filterstr)
+            children.append(child)
+        if text[pos:pos + 1] != ')':
+            raise _filter_error(filterstr, "Expected ')' at %d" % pos)
+        if op == '!':
+            if len(children) != 1:
+                raise _filter_error(filterstr, "'!' takes one filter")
+            return _Not(children[0]), pos + 1
+        return (_And if op == '&' else _Or)(children), pos + 1
+
+    end = text.find(')', pos)
+    if end < 0:
+        raise _filter_error(filterstr, "Unbalanced parentheses")
+    return _parse_item(text[pos:end], filterstr), end + 1
+
+
+def parse_filter(filterstr):
+    '''
+    Parse the RFC 4515 search filter `filterstr`. Like libldap, a single item
+    may be given without its parentheses (``uid=alice``).
+
+    :raises ldap.FILTER_ERROR: if the filter is invalid
+    '''
+    text = _text(filterstr).strip()
+    if not text.startswith('('):
+        text = '(%s)' % text
+    node, pos = _parse(text, 0, filterstr)
+    if pos != len(text):
+        raise _filter_error(filterstr, "Trailing characters at %d" % pos)
+    return node
+
+
+#===============================================================================
+# LDIF
+#===============================================================================
+
+def _logical_lines(lines):
+    'Unfold the continuation lines of LDIF `lines`, yielding None at record ends'
+    current = None
+    for line in lines:
+        line = _text(line).rstrip('\r\n')
+        if line.startswith(' '):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None and not current.startswith('#'):
+            yield current
+        if not line.strip():
+            current = None
+            yield None
+        else:
+            current = line
+    if current is not None and not current.startswith('#'):
+        yield current
+    yield None
+
+
+def parse_ldif(lines):
+    '''
+    Yield the ``(dn, attrs)`` records of the LDIF (RFC 2849) `lines`, `attrs`
+    mapping attribute names to lists of bytes values. Change records other
+    than adds are skipped.
+
+    :raises ValueError: on malformed lines or unsupported URL values
+    '''
+    dn, attrs, skip = None, {}, False
+    for line in _logical_lines(lines):
+        if line is None:
+            if dn is not None and not skip:
+                yield dn, attrs
+            dn, attrs, skip = None, {}, False
+            continue
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise ValueError("Invalid LDIF line %r" % line)
+        if value.startswith(':'):
+            value = base64.b64decode(value[1:].strip())
+        elif value.startswith('<'):
+            raise ValueError("URL values are not supported: %r" % line)
+        else:
+            value = _to_bytes(value.lstrip(' '))
+
+        name = name.strip()
+        lower = name.lower()
+        if dn is None:
+            if lower == 'version':
+                continue
+            if lower != 'dn':
+                raise ValueError("LDIF record without dn: %r" % line)
+            dn = _text(value)
+        elif lower == 'changetype':
+            skip = _text(value).strip().lower() != 'add'
+        elif lower != 'control':
+            attrs.setdefault(name, []).append(value)
+
+
+#===============================================================================
+# Directory
+#===============================================================================
+
+class Entry(object):
+    '''
+    A directory entry. `attrs` maps attribute names to bytes values and
+    `names` lower case names to attribute names.
+    '''
+    __slots__ = ('dn', 'key', 'attrs', 'names', '_normalized')
+
+    def __init__(self, dn, key, attrs):
+        self.dn = dn
+        self.key = key
+        self.attrs = {}
+        self.names = {}
+        self._normalized = {}
+        for name, values in attrs.items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            self.attrs[name] = [_to_bytes(value) for value in values]
+            self.names[name.lower()] = name
+
+    def normalized(self, attr):
+        'Set of the normalized values of the lower case attribute `attr`, computed once'
+        values = self._normalized.get(attr)
+        if values is None:
+            name = self.names.get(attr)
+            values = self._normalized[attr] = frozenset(
+                normalize_value(attr, value) for value in self.attrs.get(name, ()))
+        return values
+
+    def result(self, attrlist=None):
+        'The ``(dn, attrs)`` search result with the attributes in `attrlist`'
+        if attrlist is None or '*' in attrlist:
+            return self.dn, dict((name, list(values)) for name, values in self.attrs.items())
+        attrs = {}
+        for attr in attrlist:
+            name = self.names.get(attr.lower())
+            if name is not None:
+                attrs[name] = list(self.attrs[name])
+        return self.dn, attrs
+
+
+class MemoryDirectory(object):
+    '''
+    An indexed in-memory directory. Binds and searches are thread-safe,
+    entries should be added before it is shared between threads.
+
+    :param entries: initial ``(dn, attrs)`` entries
+    :param indexes: attributes with an equality index (default
+        `DEFAULT_INDEXES`), None to index every attribute but userPassword
+    :param latency: seconds every operation sleeps (default 0)
+    :param connect_latency: seconds `initialize` sleeps (default 0)
+    '''
+
+    def __init__(self, entries=(), indexes=DEFAULT_INDEXES, latency=0.0, connect_latency=0.0):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.entries = {}
+        self.children = {}
+        self.parents = {}
+        self.index_all = indexes is None
+        self.indexes = dict((name.lower(), {}) for name in indexes or ())
+        self.operations = dict.fromkeys(('connect', 'bind', 'search'), 0)
+        self._lock = threading.Lock()
+        for dn, attrs in entries:
+            self.add(dn, attrs)
+
+    @classmethod
+    def from_ldif(cls, source, **kwargs):
+        'A directory with the entries of the LDIF file path or lines `source`'
+        directory = cls(**kwargs)
+        directory.load_ldif(source)
+        return directory
+
+    def load_ldif(self, source):
+        'Add the entries of the LDIF file path or lines `source`, return their number'
+        if isinstance(source, (bytes, type(u''))):
+            with open(source, 'rb') as fd:
+                return self.load_ldif(fd)
+        count = 0
+        for dn, attrs in parse_ldif(source):
+            self.add(dn, attrs)
+            count += 1
+        return count
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _indexed(self, attr):
+        if self.index_all:
+            return attr != 'userpassword'
+        return attr in self.indexes
+
+    def add(self, dn, attrs):
+        'Add the entry `dn` with the attributes `attrs`, replacing any entry with that DN'
+        key = normalize_dn(dn)
+        entry = Entry(_text(dn), key, attrs)
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            child = key
+            while child and child not in self.parents:
+                parent = self.parents[child] = _parent(child)
+                self.children.setdefault(parent, set()).add(child)
+                child = parent
+            for attr in entry.names:
+                if self._indexed(attr):
+                    index = self.indexes.setdefault(attr, {})
+                    for value in entry.normalized(attr):
+                        index.setdefault(value, set()).add(key)
+
+    def delete(self, dn):
+        'Remove the entry `dn`'
+        with self._lock:
+            self._remove(normalize_dn(dn))
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object"})
+        for attr in entry.names:
+            index = self.indexes.get(attr)
+            if index is not None:
+                for value in entry.normalized(attr):
+                    keys = index.get(value)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del index[value]
+
+    def get(self, dn):
+        'The ``(dn, attrs)`` of the entry `dn` or None'
+        entry = self.entries.get(normalize_dn(dn))
+        return None if entry is None else entry.result()
+
+    def lookup(self, attr, value):
+        'Keys of the entries whose `attr` has the normalized `value`, None without index'
+        index = self.indexes.get(attr)
+        if index is None:
+            return None
+        return index.get(value, ())
+
+    def chain(self, attr, value):
+        'Keys of the entries whose `attr` leads to the DN `value` through a chain of `attr`'
+        found = set()
+        pending = [value]
+        while pending:
+            dn = pending.pop()
+            keys = self.lookup(attr, dn)
+            if keys is None:
+                keys = [entry.key for entry in self.entries.values()
+                        if dn in entry.normalized(attr)]
+            for key in keys:
+                if key not in found:
+                    found.add(key)
+                    pending.append(key)
+        return found
+
+    def _in_scope(self, key, base, scope):
+        if scope == ldap.SCOPE_BASE:
+            return key == base
+        if scope == ldap.SCOPE_ONELEVEL:
+            return self.parents.get(key) == base
+        while key != base:
+            if not key:
+                return False
+            key = self.parents.get(key, '')
+        return True
+
+    def _scope(self, base, scope):
+        'Keys of the entries in scope'
+        if scope == ldap.SCOPE_BASE:
+            return [base] if base in self.entries else []
+        if scope == ldap.SCOPE_ONELEVEL:
+            return self.children.get(base, ())
+        if not base:
+            return list(self.entries)
+        keys = []
+        pending = [base]
+        while pending:
+            key = pending.pop()
+            if key in self.entries:
+                keys.append(key)
+            pending.extend(self.children.get(key, ()))
+        return keys
+
+    def operation(self, name, latency=None):
+        'Count and delay the operation `name`'
+        with self._lock:
+            self.operations[name] += 1
+        latency = self.latency if latency is None else latency
+        if latency:
+            time.sleep(latency)
+
+    def initialize(self, uri):
+        self.operation('connect', self.connect_latency)
+        return MemoryConnection(self, uri)
+
+    def bind(self, who, cred):
+        '''
+        Simple bind as `who`. Anonymous binds (no `who` nor `cred`) succeed,
+        unauthenticated binds (`who` without `cred`) are refused like OpenLDAP does.
+        '''
+        self.operation('bind')
+        if not cred:
+            if who:
+                raise ldap.UNWILLING_TO_PERFORM({'desc': "Server is unwilling to perform",
+                                                 'info': "unauthenticated bind (DN with no "
+                                                         "password) disallowed"})
+            return
+        try:
+            entry = self.entries.get(normalize_dn(who))
+        except ValueError:
+            entry = None
+        if entry is None or not any(check_password(stored, cred) for stored in
+                                    entry.attrs.get(entry.names.get('userpassword'), ())):
+            raise ldap.INVALID_CREDENTIALS({'desc': "Invalid credentials"})
+
+    def search(self, base, scope, filterstr='(objectClass=*)', attrlist=None, sizelimit=0):
+        '''
+        Entries under `base` in `scope` matching `filterstr` as ``(dn, attrs)``
+        pairs sorted by DN, with the attributes in `attrlist`.
+
+        :raises TypeError: if `attrlist` holds names that are not native strings
+        :raises ldap.NO_SUCH_OBJECT: if `base` does not exist
+        :raises ldap.SIZELIMIT_EXCEEDED: if more than `sizelimit` entries match
+        '''
+        if attrlist is not None and not all(isinstance(attr, str) for attr in attrlist):
+            # Like python-ldap, which takes native strings (bytes only on Python 2)
+            raise TypeError("expected string in list")
+        self.operation('search')
+        node = parse_filter(filterstr or '(objectClass=*)')
+        try:
+            base = normalize_dn(base)
+        except ValueError:
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object"})
+        if base and base not in self.entries and base not in self.children:
+            raise ldap.NO_SUCH_OBJECT({'desc': "No such object"})
+
+        keys = node.candidates(self)
+        if keys is None:
+            keys = self._scope(base, scope)
+        else:
+            keys = [key for key in keys if self._in_scope(key, base, scope)]
+
+        entries = [entry for entry in (self.entries.get(key) for key in keys)
+                   if entry is not None and node.match(entry, self)]
+        if sizelimit and len(entries) > sizelimit:
+            raise ldap.SIZELIMIT_EXCEEDED({'desc': "Size limit exceeded"})
+        entries.sort(key=lambda entry: entry.key)
+        return [entry.result(attrlist) for entry in entries]
+
+
+class MemoryConnection(object):
+    'A connection to a `MemoryDirectory` with the python-ldap `LDAPObject` methods logins use'
+
+    def __init__(self, directory, uri):
+        self.directory = directory
+        self.bound = ''
+        self._uri = uri
+        self._pending = {}
+        self._msgids = itertools.count(1)
+
+    def set_option(self, option, value):
+        pass
+
+    def start_tls_s(self):
+        self.directory.operation('connect')
+
+    def simple_bind_s(self, who='', cred='', *args, **kwargs):
+        self.directory.bind(who, cred)
+        self.bound = who
+
+    def whoami_s(self, *args, **kwargs):
+        self.directory.operation('search')
+        return 'dn:%s' % self.bound if self.bound else ''
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0):
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                     serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        return self.directory.search(base, scope, filterstr, attrlist, sizelimit)
+
+    def _submit(self, rtype, func, *args):
+        msgid = next(self._msgids)
+        try:
+            self._pending[msgid] = rtype, func(*args), None
+        except ldap.LDAPError as err:
+            self._pending[msgid] = rtype, None, err
+        return msgid
+
+    def simple_bind(self, who='', cred='', *args, **kwargs):
+        return self._submit(ldap.RES_BIND, self.simple_bind_s, who, cred)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, attrsonly=0,
+                   serverctrls=None, clientctrls=None, timeout=-1, sizelimit=0):
+        return self._submit(ldap.RES_SEARCH_RESULT, self.directory.search,
+                            base, scope, filterstr, attrlist, sizelimit)
+
+    def result3(self, msgid, all=1, timeout=None):
+        rtype, data, err = self._pending.pop(msgid)
+        if err is not None:
+            raise err
+        return rtype, data, msgid, []
+
+    def abandon(self, msgid):
+        self._pending.pop(msgid, None)
+
+    def unbind_s(self):
+        pass
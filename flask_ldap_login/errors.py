@@ -0,0 +1,48 @@
+"""
+Exceptions raised by flask-ldap-login.
+
+All of them subclass `ldap.LDAPError` so that existing ``except ldap.LDAPError``
+handlers (such as the one in `LDAPLoginForm.validate_ldap`) keep working.
+Like python-ldap's own errors they carry a ``{'desc': ...}`` dict as their
+message.
+"""
+import ldap
+
+
+class LDAPLoginError(ldap.LDAPError):
+    'Base class for errors raised by flask-ldap-login itself'
+
+    def __init__(self, desc, **info):
+        info['desc'] = desc
+        super(LDAPLoginError, self).__init__(info)
+
+
+class PoolExhausted(LDAPLoginError):
+    'No pooled connection became available within POOL_TIMEOUT'
+
+
+class LoginThrottled(LDAPLoginError):
+    'Too many failed logins for this username or source'
+
+
+class DirectoryUnavailable(LDAPLoginError):
+    'The circuit breaker is open: the directory failed repeatedly and is not contacted'
+
+
+class AmbiguousUser(LDAPLoginError, ldap.INVALID_CREDENTIALS):
+    '''
+    A USER_SEARCH search matched several entries. It is an `INVALID_CREDENTIALS`
+    so it is handled like any other failed login.
+    '''
+
+
+class DirectoryBusy(LDAPLoginError):
+    'Too many logins are contacting the directory: the login was not admitted'
+
+
+class ServiceBindFailed(LDAPLoginError):
+    '''
+    The directory rejected the BIND_DN/BIND_AUTH bind. The service account is
+    misconfigured, expired or locked: the login failed on the server side and
+    is not held against the user.
+    '''
@@ -0,0 +1,78 @@
+"""
+Bulk export and lookup of the users matched by USER_SEARCH.
+
+Exports run with the Simple Paged Results control (RFC 2696) so that only
+one page of entries is held in memory at a time. Lookups of many known
+usernames merge the USER_SEARCH filter into ``(|...)`` filters.
+"""
+import logging
+import re
+
+from ldap.controls import SimplePagedResultsControl
+from ldap.filter import escape_filter_chars
+
+from .plan import scalar
+
+log = logging.getLogger(__name__)
+
+_USERNAME_ATTR = re.compile(r'([\w.;-]+)\s*=\s*%\(username\)s')
+
+
+def username_attr(template):
+    '''
+    Return the attribute compared with %(username)s in the filter `template`,
+    e.g. 'uid' for '(&(objectClass=person)(uid=%(username)s))'.
+    '''
+    match = _USERNAME_ATTR.search(template)
+    if match is None:
+        raise ValueError("Can not find the username attribute in the filter %r" % (template,))
+    return match.group(1)
+
+
+def entry_username(attrs, attr):
+    'Return the value of `attr` (compared case-insensitively) in the entry `attrs`'
+    for key, value in attrs.items():
+        if key.lower() == attr.lower():
+            value = scalar(value)
+            if isinstance(value, bytes):
+                value = value.decode('utf-8')
+            return value
+    return None
+
+
+def or_filter(template, usernames):
+    """
+    Merge the filter `template` formatted with each of `usernames` (escaped
+    with `escape_filter_chars`) into one ``(|...)`` filter.
+    """
+    terms = []
+    for username in usernames:
+        term = template % {'username': escape_filter_chars(username), 'password': ''}
+        if not term.startswith('('):
+            term = '(%s)' % term
+        terms.append(term)
+    return '(|%s)' % ''.join(terms)
+
+
+def paged_search(conn, base, scope, filterstr, attrlist=None, page_size=500):
+    '''
+    Search with the Simple Paged Results control, requesting `page_size`
+    entries at a time. Yields ``(dn, attrs)`` pairs, search continuation
+    references are skipped.
+    '''
+    control = SimplePagedResultsControl(True, size=page_size, cookie='')
+    while True:
+        log.debug("Search page of base=%s filter=%s", base, filterstr)
+        msgid = conn.search_ext(base, scope, filterstr, attrlist=attrlist, serverctrls=[control])
+        _, rdata, _, serverctrls = conn.result3(msgid)
+        for dn, attrs in rdata:
+            if dn is not None:
+                yield dn, attrs
+
+        cookie = None
+        for ctrl in serverctrls or ():
+            if ctrl.controlType == SimplePagedResultsControl.controlType:
+                cookie = ctrl.cookie
+        if not cookie:
+            return
+        control.cookie = cookie
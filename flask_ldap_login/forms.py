@@ -7,9 +7,12 @@ except ImportError:
 
 import wtforms
 from wtforms import validators
-from flask import flash, current_app
+from flask import flash, current_app, request
 import ldap
 
+from .errors import DirectoryBusy, DirectoryUnavailable, LoginThrottled, PoolExhausted
+from .pool import TRANSPORT_ERRORS
+
 class LDAPLoginForm(Form):
     """
     This is a form to be subclassed by your application. 
@@ -28,15 +31,26 @@ class LDAPLoginForm(Form):
         username = self.username.data
         password = self.password.data
         try:
-            userdata = ldap_mgr.ldap_login(username, password)
+            userdata = ldap_mgr.ldap_login(username, password, source=request.remote_addr)
+        except LoginThrottled:
+            flash("Too many failed login attempts, please try again later", 'danger')
+            return False
+        except DirectoryBusy:
+            flash("Too many logins in progress, please try again in a moment", 'danger')
+            return False
+        except (DirectoryUnavailable, PoolExhausted) + TRANSPORT_ERRORS:
+            flash("The login directory is unavailable, please try again later", 'danger')
+            return False
         except ldap.INVALID_CREDENTIALS:
             flash("Invalid LDAP credentials", 'danger')
             return False
         except ldap.LDAPError as err:
-            if isinstance(err.message, dict):
-                message = err.message.get('desc', str(err))
+            # python-ldap errors carry a {'desc': ...} dict, Python 3 ones have no .message
+            info = err.args[0] if err.args else str(err)
+            if isinstance(info, dict):
+                message = info.get('desc', str(err))
             else:
-                message = str(err.message)
+                message = str(info)
             flash(message, 'danger')
             return False
 
@@ -44,7 +58,7 @@ class LDAPLoginForm(Form):
             flash("Invalid LDAP credentials", 'danger')
             return False
 
-        self.user = ldap_mgr._save_user(username, userdata)
+        self.user = ldap_mgr.store_user(username, userdata)
         return True
 
 
@@ -0,0 +1,164 @@
+"""
+Group membership resolution for GROUP_SEARCH.
+
+The direct groups of a user are read from its memberOf attribute
+('memberOf'), found with a reverse search on the group member attribute
+('member') or, on Active Directory, all nested groups are found at once with
+the LDAP_MATCHING_RULE_IN_CHAIN matching rule ('in_chain').
+
+Nested groups are resolved by walking group DN -> parent group DNs edges
+which are kept in a TTL cache shared by all logins, so the groups of the
+groups everyone belongs to are only looked up once per GROUP_CACHE_TTL.
+
+Group searches are size limited (`GROUP_SIZELIMIT` by default); a search
+hitting the limit raises ldap.SIZELIMIT_EXCEEDED rather than returning an
+incomplete list of groups.
+"""
+import logging
+
+import ldap
+from ldap.filter import escape_filter_chars
+
+log = logging.getLogger(__name__)
+
+METHODS = ('memberOf', 'member', 'in_chain')
+
+#: OID of LDAP_MATCHING_RULE_IN_CHAIN
+IN_CHAIN = '1.2.840.113556.1.4.1941'
+
+#: Default maximum number of entries returned by a group search
+GROUP_SIZELIMIT = 1000
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def _attr_values(attrs, name):
+    'Values of the attribute `name` (compared case-insensitively) as text'
+    for key, values in attrs.items():
+        if key.lower() == name.lower():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            return [_text(value) for value in values]
+    return []
+
+
+class GroupResolver(object):
+    '''
+    Resolve the direct and nested groups of a user entry.
+
+    :param method: 'memberOf', 'member' or 'in_chain'
+    :param base: base DN of the group searches (required unless `method` is 'memberOf')
+    :param filter: filter selecting group entries
+    :param member_attr: group attribute holding member DNs, e.g. 'uniqueMember'
+    :param nested: also return the groups of the groups
+    :param sizelimit: maximum number of entries of a group search, 0 for no limit
+    :param cache: a `TTLCache` for the group graph, None to disable caching
+    '''
+
+    def __init__(self, method='member', base=None, scope=ldap.SCOPE_SUBTREE,
+                 filter='(objectClass=*)', member_attr='member', nested=True,
+                 sizelimit=GROUP_SIZELIMIT, cache=None):
+        if method not in METHODS:
+            raise ValueError("GROUP_SEARCH method must be one of %s, got %r"
+                             % (', '.join(METHODS), method))
+        if method != 'memberOf' and not base:
+            raise ValueError("GROUP_SEARCH method %r requires a base" % (method,))
+        if not filter.startswith('('):
+            filter = '(%s)' % filter
+        self.method = method
+        self.base = base
+        self.scope = scope
+        self.filter = filter
+        self.member_attr = member_attr
+        self.nested = nested
+        self.sizelimit = sizelimit
+        self.cache = cache
+        self.lookups = 0
+
+    @property
+    def attrlist(self):
+        'User attributes the resolver needs from the login search'
+        return ['memberOf'] if self.method == 'memberOf' else []
+
+    def resolve(self, conn, dn, attrs, prepare=None):
+        '''
+        Return the sorted list of group DNs of the user `dn` with attributes `attrs`.
+        `prepare()`, if given, is called before each search on `conn` and
+        returns its time limit in seconds (-1 for none).
+        '''
+        if self.method == 'in_chain':
+            return sorted(self._search(conn, '%s:%s:' % (self.member_attr, IN_CHAIN), dn,
+                                       prepare))
+
+        groups = set()
+        pending = self._direct(conn, dn, attrs, prepare)
+        while pending:
+            group = pending.pop()
+            if group in groups:
+                continue
+            groups.add(group)
+            if self.nested:
+                pending.extend(self.parents(conn, group, prepare))
+        return sorted(groups)
+
+    def _direct(self, conn, dn, attrs, prepare=None):
+        if self.method == 'memberOf':
+            return _attr_values(attrs, 'memberOf')
+        return self._search(conn, self.member_attr, dn, prepare)
+
+    def parents(self, conn, group, prepare=None):
+        'Return the groups `group` is a direct member of, cached'
+        if self.cache is not None:
+            parents = self.cache.get(group)
+            if parents is not None:
+                return list(parents)
+
+        if self.method == 'memberOf':
+            try:
+                results = self._search_ext(conn, prepare, group, ldap.SCOPE_BASE,
+                                           '(objectClass=*)', ['memberOf'])
+            except ldap.NO_SUCH_OBJECT:
+                results = []
+            parents = [p for _, attrs in results if attrs
+                       for p in _attr_values(attrs, 'memberOf')]
+        else:
+            parents = self._search(conn, self.member_attr, group, prepare)
+
+        if self.cache is not None:
+            self.cache.set(group, tuple(parents))
+        return parents
+
+    def _search(self, conn, attr, dn, prepare=None):
+        'DNs of the groups whose `attr` matches `dn`'
+        filt = '(&%s(%s=%s))' % (self.filter, attr, escape_filter_chars(dn))
+        log.debug("Group search base=%s filter=%s", self.base, filt)
+        results = self._search_ext(conn, prepare, self.base, self.scope, filt, ['1.1'])
+        return [group for group, _ in results if group is not None]
+
+    def _search_ext(self, conn, prepare, base, scope, filterstr, attrlist):
+        'One size and time limited group search'
+        self.lookups += 1
+        timeout = prepare() if prepare is not None else -1
+        try:
+            return conn.search_ext_s(base, scope, filterstr, attrlist=attrlist,
+                                     timeout=timeout, sizelimit=self.sizelimit)
+        except ldap.SIZELIMIT_EXCEEDED:
+            log.warning("Group search base=%s filter=%s returned more than %d entries",
+                        base, filterstr, self.sizelimit)
+            raise
+
+
+def compile_group_search(group_search, cache=None):
+    'Return a `GroupResolver` for the GROUP_SEARCH dict, or None if it is not set'
+    if not group_search:
+        return None
+    options = dict(group_search)
+    options.pop('key', None)
+    try:
+        return GroupResolver(cache=cache, **options)
+    except TypeError as err:
+        raise ValueError("Invalid GROUP_SEARCH %r: %s" % (group_search, err))
@@ -0,0 +1,165 @@
+"""
+Instrumentation of the login paths (METRICS).
+
+The `LDAPLoginManager` reports to a `Metrics` object:
+
+* ``timing(phase, seconds, **labels)`` for the duration of each phase of a
+  login: 'connect' (`ldap.initialize` and options), 'start_tls',
+  'service_bind', 'search', 'user_bind', 'groups', 'unbind' and the whole 'login', and
+  the time waited for a 'queue' slot with MAX_CONCURRENT_LOGINS.
+  Labels are `server` (the URI) and, for searches, `base`.
+* ``count(outcome)`` once per login, `outcome` is one of `OUTCOMES`.
+
+`HistogramMetrics` keeps histograms in memory, `PrometheusMetrics` and
+`StatsdMetrics` forward to prometheus_client and a StatsD client.
+Without METRICS no metrics are computed at all.
+"""
+from bisect import bisect_left
+import threading
+
+OUTCOMES = ('success', 'cached', 'bad_password', 'not_found', 'server_error', 'throttled',
+            'unavailable', 'rejected', 'ambiguous')
+
+#: Histogram bucket upper bounds in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Metrics(object):
+    'Instrumentation interface, ignores everything'
+
+    def timing(self, phase, seconds, **labels):
+        'Record that `phase` took `seconds`'
+
+    def count(self, outcome, **labels):
+        'Count a login `outcome`'
+
+
+class Histogram(object):
+    'Bucketed durations with their count, sum and maximum'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        'Upper bound of the bucket holding the `q` quantile (0-1)'
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.sum, 'max': self.max,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))}
+
+
+class HistogramMetrics(Metrics):
+    'Thread-safe in-memory histograms per phase and labels, and outcome counters'
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def timing(self, phase, seconds, **labels):
+        key = (phase, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def count(self, outcome, **labels):
+        key = (outcome, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def snapshot(self):
+        '''
+        Return ``{'timings': [...], 'outcomes': [...]}`` where each timing is a
+        dict with the phase, its labels and the histogram, and each outcome a
+        dict with the outcome, its labels and count.
+        '''
+        with self._lock:
+            timings = [dict(labels, phase=phase, **histogram.as_dict())
+                       for (phase, labels), histogram in sorted(self.histograms.items())]
+            outcomes = [dict(labels, outcome=outcome, count=count)
+                        for (outcome, labels), count in sorted(self.counters.items())]
+        return {'timings': timings, 'outcomes': outcomes}
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+
+class PrometheusMetrics(Metrics):
+    '''
+    Report to prometheus_client as the histogram `<prefix>_phase_seconds`
+    (labels phase, server, base) and the counter `<prefix>_total` (label outcome).
+    '''
+
+    def __init__(self, prefix='ldap_login', registry=None, buckets=BUCKETS):
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImportError("PrometheusMetrics requires the prometheus_client package")
+        kwargs = {} if registry is None else {'registry': registry}
+        self.phases = prometheus_client.Histogram(
+            prefix + '_phase_seconds', 'Duration of the LDAP login phases',
+            ['phase', 'server', 'base'], buckets=buckets, **kwargs)
+        self.outcomes = prometheus_client.Counter(
+            prefix + '_total', 'LDAP logins by outcome', ['outcome'], **kwargs)
+
+    def timing(self, phase, seconds, server='', base='', **labels):
+        self.phases.labels(phase, server or '', base or '').observe(seconds)
+
+    def count(self, outcome, **labels):
+        self.outcomes.labels(outcome).inc()
+
+
+class StatsdMetrics(Metrics):
+    '''
+    Report to a StatsD `client` (e.g. ``statsd.StatsClient``) with
+    ``timing('<prefix>.<phase>', ms)`` and ``incr('<prefix>.<outcome>')``.
+    StatsD has no labels so they are dropped.
+    '''
+
+    def __init__(self, client, prefix='ldap_login'):
+        self.client = client
+        self.prefix = prefix
+
+    def timing(self, phase, seconds, **labels):
+        self.client.timing('%s.%s' % (self.prefix, phase), seconds * 1000)
+
+    def count(self, outcome, **labels):
+        self.client.incr('%s.%s' % (self.prefix, outcome))
+
+
+def compile_metrics(metrics):
+    'Return the `Metrics` for the METRICS config value, None if it is not set'
+    if not metrics:
+        return None
+    if metrics == 'memory':
+        return HistogramMetrics()
+    if isinstance(metrics, Metrics):
+        return metrics
+    raise ValueError("METRICS must be 'memory' or a flask_ldap_login.metrics.Metrics, got %r"
+                     % (metrics,))
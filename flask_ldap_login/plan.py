@@ -0,0 +1,169 @@
+"""
+Compile the LDAP configuration once, in `LDAPLoginManager.init_app`.
+
+The resulting `LoginPlan` holds everything a login needs that does not
+depend on the user: resolved connection options, the attrlist, the
+USER_SEARCH entries and a result formatter specialised for KEY_MAP.
+Configuration errors are raised as `ValueError` when the plan is compiled
+instead of on the first login.
+"""
+from collections import namedtuple
+
+import ldap
+
+#: A compiled USER_SEARCH entry, `filter` is a %-format template
+UserSearch = namedtuple('UserSearch', 'base scope filter')
+
+LoginPlan = namedtuple('LoginPlan', 'options attrlist searches scope format_userdata')
+
+#: Attributes fetched for the userdata without KEY_MAP (USER_ATTRIBUTES)
+DEFAULT_USER_ATTRIBUTES = ('uid', 'cn', 'sn', 'givenName', 'displayName', 'mail',
+                           'sAMAccountName', 'userPrincipalName')
+
+_TEMPLATE_CTX = {'username': 'username', 'password': 'password'}
+
+
+def scalar(value):
+    """
+    Take return a value[0] if `value` is a list of length 1
+    """
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        return value[0]
+    return value
+
+
+def attribute_name(name):
+    'An attribute name as python-ldap expects it: bytes on Python 2, text on Python 3'
+    if str is bytes:
+        return name.encode('utf-8') if not isinstance(name, bytes) else name
+    return name.decode('utf-8') if isinstance(name, bytes) else name
+
+
+def _is_utf8(s):
+    try:
+        if isinstance(s, bytes):
+            s.decode('utf-8')
+
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def check_template(name, template):
+    'Raise ValueError if `template` can not be formatted with a username/password'
+    try:
+        template % _TEMPLATE_CTX
+    except (KeyError, ValueError, TypeError) as err:
+        raise ValueError("Invalid %s template %r: %s" % (name, template, err))
+
+
+def compile_options(options):
+    '''
+    Resolve OPTIONS names and ``OPT_*`` values with python-ldap constants and
+    order them so that OPT_X_TLS_NEWCTX is applied last. Other string values,
+    such as certificate paths, are passed as is.
+
+    :raises ValueError: on unknown option names or ``OPT_*`` values
+
+    There are some settings that can't be changed at runtime without a context restart.
+    It's possible to refresh the context and apply the settings by setting OPT_X_TLS_NEWCTX
+    to 0, but this needs to be the last option set.
+    '''
+    resolved = []
+    for opt, value in options.items():
+        if isinstance(opt, str):
+            try:
+                opt = getattr(ldap, opt)
+            except AttributeError:
+                raise ValueError("Unknown LDAP option %r in OPTIONS" % (opt,))
+
+        if isinstance(value, str) and value.startswith('OPT_'):
+            try:
+                value = getattr(ldap, value)
+            except AttributeError:
+                raise ValueError("Unknown LDAP option value %r in OPTIONS" % (value,))
+        resolved.append((opt, value))
+
+    newctx = getattr(ldap, 'OPT_X_TLS_NEWCTX', None)
+    resolved.sort(key=lambda item: item[0] == newctx)
+    return tuple(resolved)
+
+
+def compile_searches(user_search):
+    'Validate USER_SEARCH and return a tuple of `UserSearch`'
+    searches = []
+    for search in user_search or ():
+        try:
+            base, filt = search['base'], search['filter']
+        except KeyError as err:
+            raise ValueError("USER_SEARCH entry %r is missing %s" % (search, err))
+        check_template('USER_SEARCH filter', filt)
+        searches.append(UserSearch(base, search.get('scope', ldap.SCOPE_SUBTREE), filt))
+    return tuple(searches)
+
+
+def compile_attrlist(keymap, extra_attrs=(), user_attributes=DEFAULT_USER_ATTRIBUTES):
+    '''
+    Transform the KEY_MAP paramiter, or USER_ATTRIBUTES without KEY_MAP, into
+    an attrlist for ldap filters, adding `extra_attrs` needed by other features.
+    Returns None (all attributes) if USER_ATTRIBUTES is '*'.
+    '''
+    if keymap:
+        attrs = list(keymap.values())
+    elif user_attributes == '*':
+        return None
+    else:
+        attrs = list(user_attributes)
+    attrs.extend(attr for attr in extra_attrs if attr not in attrs)
+    # https://github.com/ContinuumIO/flask-ldap-login/issues/11
+    # https://continuumsupport.zendesk.com/agent/tickets/393
+    return [attribute_name(s) for s in attrs]
+
+
+def compile_formatter(keymap):
+    '''
+    Return a ``format_userdata(userobj)`` function turning an ldap entry (with
+    its 'dn' added) into userdata. Attributes whose value is not utf-8 are dropped.
+    '''
+    if keymap:
+        items = tuple(keymap.items())
+
+        def format_userdata(userobj):
+            userdata = {}
+            for key, attr in items:
+                value = scalar(userobj.get(attr))
+                if _is_utf8(value):
+                    userdata[key] = value
+            return userdata
+    else:
+        def format_userdata(userobj):
+            userdata = {}
+            for key, value in userobj.items():
+                value = scalar(value)
+                if _is_utf8(value):
+                    userdata[key] = value
+            return userdata
+
+    return format_userdata
+
+
+def compile_config(config, extra_attrs=()):
+    '''
+    Validate `config` and compile it into a `LoginPlan`. `extra_attrs` are
+    attributes that must be fetched with the user entry even with KEY_MAP.
+    '''
+    check_template('BIND_DN', config['BIND_DN'])
+    if config.get('LAZY_USERDATA'):
+        from .attributes import BINARY_ATTRIBUTES, compile_lazy_formatter
+        format_userdata = compile_lazy_formatter(
+            config.get('KEY_MAP'), config.get('ATTRIBUTE_CODECS'),
+            config.get('BINARY_ATTRIBUTES', BINARY_ATTRIBUTES))
+    else:
+        format_userdata = compile_formatter(config.get('KEY_MAP'))
+    return LoginPlan(options=compile_options(config['OPTIONS']),
+                     attrlist=compile_attrlist(config.get('KEY_MAP'), extra_attrs,
+                                               config.get('USER_ATTRIBUTES',
+                                                          DEFAULT_USER_ATTRIBUTES)),
+                     searches=compile_searches(config.get('USER_SEARCH')),
+                     scope=config.get('SCOPE', ldap.SCOPE_SUBTREE),
+                     format_userdata=format_userdata)
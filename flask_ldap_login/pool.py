@@ -0,0 +1,239 @@
+"""
+A bounded, thread-safe pool of LDAP connections.
+
+Connections are created lazily by a factory, checked out for the duration of a
+single login and handed back afterwards.  Connections that sat idle for too
+long, outlived their maximum lifetime or fail a health check are unbound and
+replaced.  A connection that raised a transport level error (server down,
+timeout, ...) is never put back.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+import ldap
+
+from .errors import PoolExhausted
+
+log = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
+#: Errors after which a connection can not be trusted any more
+TRANSPORT_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+
+def close_connection(conn):
+    'Unbind `conn`, ignoring errors from a connection that is already gone'
+    try:
+        conn.unbind_s()
+    except ldap.LDAPError as err:
+        log.debug("Error while unbinding pooled connection: %r", err)
+
+
+def connection_deadline(conn):
+    'Return the login deadline of a pooled connection, None for other connections'
+    if isinstance(conn, PooledConnection):
+        return conn.deadline
+    return None
+
+
+class PooledConnection(object):
+    '''
+    Book-keeping wrapper around an LDAP connection owned by a `ConnectionPool`.
+    Attribute access is forwarded to the wrapped connection so this object can
+    be used in place of it.
+
+    `deadline` is the clock time by which the login using the connection
+    must be done, or None.
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = self.last_used = _clock()
+        self.deadline = None
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+    def __repr__(self):
+        return '<PooledConnection %r>' % (self.conn,)
+
+
+class ConnectionPool(object):
+    '''
+    Hold at most `size` connections created with `factory`.
+
+    :param factory: callable returning a new, configured LDAP connection
+    :param size: maximum number of open connections. If `0` no connection is
+        kept: every checkout creates a connection and unbinds it afterwards.
+    :param timeout: seconds to wait for a free connection before raising
+        `PoolExhausted` (`None` waits forever)
+    :param idle_timeout: unbind connections that were not used for this long
+    :param max_lifetime: unbind connections older than this
+    :param check_interval: run a `whoami_s` health check on connections that
+        were idle for longer than this before handing them out
+    :param validate: optional callable; idle connections for which it returns
+        False are unbound instead of being handed out
+    :param on_transport_error: optional callable, called with the connection
+        when it is discarded because of a transport error
+    '''
+
+    def __init__(self, factory, size=10, timeout=None, idle_timeout=300,
+                 max_lifetime=None, check_interval=60, validate=None,
+                 on_transport_error=None):
+        self.factory = factory
+        self.validate = validate
+        self.on_transport_error = on_transport_error
+        self.size = size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.check_interval = check_interval
+
+        # Idle connections, most recently used last.
+        self._idle = []
+        self._open = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def __len__(self):
+        'Number of open connections (idle or checked out)'
+        return self._open
+
+    @property
+    def idle(self):
+        'Number of idle connections'
+        return len(self._idle)
+
+    def _is_stale(self, pconn, now):
+        if self.idle_timeout is not None and now - pconn.last_used > self.idle_timeout:
+            return True
+        if self.max_lifetime is not None and now - pconn.created > self.max_lifetime:
+            return True
+        return False
+
+    def _is_healthy(self, pconn, now):
+        if self.validate is not None and not self.validate(pconn.conn):
+            return False
+        if self.check_interval is None or now - pconn.last_used <= self.check_interval:
+            return True
+        try:
+            pconn.conn.whoami_s()
+        except ldap.LDAPError as err:
+            log.debug("Pooled connection failed health check: %r", err)
+            return False
+        return True
+
+    def _reap(self, now):
+        'Pop stale idle connections. Must be called with the lock held.'
+        stale = []
+        # The oldest idle connections are at the front of the list
+        while self._idle and self._is_stale(self._idle[0], now):
+            stale.append(self._idle.pop(0))
+        self._open -= len(stale)
+        return stale
+
+    def acquire(self, timeout=None):
+        '''
+        Check out a connection, creating one if the pool is not full.
+        `timeout` limits the wait further than the pool timeout.
+        '''
+        if timeout is None or (self.timeout is not None and self.timeout < timeout):
+            timeout = self.timeout
+        deadline = None if timeout is None else _clock() + timeout
+
+        while True:
+            with self._cond:
+                stale = self._reap(_clock())
+                pconn = None
+                create = False
+                while pconn is None and not create:
+                    if self._idle:
+                        pconn = self._idle.pop()
+                    elif self.size <= 0 or self._open < self.size:
+                        self._open += 1
+                        create = True
+                    else:
+                        remaining = None if deadline is None else deadline - _clock()
+                        if remaining is not None and remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+
+            for old in stale:
+                close_connection(old.conn)
+
+            if pconn is None and not create:
+                raise PoolExhausted("Timed out waiting for a pooled LDAP connection",
+                                    size=self.size)
+
+            if create:
+                try:
+                    return PooledConnection(self.factory())
+                except Exception:
+                    self._forget()
+                    raise
+
+            if self._is_healthy(pconn, _clock()):
+                return pconn
+
+            close_connection(pconn.conn)
+            self._forget()
+
+    def _forget(self):
+        'A checked out connection was dropped, make room for a new one'
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def release(self, pconn, discard=False):
+        'Return a connection to the pool, or unbind it if `discard` is set'
+        if discard or self.size <= 0:
+            close_connection(pconn.conn)
+            self._forget()
+            return
+
+        now = _clock()
+        pconn.last_used = now
+        with self._cond:
+            self._idle.append(pconn)
+            stale = self._reap(now)
+            self._cond.notify()
+
+        for old in stale:
+            close_connection(old.conn)
+
+    def connection(self, timeout=None):
+        '''
+        Context manager checking out a connection for the duration of the block.
+        The connection is discarded if the block raises a transport error.
+        '''
+        return self.checked_out(self.acquire(timeout))
+
+    @contextmanager
+    def checked_out(self, pconn):
+        'Context manager releasing the acquired connection `pconn` at the end of the block'
+        try:
+            yield pconn
+        except TRANSPORT_ERRORS:
+            self.release(pconn, discard=True)
+            if self.on_transport_error is not None:
+                self.on_transport_error(pconn.conn)
+            raise
+        except ldap.LDAPError:
+            self.release(pconn)
+            raise
+        except BaseException:
+            self.release(pconn, discard=True)
+            raise
+        else:
+            self.release(pconn)
+
+    def close(self):
+        'Unbind all idle connections'
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for pconn in idle:
+            close_connection(pconn.conn)
@@ -0,0 +1,392 @@
+"""
+Record LDAP traffic in production and replay it offline (RECORD_PATH).
+
+With RECORD_PATH set, the `LDAPLoginManager` wraps its connections in a
+`RecordingConnection` and appends one JSON line per login and per operation
+(initialize, bind, search, whoami, start_tls, unbind) to the file: when it
+started, how long it took, the DN or search it was for and its error or, for
+searches, the returned entries. Passwords are never written and attribute
+values are replaced by their length; DNs, search filters and usernames are
+kept since the replay needs them.
+
+A `ReplayDirectory` built from the log answers binds and searches like the
+recorded directory, with the recorded latencies, and `run_replay` drives
+``ldap_login`` with the recorded logins::
+
+    directory = ReplayDirectory(read_log('ldap.log'))
+    with stand_in(directory):
+        result = run_replay(manager.ldap_login, directory.logins, threads=8)
+
+See ``benchmarks/replay_login.py``.
+"""
+from contextlib import contextmanager
+import itertools
+import json
+import os
+import threading
+import time
+
+import ldap
+
+from .bench import summarize
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def redact_results(results):
+    'Search results with the attribute values replaced by their lengths'
+    entries = []
+    for dn, attrs in results or ():
+        if dn is None:
+            # A search reference, only keep the number of URLs
+            entries.append([None, len(attrs or ())])
+            continue
+        redacted = {}
+        for name, values in attrs.items():
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            redacted[name] = [len(value) for value in values]
+        entries.append([dn, redacted])
+    return entries
+
+
+def restore_results(entries):
+    'Search results with placeholder values of the lengths in redacted `entries`'
+    results = []
+    for dn, attrs in entries:
+        if dn is None:
+            results.append((None, ['ldap:///'] * attrs))
+        else:
+            results.append((dn, dict((name, [b'x' * length for length in lengths])
+                                     for name, lengths in attrs.items())))
+    return results
+
+
+def operation_key(event):
+    'What a recorded operation is answered by: the bind DN, the search or the operation'
+    if event['op'] == 'bind':
+        return 'bind', event['who']
+    if event['op'] == 'search':
+        return 'search', event['base'], event['scope'], event['filter']
+    return event['op'],
+
+
+def _search_event(base, scope, filterstr):
+    return {'op': 'search', 'base': base, 'scope': scope, 'filter': filterstr}
+
+
+class Recorder(object):
+    'Append recorded events to the log file `path` as JSON lines'
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'a')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def connection(self, conn, uri, start):
+        'Record the connection `conn` to `uri` initialized at `start` and return its proxy'
+        conn_id = '%d-%d' % (os.getpid(), next(self._ids))
+        self.record({'op': 'initialize', 'uri': uri}, conn_id, start)
+        return RecordingConnection(conn, self, conn_id)
+
+    def login(self, username):
+        'Record the start of a login'
+        self.write({'op': 'login', 't': round(time.time(), 6), 'username': username})
+
+    def record(self, event, conn_id, start, results=None, error=None):
+        'Record the operation `event` on connection `conn_id` started at `start`'
+        elapsed = _clock() - start
+        event = dict(event, conn=conn_id, t=round(time.time() - elapsed, 6),
+                     elapsed=round(elapsed, 6))
+        if error is not None:
+            event['error'] = type(error).__name__
+        elif event['op'] == 'search':
+            event['results'] = redact_results(results)
+        self.write(event)
+
+    def write(self, event):
+        line = json.dumps(event, sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class RecordingConnection(object):
+    '''
+    Proxy of the ldap connection `conn` recording its operations. Other
+    attributes are read from and set on `conn`.
+    '''
+
+    def __init__(self, conn, recorder, conn_id):
+        self.__dict__.update(_conn=conn, _recorder=recorder, _id=conn_id, _pending={})
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def _call(self, event, func, *args, **kwargs):
+        start = _clock()
+        try:
+            result = func(*args, **kwargs)
+        except ldap.LDAPError as err:
+            self._recorder.record(event, self._id, start, error=err)
+            raise
+        self._recorder.record(event, self._id, start, results=result)
+        return result
+
+    def simple_bind_s(self, who='', cred='', *args, **kwargs):
+        return self._call({'op': 'bind', 'who': who}, self._conn.simple_bind_s,
+                          who, cred, *args, **kwargs)
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', *args, **kwargs):
+        return self._call(_search_event(base, scope, filterstr), self._conn.search_s,
+                          base, scope, filterstr, *args, **kwargs)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', *args, **kwargs):
+        return self._call(_search_event(base, scope, filterstr), self._conn.search_ext_s,
+                          base, scope, filterstr, *args, **kwargs)
+
+    def whoami_s(self, *args, **kwargs):
+        return self._call({'op': 'whoami'}, self._conn.whoami_s, *args, **kwargs)
+
+    def start_tls_s(self):
+        return self._call({'op': 'start_tls'}, self._conn.start_tls_s)
+
+    def unbind_s(self, *args, **kwargs):
+        return self._call({'op': 'unbind'}, self._conn.unbind_s, *args, **kwargs)
+
+    def simple_bind(self, who='', cred='', *args, **kwargs):
+        msgid = self._conn.simple_bind(who, cred, *args, **kwargs)
+        self._pending[msgid] = {'op': 'bind', 'who': who}, _clock()
+        return msgid
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', *args, **kwargs):
+        msgid = self._conn.search_ext(base, scope, filterstr, *args, **kwargs)
+        self._pending[msgid] = _search_event(base, scope, filterstr), _clock()
+        return msgid
+
+    def result3(self, msgid, *args, **kwargs):
+        'Record an asynchronous operation once its results arrived'
+        try:
+            rtype, rdata, rmsgid, controls = self._conn.result3(msgid, *args, **kwargs)
+        except ldap.LDAPError as err:
+            if msgid in self._pending:
+                event, start = self._pending.pop(msgid)
+                self._recorder.record(event, self._id, start, error=err)
+            raise
+        if rtype is not None and msgid in self._pending:
+            event, start = self._pending.pop(msgid)
+            self._recorder.record(event, self._id, start, results=rdata)
+        return rtype, rdata, rmsgid, controls
+
+    def abandon(self, msgid):
+        self._pending.pop(msgid, None)
+        return self._conn.abandon(msgid)
+
+
+def read_log(path):
+    'Read the events of a RECORD_PATH log'
+    with open(path) as fd:
+        return [json.loads(line) for line in fd if line.strip()]
+
+
+class ReplayDirectory(object):
+    '''
+    Stand-in directory answering binds by DN and searches by base, scope and
+    filter with the responses recorded in `events`, cycling through them, after
+    the recorded latency times `latency_scale`. Operations that were not
+    recorded succeed at once, searches with no entries, and are counted in
+    `misses`.
+
+    `logins` are the recorded ``(offset, username)`` logins, offsets in seconds
+    from the first one.
+
+    Use it in place of `ldap.initialize` with `stand_in`.
+    '''
+
+    def __init__(self, events, latency_scale=1.0):
+        self.latency_scale = latency_scale
+        self.responses = {}
+        self.logins = []
+        self.operations = dict.fromkeys(('connect', 'bind', 'search'), 0)
+        self.misses = 0
+        self._next = {}
+        self._lock = threading.Lock()
+
+        connects = []
+        for event in events:
+            if event['op'] == 'login':
+                self.logins.append((event['t'], event['username']))
+            elif event['op'] == 'initialize':
+                connects.append(event['elapsed'])
+            else:
+                self.responses.setdefault(operation_key(event), []).append(event)
+        self.connect_latency = sum(connects) / len(connects) if connects else 0.0
+        if self.logins:
+            first = min(t for t, _ in self.logins)
+            self.logins = sorted((t - first, username) for t, username in self.logins)
+
+    def _sleep(self, seconds):
+        if seconds and self.latency_scale:
+            time.sleep(seconds * self.latency_scale)
+
+    def respond(self, key, counter):
+        '''
+        Answer the operation `key` with its next recorded response: return its
+        restored results or raise its error
+        '''
+        with self._lock:
+            self.operations[counter] += 1
+            responses = self.responses.get(key)
+            if not responses:
+                self.misses += 1
+                return []
+            position = self._next.get(key, 0)
+            self._next[key] = (position + 1) % len(responses)
+        event = responses[position]
+        self._sleep(event['elapsed'])
+        if 'error' in event:
+            error = getattr(ldap, event['error'], None)
+            if not (isinstance(error, type) and issubclass(error, ldap.LDAPError)):
+                error = ldap.LDAPError
+            raise error({'desc': "Replayed %s" % event['error']})
+        return restore_results(event.get('results', ()))
+
+    def initialize(self, uri):
+        with self._lock:
+            self.operations['connect'] += 1
+        self._sleep(self.connect_latency)
+        return ReplayConnection(self, uri)
+
+    def stats(self):
+        'Return the replayed operations and the operations that were not recorded'
+        with self._lock:
+            return dict(self.operations, misses=self.misses)
+
+
+class ReplayConnection(object):
+    'A connection to a `ReplayDirectory`'
+
+    def __init__(self, directory, uri):
+        self.directory = directory
+        self._uri = uri
+        self._pending = {}
+        self._msgids = itertools.count(1)
+
+    def set_option(self, option, value):
+        pass
+
+    def start_tls_s(self):
+        self.directory.respond(('start_tls',), 'connect')
+
+    def simple_bind_s(self, who='', cred='', *args, **kwargs):
+        self.directory.respond(('bind', who), 'bind')
+
+    def whoami_s(self, *args, **kwargs):
+        self.directory.respond(('whoami',), 'search')
+        return ''
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', *args, **kwargs):
+        return self.directory.respond(('search', base, scope, filterstr), 'search')
+
+    search_ext_s = search_s
+
+    def _submit(self, rtype, func, *args):
+        msgid = next(self._msgids)
+        try:
+            self._pending[msgid] = rtype, func(*args), None
+        except ldap.LDAPError as err:
+            self._pending[msgid] = rtype, None, err
+        return msgid
+
+    def simple_bind(self, who='', cred='', *args, **kwargs):
+        return self._submit(ldap.RES_BIND, self.simple_bind_s, who)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', *args, **kwargs):
+        return self._submit(ldap.RES_SEARCH_RESULT, self.search_s, base, scope, filterstr)
+
+    def result3(self, msgid, all=1, timeout=None):
+        rtype, data, err = self._pending.pop(msgid)
+        if err is not None:
+            raise err
+        return rtype, data, msgid, []
+
+    def abandon(self, msgid):
+        self._pending.pop(msgid, None)
+
+    def unbind_s(self):
+        pass
+
+
+@contextmanager
+def stand_in(directory):
+    'Make `ldap.initialize` connect to `directory` instead of a server'
+    initialize = ldap.initialize
+    ldap.initialize = directory.initialize
+    try:
+        yield directory
+    finally:
+        ldap.initialize = initialize
+
+
+def run_replay(login, logins, threads=4, speed=1.0, password='replay'):
+    '''
+    Call ``login(username, password)`` for the recorded ``(offset, username)``
+    `logins` from `threads` threads. Each login starts `offset` / `speed`
+    seconds after the replay started, or as soon as a thread is free if it is
+    late. With a `speed` of 0 the logins run back to back.
+
+    Returns the `flask_ldap_login.bench.summarize` dict, with the average
+    delay of the login starts behind the recorded schedule in `lag_ms`.
+    '''
+    pending = iter(logins)
+    lock = threading.Lock()
+    latencies = []
+    errors = {}
+    counters = {'failures': 0, 'lag': 0.0}
+    start = _clock()
+
+    def worker():
+        while True:
+            with lock:
+                try:
+                    offset, username = next(pending)
+                except StopIteration:
+                    return
+            if speed:
+                delay = start + offset / speed - _clock()
+                if delay > 0:
+                    time.sleep(delay)
+            begin = _clock()
+            lag = begin - start - (offset / speed if speed else 0)
+            try:
+                userdata = login(username, password)
+            except Exception as err:
+                with lock:
+                    name = type(err).__name__
+                    errors[name] = errors.get(name, 0) + 1
+                continue
+            elapsed = _clock() - begin
+            with lock:
+                latencies.append(elapsed)
+                counters['lag'] += max(lag, 0)
+                if userdata is None:
+                    counters['failures'] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    result = summarize(threads, _clock() - start, latencies, counters['failures'], errors)
+    result['lag_ms'] = (round(1000 * counters['lag'] / len(latencies), 3)
+                        if latencies and speed else None)
+    return result
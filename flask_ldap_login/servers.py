@@ -0,0 +1,140 @@
+"""
+Health and latency book-keeping for the LDAP servers in SERVERS.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+def connection_uri(conn):
+    'Return the URI an ldap connection was initialized with'
+    return getattr(conn, '_uri', None)
+
+
+class Server(object):
+    'State of one LDAP server'
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.failures = 0
+        self.down_until = None
+        self.latency = None
+
+    def available(self, now):
+        'True if the server is up or its backoff has elapsed'
+        return self.down_until is None or self.down_until <= now
+
+    def as_dict(self, now):
+        return {'uri': self.uri, 'up': self.down_until is None,
+                'available': self.available(now), 'failures': self.failures,
+                'latency': self.latency}
+
+
+class ServerSet(object):
+    '''
+    Route connections to the fastest available server.
+
+    Servers that fail are marked down for an exponentially growing backoff
+    (`backoff`, doubled per consecutive failure up to `max_backoff` seconds).
+    Once the backoff elapsed the server is tried again; a success marks it up.
+    Bind latencies are tracked as a moving average with weight `alpha`.
+    '''
+
+    def __init__(self, uris, backoff=1, max_backoff=300, alpha=0.2):
+        if not uris:
+            raise ValueError("At least one LDAP server is required")
+        self.servers = [Server(uri) for uri in uris]
+        self._by_uri = dict((server.uri, server) for server in self.servers)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._probe_thread = None
+        self._stop = threading.Event()
+
+    def __len__(self):
+        return len(self.servers)
+
+    def select(self):
+        '''
+        Return the URI of the available server with the lowest bind latency.
+        Servers without latency samples are tried first. If every server is
+        down, the one whose backoff ends first is returned.
+        '''
+        now = _clock()
+        with self._lock:
+            available = [s for s in self.servers if s.available(now)]
+            if not available:
+                return min(self.servers, key=lambda s: s.down_until).uri
+            return min(available, key=lambda s: s.latency or 0).uri
+
+    def available(self, uri):
+        'True if `uri` is not marked down (unknown URIs are always available)'
+        server = self._by_uri.get(uri)
+        return server is None or server.available(_clock())
+
+    def record_success(self, uri, latency=None):
+        'Mark `uri` up, optionally adding a bind `latency` sample in seconds'
+        server = self._by_uri.get(uri)
+        if server is None:
+            return
+        with self._lock:
+            if server.down_until is not None:
+                log.info("LDAP server %s is up", uri)
+            server.failures = 0
+            server.down_until = None
+            if latency is not None:
+                if server.latency is None:
+                    server.latency = latency
+                else:
+                    server.latency += self.alpha * (latency - server.latency)
+
+    def record_failure(self, uri):
+        'Mark `uri` down for the next backoff interval'
+        server = self._by_uri.get(uri)
+        if server is None:
+            return
+        with self._lock:
+            server.failures += 1
+            delay = min(self.backoff * 2 ** (server.failures - 1), self.max_backoff)
+            server.down_until = _clock() + delay
+        log.warning("LDAP server %s is down, retrying in %ss", uri, delay)
+
+    def stats(self):
+        'Return a list with the state of each server'
+        now = _clock()
+        with self._lock:
+            return [server.as_dict(now) for server in self.servers]
+
+    def start_probes(self, probe, interval):
+        '''
+        Start a daemon thread calling ``probe(uri)`` for every server each
+        `interval` seconds. `probe` returns the bind latency or raises.
+        '''
+        if self._probe_thread is not None:
+            return
+
+        def run():
+            while True:
+                for server in self.servers:
+                    try:
+                        latency = probe(server.uri)
+                    except Exception as err:
+                        log.debug("Probe of %s failed: %r", server.uri, err)
+                        self.record_failure(server.uri)
+                    else:
+                        self.record_success(server.uri, latency)
+                if self._stop.wait(interval):
+                    return
+
+        self._probe_thread = threading.Thread(target=run, name='flask-ldap-login-probe')
+        self._probe_thread.daemon = True
+        self._probe_thread.start()
+
+    def stop_probes(self):
+        'Stop the probe thread after its current round'
+        self._stop.set()
@@ -0,0 +1,104 @@
+"""
+Coalescing of concurrent identical logins (COALESCE_LOGINS).
+
+While a login for a username/password pair is in flight, other logins with
+the same pair wait for its result instead of repeating the same binds and
+searches. The pair is keyed by a salted HMAC so passwords are not kept.
+"""
+import copy
+import hashlib
+import hmac
+import logging
+import os
+import threading
+
+log = logging.getLogger(__name__)
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+class _Call(object):
+    'An in-flight call and, once `done` is set, its result or error'
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''
+    Run a function once for all concurrent calls with the same key.
+
+    The first caller of `do` for a key (the leader) runs the function, the
+    callers arriving while it runs (followers) get a copy of its return value
+    or its exception. A follower waits at most `timeout` seconds, then runs
+    the function itself so a stuck leader can not hang it.
+
+    `futures` holds the in-flight calls of `flask_ldap_login.aio`.
+
+    :param timeout: seconds a follower waits for the leader (None waits forever)
+    '''
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.salt = os.urandom(16)
+        self.coalesced = 0
+        self.timeouts = 0
+        self.futures = {}
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def key(self, username, password):
+        'Return the key of a username/password pair'
+        secret = _to_bytes(username) + b'\0' + _to_bytes(password)
+        return hmac.new(self.salt, secret, hashlib.sha256).digest()
+
+    def do(self, key, func, *args):
+        'Return ``func(*args)``, shared with the concurrent calls for `key`'
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if call.done.wait(self.timeout):
+                return self.share(call.value, call.error)
+            self.timed_out()
+            return func(*args)
+
+        try:
+            call.value = func(*args)
+        except BaseException as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value
+
+    def share(self, value, error=None):
+        'Return a copy of the leader `value` to a follower, or raise its `error`'
+        if error is not None:
+            raise error
+        return copy.deepcopy(value)
+
+    def timed_out(self):
+        'Book-keeping for a follower that stopped waiting for its leader'
+        with self._lock:
+            self.timeouts += 1
+        log.warning("Coalesced login still running after %ss, logging in separately",
+                    self.timeout)
+
+    def stats(self):
+        'Return a dict with the in-flight, coalesced and timed out calls'
+        return {'in_flight': len(self._calls) + len(self.futures),
+                'coalesced': self.coalesced, 'timeouts': self.timeouts}
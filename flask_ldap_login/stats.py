@@ -0,0 +1,51 @@
+"""
+Statistics on the USER_SEARCH entries used to order them adaptively.
+"""
+import threading
+import time
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class SearchStats(object):
+    '''
+    Per USER_SEARCH entry counts of searches, hits (searches that found an
+    entry) and a moving average of the search latency.
+
+    :param searches: the USER_SEARCH list
+    :param alpha: weight of the latest sample in the latency moving average
+    '''
+
+    def __init__(self, searches, alpha=0.2):
+        self.searches = searches
+        self.alpha = alpha
+        self._counts = [[0, 0, None] for _ in searches]
+        self._lock = threading.Lock()
+
+    def record(self, index, hit, latency):
+        'Record one search of entry `index` that took `latency` seconds'
+        with self._lock:
+            counts = self._counts[index]
+            counts[0] += 1
+            if hit:
+                counts[1] += 1
+            if counts[2] is None:
+                counts[2] = latency
+            else:
+                counts[2] += self.alpha * (latency - counts[2])
+
+    def order(self):
+        '''
+        Return the entry indexes with the most hits first. Entries with equal
+        hits keep their configuration order.
+        '''
+        with self._lock:
+            hits = [counts[1] for counts in self._counts]
+        return sorted(range(len(hits)), key=lambda index: -hits[index])
+
+    def stats(self):
+        'Return a list with a dict of statistics for each entry, in configuration order'
+        with self._lock:
+            return [{'base': search['base'], 'filter': search['filter'],
+                     'searches': counts[0], 'hits': counts[1], 'latency': counts[2]}
+                    for search, counts in zip(self.searches, self._counts)]
@@ -0,0 +1,270 @@
+"""
+Cache stores shared between processes (CACHE_BACKEND).
+
+The login cache and the username to DN cache keep their entries in a store
+with the interface of `flask_ldap_login.cache.TTLCache`: ``get(key,
+default=None)``, ``set(key, value, ttl=None)``, ``delete(key)``, ``clear()``
+and ``stats()``. Keys are usernames. The shared stores pickle the values and
+sign them with an HMAC keyed by CACHE_SALT (or the application SECRET_KEY):
+an entry written without the secret, or moved to another key, is ignored
+instead of unpickled.
+
+A backend is a callable ``backend(name, maxsize, ttl)`` returning the store
+of the cache `name` ('login' or 'dn'). Besides the default in-process
+`memory_backend`, `FileBackend` shares the caches between the worker
+processes of one host (e.g. a pre-fork gunicorn) through an SQLite file and
+`RedisBackend` between hosts through a Redis client.
+
+Shared entries only hold salted PBKDF2 hashes of the passwords, with the
+same CACHE_SALT in every process.
+"""
+import copy
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from .cache import TTLCache
+
+log = logging.getLogger(__name__)
+
+#: Prune expired and excess entries of a `FileCache` every this many `set` calls
+PRUNE_INTERVAL = 64
+
+
+def memory_backend(name, maxsize, ttl):
+    'The default backend: an in-process `TTLCache`'
+    return TTLCache(maxsize=maxsize, ttl=ttl)
+
+
+class Serializer(object):
+    '''
+    Pickles the values of the store `name` signed with an HMAC-SHA256 keyed
+    by `secret`. `loads` checks the signature before unpickling, so only
+    values written with the same secret, for the same store and key, are
+    ever unpickled.
+    '''
+
+    def __init__(self, secret, name):
+        if not secret:
+            raise ValueError("Shared cache stores require a secret to sign their entries")
+        if not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self.key = hmac.new(secret, b'flask_ldap_login.stores', hashlib.sha256).digest()
+        self.name = name
+
+    def _signature(self, key, data):
+        message = b'\0'.join([self.name.encode('utf-8'), key.encode('utf-8'), data])
+        return hmac.new(self.key, message, hashlib.sha256).digest()
+
+    def dumps(self, key, value):
+        'The signed pickle of the `value` of `key`'
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return self._signature(key, data) + data
+
+    def loads(self, key, value):
+        'Unpickle the `value` of `key`, raise ValueError if its signature is wrong'
+        value = bytes(value)
+        size = hashlib.sha256().digest_size
+        signature, data = value[:size], value[size:]
+        if not hmac.compare_digest(signature, self._signature(key, data)):
+            raise ValueError("Bad signature")
+        return pickle.loads(data)
+
+
+class FileCache(object):
+    '''
+    A store in the SQLite database `path`, shared by the processes of a host.
+
+    Expiry times are wall clock times so that all processes agree on them.
+    Once the store holds more than `maxsize` entries the ones expiring first
+    are evicted. Values are signed with `secret`, see `Serializer`.
+    '''
+
+    def __init__(self, path, name='cache', maxsize=1024, ttl=300, secret=None):
+        self.path = path
+        self.name = name
+        self.serializer = Serializer(secret, name)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self.expirations = 0
+        self._sets = 0
+        self._local = threading.local()
+        # Only the owner may read the password hashes. SQLite creates the
+        # -wal and -shm files with the permissions of the database file.
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        self._execute('CREATE TABLE IF NOT EXISTS entries (name TEXT, key TEXT, expires REAL, '
+                      'value BLOB, PRIMARY KEY (name, key))')
+        self._execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (name, expires)')
+
+    def _connection(self):
+        'Connection of this thread, connections are not shared with forked processes'
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _execute(self, sql, *params):
+        return self._connection().execute(sql, params)
+
+    def __len__(self):
+        return self._execute('SELECT COUNT(*) FROM entries WHERE name = ? AND expires > ?',
+                             self.name, time.time()).fetchone()[0]
+
+    def get(self, key, default=None):
+        'Return the value for `key` or `default` if it is missing or expired'
+        row = self._execute('SELECT expires, value FROM entries WHERE name = ? AND key = ?',
+                            self.name, key).fetchone()
+        if row is None:
+            return default
+        expires, value = row
+        if expires <= time.time():
+            self.expirations += 1
+            self.delete(key)
+            return default
+        return _loads(self.serializer, key, value, default)
+
+    def set(self, key, value, ttl=None):
+        'Store `value` for `key`, for `ttl` seconds if given'
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        value = sqlite3.Binary(self.serializer.dumps(key, value))
+        self._execute('INSERT OR REPLACE INTO entries (name, key, expires, value) '
+                      'VALUES (?, ?, ?, ?)', self.name, key, expires, value)
+        self._sets += 1
+        if self._sets % PRUNE_INTERVAL == 0:
+            self.prune()
+
+    def delete(self, key):
+        'Remove `key` from the store'
+        self._execute('DELETE FROM entries WHERE name = ? AND key = ?', self.name, key)
+
+    def clear(self):
+        'Remove all entries of this store'
+        self._execute('DELETE FROM entries WHERE name = ?', self.name)
+
+    def prune(self):
+        'Remove the expired entries and evict the entries over `maxsize`'
+        cursor = self._execute('DELETE FROM entries WHERE name = ? AND expires <= ?',
+                               self.name, time.time())
+        self.expirations += max(cursor.rowcount, 0)
+        excess = len(self) - self.maxsize
+        if excess > 0:
+            cursor = self._execute(
+                'DELETE FROM entries WHERE name = ? AND key IN (SELECT key FROM entries '
+                'WHERE name = ? ORDER BY expires LIMIT ?)', self.name, self.name, excess)
+            self.evictions += max(cursor.rowcount, 0)
+
+    def stats(self):
+        'Return a dict of store statistics, evictions and expirations are per process'
+        return {'size': len(self), 'maxsize': self.maxsize,
+                'evictions': self.evictions, 'expirations': self.expirations}
+
+
+class FileBackend(object):
+    '''
+    Backend of `FileCache` stores in the SQLite database `path`, signing
+    their values with `secret` (by default the secret of the manager)
+    '''
+
+    def __init__(self, path, secret=None):
+        self.path = path
+        self.secret = secret
+
+    def __call__(self, name, maxsize, ttl):
+        return FileCache(self.path, name, maxsize=maxsize, ttl=ttl, secret=self.secret)
+
+
+class RedisCache(object):
+    '''
+    A store in Redis under the keys ``<prefix>:<name>:<key>``. Entries expire
+    with Redis key expiry, `maxsize` is left to the Redis eviction policy.
+    Values are signed with `secret`, see `Serializer`.
+
+    :param client: a ``redis.Redis`` client, or any client with the same
+        `get`, `set`, `delete` and `scan_iter` methods
+    '''
+
+    def __init__(self, client, name='cache', ttl=300, prefix='ldap_login', secret=None):
+        self.client = client
+        self.name = name
+        self.serializer = Serializer(secret, name)
+        self.ttl = ttl
+        self.prefix = '%s:%s:' % (prefix, name)
+
+    def get(self, key, default=None):
+        'Return the value for `key` or `default` if it is missing or expired'
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return default
+        return _loads(self.serializer, key, value, default)
+
+    def set(self, key, value, ttl=None):
+        'Store `value` for `key`, for `ttl` seconds if given'
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, self.serializer.dumps(key, value),
+                        px=max(int(ttl * 1000), 1))
+
+    def delete(self, key):
+        'Remove `key` from the store'
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        'Remove all entries of this store'
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+    def stats(self):
+        return {'prefix': self.prefix}
+
+
+class RedisBackend(object):
+    '''
+    Backend of `RedisCache` stores using the Redis `client`, signing their
+    values with `secret` (by default the secret of the manager)
+    '''
+
+    def __init__(self, client, prefix='ldap_login', secret=None):
+        self.client = client
+        self.prefix = prefix
+        self.secret = secret
+
+    def __call__(self, name, maxsize, ttl):
+        return RedisCache(self.client, name, ttl=ttl, prefix=self.prefix, secret=self.secret)
+
+
+def _loads(serializer, key, value, default):
+    'The value of `key` loaded with `serializer`, `default` if it was not signed by us'
+    try:
+        return serializer.loads(key, value)
+    except ValueError:
+        log.warning("Ignoring the cache entry of %s: bad signature", key)
+        return default
+
+
+def compile_cache_backend(backend, path=None, secret=None):
+    '''
+    Return the backend for the CACHE_BACKEND config value: 'memory', 'file'
+    (with CACHE_PATH) or a backend callable. A backend with a `secret`
+    attribute of None is copied with `secret` to sign its entries.
+    '''
+    if backend in (None, 'memory'):
+        return memory_backend
+    if backend == 'file':
+        if not path:
+            raise ValueError("CACHE_BACKEND 'file' requires CACHE_PATH")
+        return FileBackend(path, secret)
+    if callable(backend):
+        if getattr(backend, 'secret', False) is None:
+            backend = copy.copy(backend)
+            backend.secret = secret
+        return backend
+    raise ValueError("CACHE_BACKEND must be 'memory', 'file' or a backend callable, got %r"
+                     % (backend,))
@@ -1,3 +1,9 @@
+import itertools
+import random
+import re
+import threading
+import time
+
 import ldap
 from mock import patch
 #===============================================================================
@@ -9,6 +15,22 @@ MOCK_LDAP_USERS = {('x=user1', 'pass1'): [['x=user1', {'key':['value1'],
               ('x=user2', 'pass2'):[['x=user2', {'key':['value2'],
                                              'uid':'user2'}]]}
 
+def project(results, attrlist):
+    '''
+    Keep the attributes of `results` listed in `attrlist` like a server does.
+    Attribute names must be native strings like python-ldap requires.
+    '''
+    if results is None or attrlist is None:
+        return results
+    if not all(isinstance(attr, str) for attr in attrlist):
+        raise TypeError("expected string in list")
+    if '*' in attrlist:
+        return results
+    wanted = set(attr.lower() for attr in attrlist)
+    return [[dn, dict((name, value) for name, value in attrs.items()
+                      if name.lower() in wanted)]
+            for dn, attrs in results]
+
 def simple_bind_s(username, password):
     if (username, password) not in MOCK_LDAP_USERS:
         raise ldap.INVALID_CREDENTIALS
@@ -20,11 +42,18 @@ def test_keys(keys, results):
     for k, v in keys:
         if k not in results:
             return False
-        if results[k] == v or results[k] == [v]:
+        if v == '*' or results[k] == v or results[k] == [v]:
             return True
 
 def search_s(base, scope, filtstr=None, attrlist=None):
-    if filtstr:
+    return project(_search(base, scope, filtstr), attrlist)
+
+def _search(base, scope, filtstr=None):
+    if filtstr and filtstr.endswith('=*'):
+        keys = [filtstr.split('=', 1)]
+        return [result for _, results in sorted(MOCK_LDAP_USERS.items())
+                for result in results if test_keys(keys, result)]
+    elif filtstr:
         keys = [filt.split('=', 1) for filt in filtstr.split(',')]
         for (user, _), results in MOCK_LDAP_USERS.items():
             for result in results:
@@ -35,6 +64,45 @@ def search_s(base, scope, filtstr=None, attrlist=None):
             if base == user:
                 return results
 #===============================================================================
+# Asynchronous operations, results are computed on submission
+#===============================================================================
+
+_msgids = itertools.count(1)
+_pending = {}
+
+def _submit(rtype, func, *args):
+    msgid = next(_msgids)
+    try:
+        _pending[msgid] = rtype, func(*args), None
+    except ldap.LDAPError as err:
+        _pending[msgid] = rtype, None, err
+    return msgid
+
+def simple_bind(username, password):
+    return _submit(ldap.RES_BIND, simple_bind_s, username, password)
+
+def search_ext_s(base, scope, filterstr='(objectClass=*)', attrlist=None, sizelimit=0,
+                 **kwargs):
+    if filterstr == '(objectClass=*)':
+        filterstr = None
+    results = search_s(base, scope, filterstr, attrlist)
+    if sizelimit and results and len(results) > sizelimit:
+        raise ldap.SIZELIMIT_EXCEEDED({'desc': "Size limit exceeded"})
+    return results
+
+def search_ext(base, scope, filterstr='(objectClass=*)', attrlist=None, **kwargs):
+    return _submit(ldap.RES_SEARCH_RESULT, search_ext_s, base, scope, filterstr, attrlist,
+                   kwargs.get('sizelimit', 0))
+
+def abandon(msgid):
+    _pending.pop(msgid, None)
+
+def result3(msgid, all=1, timeout=None):
+    rtype, data, err = _pending.pop(msgid)
+    if err is not None:
+        raise err
+    return rtype, data, msgid, []
+#===============================================================================
 #
 #===============================================================================
 
@@ -47,6 +115,134 @@ class LDAPTestFixture(object):
         self._ldap_init = self._init_patch.start()
         self._ldap_init().simple_bind_s = simple_bind_s
         self._ldap_init().search_s = search_s
+        self._ldap_init().search_ext_s = search_ext_s
+        self._ldap_init().simple_bind = simple_bind
+        self._ldap_init().search_ext = search_ext
+        self._ldap_init().result3 = result3
+        self._ldap_init().abandon = abandon
 
     def tearDown(self):
         self._init_patch.stop()
+
+#===============================================================================
+# Simulated directory for benchmarks
+#===============================================================================
+
+class SimulatedDirectory(object):
+    '''
+    A thread-safe in-memory directory of `users` users for benchmarks.
+
+    Users are ``uid=user<N>,ou=people`` with password ``pass<N>``. Every
+    operation sleeps `latency` seconds and `initialize` sleeps
+    `connect_latency` seconds, releasing the GIL like a network round-trip.
+    A fraction `failure_rate` of all operations raise `ldap.SERVER_DOWN`.
+
+    Use it in place of `ldap.initialize`::
+
+        with patch('ldap.initialize', side_effect=directory.initialize):
+            ...
+    '''
+
+    def __init__(self, users=1000, latency=0.0, connect_latency=0.0, failure_rate=0.0,
+                 seed=None):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.failure_rate = failure_rate
+        self.entries = {}
+        self.uids = {}
+        for n in range(users):
+            dn = 'uid=user%d,ou=people' % n
+            self.entries[dn] = ('pass%d' % n, {'uid': [b'user%d' % n],
+                                               'cn': [b'User %d' % n],
+                                               'mail': [b'user%d@example.com' % n]})
+            self.uids['user%d' % n] = dn
+        self.operations = dict.fromkeys(('connect', 'bind', 'search'), 0)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def operation(self, name, latency=None):
+        'Count, delay and possibly fail the operation `name`'
+        with self._lock:
+            self.operations[name] += 1
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+        time.sleep(self.latency if latency is None else latency)
+        if failed:
+            raise ldap.SERVER_DOWN({'desc': "Injected failure"})
+
+    def initialize(self, uri):
+        self.operation('connect', self.connect_latency)
+        return SimulatedConnection(self, uri)
+
+    def bind(self, who, cred):
+        self.operation('bind')
+        if who and self.entries.get(who, (None,))[0] != cred:
+            raise ldap.INVALID_CREDENTIALS({'desc': "Invalid credentials"})
+
+    def search(self, base, scope, filterstr=None, attrlist=None):
+        if attrlist is not None and not all(isinstance(attr, str) for attr in attrlist):
+            raise TypeError("expected string in list")
+        self.operation('search')
+        match = re.search(r'uid=([^)]*)', filterstr or '')
+        if match is None or scope == ldap.SCOPE_BASE:
+            dns = [base] if base in self.entries else []
+        else:
+            dn = self.uids.get(match.group(1))
+            dns = [dn] if dn is not None and dn.endswith(',' + base) else []
+        return [tuple(result) for result in
+                project([(dn, dict(self.entries[dn][1])) for dn in dns], attrlist)]
+
+
+class SimulatedConnection(object):
+    'A connection to a `SimulatedDirectory`'
+
+    def __init__(self, directory, uri):
+        self.directory = directory
+        self._uri = uri
+        self._pending = {}
+        self._msgids = itertools.count(1)
+
+    def set_option(self, option, value):
+        pass
+
+    def start_tls_s(self):
+        self.directory.operation('connect')
+
+    def simple_bind_s(self, who='', cred=''):
+        self.directory.bind(who, cred)
+
+    def whoami_s(self):
+        self.directory.operation('search')
+        return ''
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None):
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    def search_ext_s(self, base, scope, filterstr='(objectClass=*)', attrlist=None, **kwargs):
+        return self.directory.search(base, scope, filterstr, attrlist)
+
+    def _submit(self, rtype, func, *args):
+        msgid = next(self._msgids)
+        try:
+            self._pending[msgid] = rtype, func(*args), None
+        except ldap.LDAPError as err:
+            self._pending[msgid] = rtype, None, err
+        return msgid
+
+    def simple_bind(self, who='', cred=''):
+        return self._submit(ldap.RES_BIND, self.directory.bind, who, cred)
+
+    def search_ext(self, base, scope, filterstr='(objectClass=*)', attrlist=None, **kwargs):
+        return self._submit(ldap.RES_SEARCH_RESULT, self.directory.search,
+                            base, scope, filterstr, attrlist)
+
+    def result3(self, msgid, all=1, timeout=None):
+        rtype, data, err = self._pending.pop(msgid)
+        if err is not None:
+            raise err
+        return rtype, data, msgid, []
+
+    def abandon(self, msgid):
+        self._pending.pop(msgid, None)
+
+    def unbind_s(self):
+        pass
@@ -0,0 +1,68 @@
+import threading
+import unittest
+
+from flask_ldap_login.admission import AdmissionControl
+from flask_ldap_login.errors import DirectoryBusy
+
+
+class TestAdmissionControl(unittest.TestCase):
+
+    def test_queue_full(self):
+        admission = AdmissionControl(limit=2, queue_size=0)
+        self.assertEqual(admission.acquire(), 0.0)
+        self.assertTrue(admission.try_acquire())
+        self.assertFalse(admission.try_acquire())
+        self.assertRaises(DirectoryBusy, admission.acquire)
+        admission.release()
+        self.assertEqual(admission.acquire(), 0.0)
+        stats = admission.stats()
+        self.assertEqual((stats['in_flight'], stats['admitted'], stats['rejected']), (2, 3, 1))
+
+    def test_queue_timeout(self):
+        admission = AdmissionControl(limit=1, queue_size=1, timeout=0.01)
+        admission.acquire()
+        self.assertRaises(DirectoryBusy, admission.acquire)
+        stats = admission.stats()
+        self.assertEqual((stats['queued'], stats['max_queued'], stats['timeouts']), (0, 1, 1))
+
+    def test_queued(self):
+        admission = AdmissionControl(limit=1, queue_size=1, timeout=5)
+        admission.acquire()
+        waited = []
+        waiter = threading.Thread(target=lambda: waited.append(admission.acquire()))
+        waiter.start()
+        while not admission.queued:
+            threading.Event().wait(0.001)
+        # The queue is full
+        self.assertRaises(DirectoryBusy, admission.acquire)
+        admission.release()
+        waiter.join()
+        self.assertEqual(len(waited), 1)
+        stats = admission.stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['admitted']), (1, 0, 2))
+        self.assertEqual(stats['max_wait'], waited[0])
+
+    def test_enqueue(self):
+        admission = AdmissionControl(limit=1, queue_size=2, timeout=5)
+        self.assertIsNone(admission.enqueue(None))
+        woken = []
+        first = admission.enqueue(lambda: woken.append(1))
+        second = admission.enqueue(lambda: woken.append(2))
+        self.assertRaises(DirectoryBusy, admission.enqueue, None)
+
+        # The slot is handed to the first waiter, which now owns it
+        admission.release()
+        self.assertEqual(woken, [1])
+        self.assertFalse(admission.cancel(first))
+        admission.expire(first)
+        self.assertEqual((admission.in_flight, admission.queued), (1, 1))
+
+        self.assertRaises(DirectoryBusy, admission.expire, second)
+        admission.release()
+        self.assertEqual(woken, [1])
+        stats = admission.stats()
+        self.assertEqual((stats['in_flight'], stats['admitted'], stats['timeouts']), (0, 2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
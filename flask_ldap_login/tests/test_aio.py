@@ -0,0 +1,240 @@
+import sys
+import unittest
+
+import flask
+from flask_testing import TestCase as FlaskTestCase
+from mock import Mock, patch
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.errors import DirectoryBusy
+
+from flask_ldap_login.tests.fixture import LDAPTestFixture, SimulatedDirectory
+
+
+@unittest.skipIf(sys.version_info < (3, 5), "asyncio login requires Python 3.5+")
+class TestAsyncLogin(LDAPTestFixture, FlaskTestCase):
+
+    def create_app(self):
+        return flask.Flask(__name__)
+
+    def login(self, LDAP, username, password):
+        import asyncio
+
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        sync_result = loginmanager.ldap_login(username, password)
+        loop = asyncio.new_event_loop()
+        try:
+            async_result = loop.run_until_complete(
+                loginmanager.ldap_login_async(username, password))
+        finally:
+            loop.close()
+        self.assertEqual(async_result, sync_result)
+        return async_result
+
+    def test_direct_bind(self):
+        LDAP = dict(BIND_DN='x=%(username)s')
+        self.assertIsNone(self.login(LDAP, 'user1', 'pass2'))
+        self.assertEqual(self.login(LDAP, 'user1', 'pass1'),
+                         {'dn': 'x=user1', 'uid': 'user1'})
+
+    def test_bind_search(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2',
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}],
+                    KEY_MAP={'transformed_key':'key'})
+        self.assertIsNone(self.login(LDAP, 'user1', 'pass2'))
+        self.assertEqual(self.login(LDAP, 'user1', 'pass1'), {'transformed_key': 'value1'})
+
+    def test_parallel_search(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', PARALLEL_SEARCH=True,
+                    ADAPTIVE_SEARCH_ORDER=True,
+                    USER_SEARCH=[{'base':'base1', 'filter':'uid=nobody-%(username)s'},
+                                 {'base':'base2', 'filter':'uid=%(username)s'}])
+        self.assertEqual(self.login(LDAP, 'user1', 'pass1'),
+                         {'dn': 'x=user1', 'uid': 'user1'})
+
+    def test_dn_cache(self):
+        LDAP = dict(BIND_DN='uid=user0,ou=people', BIND_AUTH='pass0', DN_CACHE_TTL=60,
+                    USER_SEARCH=[{'base':'ou=people', 'filter':'uid=%(username)s'}])
+        directory = SimulatedDirectory(users=2)
+        self._ldap_init.side_effect = directory.initialize
+        self.assertEqual(self.login(LDAP, 'user1', 'pass1')['uid'], b'user1')
+        # The asynchronous login hit the DN cached by the synchronous one
+        self.assertEqual((directory.operations['bind'], directory.operations['search']), (3, 2))
+
+    def test_result_on_readable(self):
+        import asyncio
+        import socket
+        import ldap
+        from flask_ldap_login.aio import result
+
+        sock, peer = socket.socketpair()
+        self.addCleanup(sock.close)
+        self.addCleanup(peer.close)
+        sock.setblocking(False)
+
+        class Connection(object):
+            polls = 0
+
+            def fileno(self):
+                return sock.fileno()
+
+            def result3(self, msgid, all=1, timeout=None):
+                self.polls += 1
+                try:
+                    sock.recv(1)
+                except (socket.error, IOError):
+                    return None, None, None, None
+                return ldap.RES_SEARCH_RESULT, [('x=user1', {})], msgid, []
+
+        conn = Connection()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.call_later(0.03, peer.send, b'x')
+            self.assertEqual(loop.run_until_complete(result(conn, 1)),
+                             (ldap.RES_SEARCH_RESULT, [('x=user1', {})]))
+            # Woken by the socket instead of polling, and no longer watching it
+            self.assertLessEqual(conn.polls, 3)
+            self.assertFalse(loop.remove_reader(sock.fileno()))
+        finally:
+            loop.close()
+
+    def cancel_login(self, loginmanager, delay):
+        'Start a login, cancel it after `delay` and let its executor calls finish'
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.create_task(loginmanager.ldap_login_async('user1', 'pass1'))
+            loop.run_until_complete(asyncio.sleep(delay))
+            task.cancel()
+            loop.run_until_complete(asyncio.wait([task]))
+            self.assertTrue(task.cancelled())
+            loop.run_until_complete(asyncio.sleep(0.1))
+        finally:
+            loop.close()
+
+    def test_cancel_acquire(self):
+        import time
+
+        LDAP = dict(BIND_DN='x=%(username)s', POOL_SIZE=1, POOL_TIMEOUT=0.1)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        pool = loginmanager._pool
+        acquire = pool.acquire
+
+        def slow_acquire(timeout=None):
+            time.sleep(0.05)
+            return acquire(timeout)
+
+        with patch.object(pool, 'acquire', side_effect=slow_acquire):
+            self.cancel_login(loginmanager, 0.01)
+        # The connection checked out for the cancelled login went back to the pool
+        self.assertEqual((len(pool), pool.idle), (1, 1))
+        self.assertIsNotNone(loginmanager.ldap_login('user1', 'pass1'))
+
+    def test_cancel_groups(self):
+        import time
+
+        LDAP = dict(BIND_DN='x=%(username)s')
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        loginmanager._groups = Mock()
+        pool = loginmanager._pool
+        events = []
+
+        def format_login(conn, results):
+            time.sleep(0.05)
+            events.append('groups')
+
+        def release(pconn, discard=False):
+            events.append('release')
+
+        with patch.object(loginmanager, '_format_login', side_effect=format_login), \
+                patch.object(pool, 'release', side_effect=release):
+            self.cancel_login(loginmanager, 0.02)
+        # The connection was not given back while the groups were resolved on it
+        self.assertEqual(events, ['groups', 'release'])
+
+    def test_executor(self):
+        LDAP = dict(BIND_DN='x=%(username)s', ASYNC_MODE='executor')
+        self.assertEqual(self.login(LDAP, 'user1', 'pass1'),
+                         {'dn': 'x=user1', 'uid': 'user1'})
+
+    def test_coalesce_logins(self):
+        import asyncio
+
+        LDAP = dict(BIND_DN='uid=%(username)s,ou=people', COALESCE_LOGINS=True)
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2, latency=0.01)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        credentials = [('user1', 'pass1')] * 4 + [('user1', 'bad')]
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            logins = asyncio.gather(*[loginmanager.ldap_login_async(username, password)
+                                      for username, password in credentials])
+            results = loop.run_until_complete(logins)
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+        self.assertEqual(results[:4], [results[0]] * 4)
+        self.assertEqual(results[0]['uid'], b'user1')
+        self.assertIsNone(results[4])
+        self.assertEqual(directory.operations['bind'], 2)
+        self.assertEqual(loginmanager.coalesce_stats(),
+                         {'in_flight': 0, 'coalesced': 3, 'timeouts': 0})
+
+
+    def test_admission_beyond_executor(self):
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        LDAP = dict(BIND_DN='uid=%(username)s,ou=people', MAX_CONCURRENT_LOGINS=1,
+                    LOGIN_QUEUE_SIZE=16, LOGIN_QUEUE_TIMEOUT=2)
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2, latency=0.005)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        # Queued logins must not hold the executor threads the admitted one needs
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=2)
+        loop.set_default_executor(executor)
+        asyncio.set_event_loop(loop)
+        try:
+            logins = asyncio.gather(*[loginmanager.ldap_login_async('user1', 'pass1')
+                                      for _ in range(8)])
+            results = loop.run_until_complete(asyncio.wait_for(logins, 1))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+            executor.shutdown()
+        self.assertEqual([userdata['uid'] for userdata in results], [b'user1'] * 8)
+        stats = loginmanager.admission_stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['admitted']), (0, 0, 8))
+
+    def test_admission_timeout(self):
+        import asyncio
+
+        LDAP = dict(BIND_DN='uid=%(username)s,ou=people', MAX_CONCURRENT_LOGINS=1,
+                    LOGIN_QUEUE_SIZE=4, LOGIN_QUEUE_TIMEOUT=0.01)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        # Another login holds the only slot
+        loginmanager._admission.acquire()
+
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertRaises(DirectoryBusy, loop.run_until_complete,
+                              loginmanager.ldap_login_async('user1', 'pass1'))
+        finally:
+            loop.close()
+        stats = loginmanager.admission_stats()
+        self.assertEqual((stats['in_flight'], stats['queued'], stats['timeouts']), (1, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
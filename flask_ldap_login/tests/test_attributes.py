@@ -0,0 +1,94 @@
+from datetime import datetime
+import json
+import struct
+import unittest
+import uuid
+
+from flask_ldap_login.attributes import (LazyUserData, compile_codecs,
+                                         compile_lazy_formatter, decode_guid, decode_sid,
+                                         decode_time)
+from flask_ldap_login.plan import compile_config
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_guid(self):
+        guid = uuid.UUID('12345678-1234-5678-1234-567812345678')
+        self.assertEqual(decode_guid([guid.bytes_le]), str(guid))
+
+    def test_sid(self):
+        sid = struct.pack('BB', 1, 5) + b'\0\0\0\0\0\x05' + struct.pack('<5I', 21, 1, 2, 3, 500)
+        self.assertEqual(decode_sid([sid]), 'S-1-5-21-1-2-3-500')
+
+    def test_time(self):
+        self.assertEqual(decode_time([b'20230102030405Z']), datetime(2023, 1, 2, 3, 4, 5))
+        self.assertEqual(decode_time([b'20230102030405.5Z']),
+                         datetime(2023, 1, 2, 3, 4, 5, 500000))
+        self.assertEqual(decode_time([b'20230102030405+0130']), datetime(2023, 1, 2, 1, 34, 5))
+
+    def test_unknown_codec(self):
+        self.assertRaises(ValueError, compile_codecs, {'cn': 'float'})
+
+
+class TestLazyUserData(unittest.TestCase):
+
+    def setUp(self):
+        self.userobj = {'dn': 'x=user1', 'cn': [b'User One'], 'uidNumber': [b'1000'],
+                        'mail': [b'a@b', b'c@d'], 'jpegPhoto': [b'\xff\xd8']}
+
+    def test_decode_on_access(self):
+        calls = []
+
+        def codec(value):
+            calls.append(value)
+            return int(value[0])
+
+        userdata = compile_lazy_formatter(None, {'uidNumber': codec})(self.userobj)
+        self.assertEqual(calls, [])
+        self.assertEqual(userdata['uidNumber'], 1000)
+        self.assertEqual(userdata['uidNumber'], 1000)
+        self.assertEqual(calls, [[b'1000']])
+
+    def test_keys_without_decoding(self):
+        self.userobj['unknownBinary'] = [b'\xff\xfe']
+        userdata = compile_lazy_formatter(None)(self.userobj)
+        # Keys come from the attribute names only, values that are not utf-8 stay raw
+        self.assertEqual(sorted(userdata), ['cn', 'dn', 'mail', 'uidNumber', 'unknownBinary'])
+        self.assertEqual(userdata['unknownBinary'], b'\xff\xfe')
+
+    def test_to_dict(self):
+        userdata = compile_lazy_formatter(None, {'cn': 'str', 'mail': 'str',
+                                                 'uidNumber': 'int'})(self.userobj)
+        plain = userdata.to_dict()
+        self.assertIs(type(plain), dict)
+        self.assertEqual(json.loads(json.dumps(plain)),
+                         {'dn': 'x=user1', 'cn': 'User One', 'uidNumber': 1000,
+                          'mail': ['a@b', 'c@d']})
+
+    def test_binary_attributes_skipped(self):
+        userdata = compile_lazy_formatter(None, {'cn': 'str'})(self.userobj)
+        self.assertEqual(sorted(userdata), ['cn', 'dn', 'mail', 'uidNumber'])
+        self.assertEqual(userdata['cn'], u'User One')
+        self.assertEqual(userdata['mail'], [b'a@b', b'c@d'])
+
+    def test_key_map(self):
+        userdata = compile_lazy_formatter({'name': 'cn', 'photo': 'jpegPhoto'},
+                                          {'jpegPhoto': 'bytes'})(self.userobj)
+        self.assertEqual(dict(userdata), {'name': b'User One', 'photo': b'\xff\xd8'})
+
+    def test_mutable(self):
+        userdata = LazyUserData(self.userobj, [('cn', 'cn')], {})
+        userdata['extra'] = 1
+        del userdata['cn']
+        self.assertEqual(userdata.to_dict(), {'extra': 1})
+
+    def test_compile_config(self):
+        plan = compile_config({'BIND_DN': '', 'OPTIONS': {}, 'LAZY_USERDATA': True,
+                               'ATTRIBUTE_CODECS': {'uidNumber': 'int'}})
+        userdata = plan.format_userdata(self.userobj)
+        self.assertIsInstance(userdata, LazyUserData)
+        self.assertEqual(userdata['uidNumber'], 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+import flask
+from mock import patch
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.bench import percentile, run_load
+from flask_ldap_login.tests.fixture import SimulatedDirectory
+
+
+class TestBench(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    def test_run_load(self):
+        directory = SimulatedDirectory(users=10)
+        app = flask.Flask(__name__)
+        app.config.update(LDAP=dict(BIND_DN='uid=user0,ou=people', BIND_AUTH='pass0',
+                                    USER_SEARCH={'base': 'ou=people',
+                                                 'filter': 'uid=%(username)s'}))
+        credentials = [('user1', 'pass1'), ('user2', 'wrong')]
+
+        with patch('ldap.initialize', side_effect=directory.initialize):
+            manager = LDAPLoginManager(app)
+            result = run_load(manager.ldap_login, credentials, threads=2, count=10)
+
+        self.assertEqual(result['failures'], 5)
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(directory.operations['search'], 10)
+        self.assertLessEqual(directory.operations['connect'], 2)
+
+    def test_failure_injection(self):
+        directory = SimulatedDirectory(users=1, failure_rate=1)
+        result = run_load(lambda u, p: directory.bind('uid=user0,ou=people', p),
+                          [('user0', 'pass0')], count=3)
+        self.assertEqual(result['errors'], {'SERVER_DOWN': 3})
+
+
+if __name__ == '__main__':
+    unittest.main()
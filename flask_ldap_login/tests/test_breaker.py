@@ -0,0 +1,52 @@
+import unittest
+
+from mock import patch
+
+from flask_ldap_login.breaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_and_reset(self):
+        breaker = CircuitBreaker(threshold=2, reset_timeout=30)
+        with patch('flask_ldap_login.breaker._clock', return_value=100):
+            breaker.record_failure()
+            self.assertTrue(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, OPEN)
+            self.assertFalse(breaker.allow())
+
+        with patch('flask_ldap_login.breaker._clock', return_value=131):
+            # One probe is let through
+            self.assertTrue(breaker.allow())
+            self.assertEqual(breaker.state, HALF_OPEN)
+            self.assertFalse(breaker.allow())
+            breaker.record_failure()
+            self.assertEqual(breaker.state, OPEN)
+            self.assertFalse(breaker.allow())
+
+        with patch('flask_ldap_login.breaker._clock', return_value=162):
+            self.assertTrue(breaker.allow())
+            breaker.record_success()
+            self.assertEqual(breaker.stats(), {'state': CLOSED, 'failures': 0})
+            self.assertTrue(breaker.allow())
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_lost_probe(self):
+        breaker = CircuitBreaker(threshold=1, reset_timeout=30)
+        with patch('flask_ldap_login.breaker._clock', return_value=100):
+            breaker.record_failure()
+        with patch('flask_ldap_login.breaker._clock', return_value=131):
+            self.assertTrue(breaker.allow())
+        with patch('flask_ldap_login.breaker._clock', return_value=162):
+            self.assertTrue(breaker.allow())
+
+
+if __name__ == '__main__':
+    unittest.main()
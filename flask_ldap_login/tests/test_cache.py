@@ -0,0 +1,70 @@
+import unittest
+
+from flask_ldap_login.cache import CredentialHasher, LoginCache, TTLCache, fingerprint
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_expiry(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1, ttl=-1)
+
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(len(cache), 0)
+
+
+class TestLoginCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = LoginCache(TTLCache(), CredentialHasher(iterations=1))
+
+    def test_hit_requires_same_password(self):
+        pwhash = self.cache.hash('user1', 'pass1')
+        self.cache.set('user1', pwhash, {'uid': 'user1'})
+
+        self.assertIsNone(self.cache.get('user1', self.cache.hash('user1', 'pass2')))
+        self.assertEqual(self.cache.get('user1', pwhash), {'uid': 'user1'})
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_returns_copies(self):
+        pwhash = self.cache.hash('user1', 'pass1')
+        self.cache.set('user1', pwhash, {'uid': 'user1'})
+        self.cache.get('user1', pwhash)['uid'] = 'changed'
+
+        self.assertEqual(self.cache.get('user1', pwhash), {'uid': 'user1'})
+
+    def test_invalidate(self):
+        pwhash = self.cache.hash('user1', 'pass1')
+        self.cache.set('user1', pwhash, {'uid': 'user1'})
+        self.cache.invalidate('user1')
+
+        self.assertIsNone(self.cache.get('user1', pwhash))
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_fingerprint(self):
+        userdata = {'uid': [b'user1'], 'cn': u'User One', 'uidNumber': 1000}
+        self.assertEqual(fingerprint(userdata),
+                         fingerprint({'uidNumber': 1000, 'cn': u'User One', 'uid': [b'user1']}))
+        self.assertNotEqual(fingerprint(userdata), fingerprint(dict(userdata, uidNumber=1001)))
+        self.assertNotEqual(fingerprint(userdata), fingerprint(dict(userdata, uidNumber='1000')))
+        self.assertNotEqual(fingerprint({'a': [b'b', b'c']}), fingerprint({'a': [b'bc']}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+from argparse import Namespace
+import os
+import shutil
+import tempfile
+import unittest
+
+import flask
+from mock import patch
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.check import bench, check_thresholds, read_credentials
+from flask_ldap_login.tests.fixture import SimulatedDirectory
+
+
+def bench_args(**kwargs):
+    args = dict(credentials=None, username=None, password=None, workers=2, count=10,
+                duration=None, max_p99=None, max_error_rate=None, min_throughput=None,
+                json=None)
+    args.update(kwargs)
+    return Namespace(**args)
+
+
+class TestCheck(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_credentials(self, content):
+        path = os.path.join(self.tmpdir, 'credentials')
+        with open(path, 'w') as fd:
+            fd.write(content)
+        return path
+
+    def test_read_credentials(self):
+        path = self.write_credentials("# comment\nuser1:pass1\n\nuser2:pa:ss2\n")
+        self.assertEqual(read_credentials(path), [('user1', 'pass1'), ('user2', 'pa:ss2')])
+        self.assertRaises(ValueError, read_credentials, self.write_credentials("user1\n"))
+
+    def test_thresholds(self):
+        result = {'logins': 10, 'failures': 1, 'errors': {'SERVER_DOWN': 1},
+                  'p99_ms': 50.0, 'throughput': 100.0, 'success_throughput': 80.0}
+        self.assertEqual(check_thresholds(result, bench_args(max_p99=100, max_error_rate=0.2,
+                                                             min_throughput=10)), [])
+        self.assertEqual(len(check_thresholds(result, bench_args(max_p99=10, max_error_rate=0.1,
+                                                                 min_throughput=1000))), 3)
+        # Logins returning None do not count as successful
+        self.assertEqual(len(check_thresholds(result, bench_args(min_throughput=90))), 1)
+
+    def test_bench(self):
+        directory = SimulatedDirectory(users=10)
+        app = flask.Flask(__name__)
+        app.config.update(LDAP=dict(BIND_DN='uid=%(username)s,ou=people'))
+        path = self.write_credentials("user1:pass1\nuser2:wrong\n")
+
+        with patch('ldap.initialize', side_effect=directory.initialize):
+            LDAPLoginManager(app)
+            self.assertEqual(bench(app, bench_args(credentials=path)), 0)
+            self.assertEqual(bench(app, bench_args(credentials=path, max_error_rate=0.1)), 1)
+
+            with patch('flask_ldap_login.check.input', create=True,
+                       return_value='user1') as prompt:
+                self.assertEqual(bench(app, bench_args(password='pass1')), 0)
+            prompt.assert_called_once_with('Username: ')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import base64
+import hashlib
+import unittest
+
+import flask
+import ldap
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.directory import (MemoryDirectory, check_password, normalize_dn,
+                                        parse_filter, parse_ldif)
+from flask_ldap_login.replay import stand_in
+
+LDIF = '''\
+version: 1
+
+# People
+dn: ou=people,dc=example,dc=com
+objectClass: organizationalUnit
+ou: people
+
+dn: uid=alice,ou=people,dc=example,dc=com
+objectClass: person
+objectClass: inetOrgPerson
+uid: alice
+cn: Alice Smith
+mail: alice@example.com
+userAccountControl: 512
+userPassword: secret
+
+dn: uid=bob,ou=people,dc=example,dc=com
+objectClass: person
+uid: bob
+cn:: Qm9iIErDuHJnZW5zZW4=
+userAccountControl: 514
+userPassword: {SSHA}%(ssha)s
+
+dn: uid=carol,ou=staff,ou=people,dc=example,dc=com
+objectClass: person
+uid: carol
+cn: Carol
+ ine Jones
+
+dn: uid=dave,ou=people,dc=example,dc=com
+changetype: delete
+
+dn: cn=admins,ou=groups,dc=example,dc=com
+objectClass: groupOfNames
+cn: admins
+member: UID=Alice, ou=People,dc=example,dc=com
+
+dn: cn=all,ou=groups,dc=example,dc=com
+objectClass: groupOfNames
+cn: all
+member: cn=admins,ou=groups,dc=example,dc=com
+member: uid=bob,ou=people,dc=example,dc=com
+'''
+
+SSHA = base64.b64encode(hashlib.sha1(b'hunter2' + b'salt').digest() + b'salt').decode('ascii')
+
+BASE = 'dc=example,dc=com'
+
+
+class TestDirectory(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = MemoryDirectory.from_ldif((LDIF % {'ssha': SSHA}).splitlines())
+
+    def search(self, filterstr, base=BASE, scope=ldap.SCOPE_SUBTREE, **kwargs):
+        return [dn.split(',')[0] for dn, _ in
+                self.directory.search(base, scope, filterstr, **kwargs)]
+
+    def test_ldif(self):
+        records = dict(parse_ldif((LDIF % {'ssha': SSHA}).splitlines()))
+        self.assertEqual(len(records), 6)
+        self.assertEqual(records['uid=bob,ou=people,dc=example,dc=com']['cn'],
+                         [u'Bob J\xf8rgensen'.encode('utf-8')])
+        self.assertEqual(records['uid=carol,ou=staff,ou=people,dc=example,dc=com']['cn'],
+                         [b'Caroline Jones'])
+        self.assertEqual(records['uid=alice,ou=people,dc=example,dc=com']['objectClass'],
+                         [b'person', b'inetOrgPerson'])
+        self.assertEqual(len(self.directory), 6)
+
+    def test_normalize_dn(self):
+        self.assertEqual(normalize_dn('UID=Alice, ou=People,DC=example,dc=com'),
+                         'uid=alice,ou=people,dc=example,dc=com')
+        self.assertEqual(normalize_dn(r'cn=Smith\2C John,dc=com'),
+                         normalize_dn(r'cn=smith\, john,dc=com'))
+        self.assertEqual(normalize_dn('cn=a+uid=b,dc=com'), normalize_dn('uid=b+cn=a,dc=com'))
+        self.assertRaises(ValueError, normalize_dn, 'not a dn')
+
+    def test_filters(self):
+        self.assertEqual(self.search('(uid=alice)'), ['uid=alice'])
+        self.assertEqual(self.search('uid=ALICE'), ['uid=alice'])
+        self.assertEqual(self.search('(&(objectClass=person)(|(uid=bob)(uid=carol)))'),
+                         ['uid=bob', 'uid=carol'])
+        self.assertEqual(self.search('(&(objectClass=person)(!(uid=bob)))'),
+                         ['uid=alice', 'uid=carol'])
+        self.assertEqual(self.search('(cn=*jones)'), ['uid=carol'])
+        self.assertEqual(self.search('(cn=a*i*h)'), ['uid=alice'])
+        self.assertEqual(self.search('(mail=*)'), ['uid=alice'])
+        self.assertEqual(self.search('(userAccountControl>=513)'), ['uid=bob'])
+        self.assertEqual(self.search('(userAccountControl<=512)'), ['uid=alice'])
+        self.assertEqual(self.search('(userAccountControl:1.2.840.113556.1.4.803:=2)'),
+                         ['uid=bob'])
+        self.assertEqual(self.search('(cn:caseExactMatch:=alice smith)'), [])
+        self.assertEqual(self.search('(cn:caseExactMatch:=Alice Smith)'), ['uid=alice'])
+        self.assertEqual(self.search('(ou:dn:=staff)'), ['uid=carol'])
+        self.assertEqual(self.search(r'(cn=Bob J\c3\b8rgensen)'), ['uid=bob'])
+        self.assertEqual(self.search('(member=uid=alice,ou=people,dc=example,dc=com)'),
+                         ['cn=admins'])
+        self.assertEqual(self.search('(member:1.2.840.113556.1.4.1941:='
+                                     'uid=alice,ou=people,dc=example,dc=com)'),
+                         ['cn=admins', 'cn=all'])
+
+        for filterstr in ('(uid=alice', '(&(uid=a)', '(uid=a)(uid=b)', '(!(a=1)(b=2))',
+                          '(=a)', '(uid:1.2.3:=a)', r'(uid=a\)'):
+            self.assertRaises(ldap.FILTER_ERROR, parse_filter, filterstr)
+
+    def test_scopes(self):
+        people = 'ou=people,' + BASE
+        self.assertEqual(self.search('(objectClass=*)', people, ldap.SCOPE_BASE), ['ou=people'])
+        self.assertEqual(self.search('(objectClass=person)', people, ldap.SCOPE_ONELEVEL),
+                         ['uid=alice', 'uid=bob'])
+        self.assertEqual(self.search('(uid=carol)', people, ldap.SCOPE_ONELEVEL), [])
+        self.assertEqual(self.search('(uid=carol)', people), ['uid=carol'])
+        self.assertEqual(self.search('(cn=*)', 'ou=groups,' + BASE), ['cn=admins', 'cn=all'])
+        self.assertEqual(self.search('(uid=alice)', 'ou=groups,' + BASE), [])
+        self.assertRaises(ldap.NO_SUCH_OBJECT, self.search, '(uid=alice)', 'ou=nowhere,' + BASE)
+        self.assertRaises(ldap.SIZELIMIT_EXCEEDED, self.search, '(objectClass=person)',
+                          sizelimit=2)
+
+    def test_attrlist(self):
+        [(dn, attrs)] = self.directory.search(BASE, ldap.SCOPE_SUBTREE, '(uid=alice)',
+                                              ['CN', 'mail', 'missing'])
+        self.assertEqual(dn, 'uid=alice,ou=people,dc=example,dc=com')
+        self.assertEqual(attrs, {'cn': [b'Alice Smith'], 'mail': [b'alice@example.com']})
+        [(_, attrs)] = self.directory.search(BASE, ldap.SCOPE_SUBTREE, '(uid=alice)', ['1.1'])
+        self.assertEqual(attrs, {})
+        if bytes is not str:
+            self.assertRaises(TypeError, self.directory.search, BASE, ldap.SCOPE_SUBTREE,
+                              '(uid=nobody)', [b'cn'])
+
+    def test_bind(self):
+        conn = self.directory.initialize('ldap://memory')
+        conn.simple_bind_s('uid=alice,ou=people,dc=example,dc=com', 'secret')
+        self.assertEqual(conn.whoami_s(), 'dn:uid=alice,ou=people,dc=example,dc=com')
+        conn.simple_bind_s('UID=bob, ou=people,dc=example,dc=com', 'hunter2')
+        conn.simple_bind_s('', '')
+        for who, cred in (('uid=alice,ou=people,dc=example,dc=com', 'wrong'),
+                          ('uid=carol,ou=staff,ou=people,dc=example,dc=com', 'secret'),
+                          ('uid=nobody,dc=example,dc=com', 'secret'), ('not a dn', 'secret')):
+            self.assertRaises(ldap.INVALID_CREDENTIALS, conn.simple_bind_s, who, cred)
+        self.assertRaises(ldap.UNWILLING_TO_PERFORM, conn.simple_bind_s,
+                          'uid=alice,ou=people,dc=example,dc=com', '')
+
+    def test_check_password(self):
+        self.assertTrue(check_password(b'secret', 'secret'))
+        self.assertTrue(check_password(b'{SSHA}' + SSHA.encode('ascii'), 'hunter2'))
+        self.assertTrue(check_password(
+            b'{SHA256}' + base64.b64encode(hashlib.sha256(b'pw').digest()), 'pw'))
+        self.assertFalse(check_password(b'{SSHA}' + SSHA.encode('ascii'), 'hunter3'))
+        self.assertFalse(check_password(b'{CRYPT}abc', 'abc'))
+
+    def test_update(self):
+        self.directory.add('uid=alice,ou=people,dc=example,dc=com',
+                           {'objectClass': [b'person'], 'uid': [b'alice2']})
+        self.assertEqual(self.search('(uid=alice)'), [])
+        self.assertEqual(self.search('(uid=alice2)'), ['uid=alice'])
+        self.directory.delete('uid=alice,ou=people,dc=example,dc=com')
+        self.assertEqual(self.search('(uid=alice2)'), [])
+        self.assertIsNone(self.directory.get('uid=alice,ou=people,dc=example,dc=com'))
+
+    def test_indexes(self):
+        # Unindexed filters give the same results by scanning the scope
+        directory = MemoryDirectory.from_ldif((LDIF % {'ssha': SSHA}).splitlines(), indexes=())
+        for filterstr in ('(uid=bob)', '(&(objectClass=person)(cn=Carol*))',
+                          '(member:1.2.840.113556.1.4.1941:=uid=alice,ou=people,' + BASE + ')'):
+            self.assertEqual(directory.search(BASE, ldap.SCOPE_SUBTREE, filterstr),
+                             self.directory.search(BASE, ldap.SCOPE_SUBTREE, filterstr))
+
+    def test_login(self):
+        app = flask.Flask(__name__)
+        app.config.update(LDAP=dict(
+            BIND_DN='uid=alice,ou=people,dc=example,dc=com', BIND_AUTH='secret',
+            USER_SEARCH={'base': BASE, 'filter': '(&(objectClass=person)(uid=%(username)s))'},
+            GROUP_SEARCH={'method': 'in_chain', 'base': BASE,
+                          'filter': '(objectClass=groupOfNames)'}))
+        with stand_in(self.directory):
+            manager = LDAPLoginManager(app)
+            userdata = manager.ldap_login('alice', 'secret')
+            self.assertEqual(userdata['groups'], ['cn=admins,ou=groups,dc=example,dc=com',
+                                                  'cn=all,ou=groups,dc=example,dc=com'])
+            self.assertEqual(manager.ldap_login('bob', 'hunter2')['groups'],
+                             ['cn=all,ou=groups,dc=example,dc=com'])
+            self.assertIsNone(manager.ldap_login('bob', 'secret'))
+            self.assertIsNone(manager.ldap_login('nobody', 'secret'))
+
+    def test_scale(self):
+        directory = MemoryDirectory(('uid=user%d,ou=people,dc=example,dc=com' % n,
+                                     {'objectClass': [b'person'], 'uid': [b'user%d' % n],
+                                      'userPassword': [b'pass%d' % n]})
+                                    for n in range(20000))
+        results = directory.search(BASE, ldap.SCOPE_SUBTREE,
+                                   '(&(objectClass=person)(uid=user12345))')
+        self.assertEqual([dn for dn, _ in results], ['uid=user12345,ou=people,dc=example,dc=com'])
+        directory.bind(results[0][0], 'pass12345')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import unittest
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+from mock import MagicMock
+
+from flask_ldap_login.export import or_filter, paged_search, username_attr
+
+
+class TestExport(unittest.TestCase):
+
+    def test_username_attr(self):
+        self.assertEqual(username_attr('uid=%(username)s'), 'uid')
+        self.assertEqual(username_attr('(&(objectClass=user)(sAMAccountName=%(username)s))'),
+                         'sAMAccountName')
+        self.assertRaises(ValueError, username_attr, '(cn=*)')
+
+    def test_or_filter(self):
+        self.assertEqual(or_filter('uid=%(username)s', ['a', 'b*)(uid=c']),
+                         r'(|(uid=a)(uid=b\2a\29\28uid=c))')
+        self.assertEqual(or_filter('(&(objectClass=person)(uid=%(username)s))', ['a']),
+                         '(|(&(objectClass=person)(uid=a)))')
+
+    def test_paged_search(self):
+        pages = [([('x=user1', {}), (None, ['ldap://referral'])], b'page2'),
+                 ([('x=user2', {})], b'')]
+        cookies = []
+        conn = MagicMock()
+
+        def search_ext(base, scope, filterstr, attrlist=None, serverctrls=None):
+            cookies.append(serverctrls[0].cookie)
+            self.assertEqual(serverctrls[0].size, 1)
+            return len(cookies)
+
+        def result3(msgid):
+            rdata, cookie = pages[msgid - 1]
+            return ldap.RES_SEARCH_RESULT, rdata, msgid, [
+                SimplePagedResultsControl(True, size=1, cookie=cookie)]
+
+        conn.search_ext.side_effect = search_ext
+        conn.result3.side_effect = result3
+
+        entries = paged_search(conn, 'base', ldap.SCOPE_SUBTREE, 'uid=*', page_size=1)
+        self.assertEqual(list(entries), [('x=user1', {}), ('x=user2', {})])
+        self.assertEqual(cookies, ['', b'page2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
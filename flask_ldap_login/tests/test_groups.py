@@ -0,0 +1,80 @@
+import unittest
+
+import ldap
+from mock import MagicMock
+
+from flask_ldap_login.cache import TTLCache
+from flask_ldap_login.groups import GroupResolver, compile_group_search
+
+# group -> members
+GROUPS = {'cn=devs': ['x=user1'],
+          'cn=staff': ['cn=devs', 'cn=admins'],
+          'cn=admins': ['x=user1', 'cn=all'],
+          'cn=all': ['cn=staff']}  # cycle
+
+
+def member_search(base, scope, filterstr, attrlist=None, **kwargs):
+    member = filterstr.split('(member=', 1)[1].rstrip(')')
+    return [(group, {}) for group, members in sorted(GROUPS.items()) if member in members]
+
+
+class TestGroupResolver(unittest.TestCase):
+
+    def test_member_nested(self):
+        conn = MagicMock()
+        conn.search_ext_s.side_effect = member_search
+        resolver = GroupResolver('member', base='ou=groups', cache=TTLCache())
+
+        expected = ['cn=admins', 'cn=all', 'cn=devs', 'cn=staff']
+        self.assertEqual(resolver.resolve(conn, 'x=user1', {}), expected)
+        self.assertEqual(conn.search_ext_s.call_args[0][:2], ('ou=groups', ldap.SCOPE_SUBTREE))
+        self.assertEqual(resolver.lookups, 5)
+
+        # Group parents come from the cache, only the user's groups are searched
+        self.assertEqual(resolver.resolve(conn, 'x=user1', {}), expected)
+        self.assertEqual(resolver.lookups, 6)
+
+    def test_not_nested(self):
+        conn = MagicMock()
+        conn.search_ext_s.side_effect = member_search
+        resolver = GroupResolver('member', base='ou=groups', nested=False)
+        self.assertEqual(resolver.resolve(conn, 'x=user1', {}), ['cn=admins', 'cn=devs'])
+
+    def test_member_of(self):
+        conn = MagicMock()
+        conn.search_ext_s.return_value = [('cn=devs', {'memberOf': [b'cn=staff']})]
+        resolver = GroupResolver('memberOf', nested=True)
+
+        self.assertEqual(resolver.resolve(conn, 'x=user1', {'memberOf': [b'cn=devs']}),
+                         ['cn=devs', 'cn=staff'])
+        conn.search_ext_s.assert_any_call('cn=devs', ldap.SCOPE_BASE, '(objectClass=*)',
+                                          attrlist=['memberOf'], timeout=-1, sizelimit=1000)
+
+    def test_in_chain(self):
+        conn = MagicMock()
+        conn.search_ext_s.return_value = [('cn=devs', {}), (None, ['ldap://ref'])]
+        resolver = GroupResolver('in_chain', base='dc=io', filter='objectClass=group',
+                                 sizelimit=50)
+
+        self.assertEqual(resolver.resolve(conn, 'cn=a\\, b', {}, prepare=lambda: 2.5),
+                         ['cn=devs'])
+        conn.search_ext_s.assert_called_once_with(
+            'dc=io', ldap.SCOPE_SUBTREE,
+            '(&(objectClass=group)(member:1.2.840.113556.1.4.1941:=cn=a\\5c, b))',
+            attrlist=['1.1'], timeout=2.5, sizelimit=50)
+
+    def test_sizelimit(self):
+        conn = MagicMock()
+        conn.search_ext_s.side_effect = ldap.SIZELIMIT_EXCEEDED({'desc': "Size limit exceeded"})
+        resolver = GroupResolver('member', base='ou=groups', sizelimit=1)
+        self.assertRaises(ldap.SIZELIMIT_EXCEEDED, resolver.resolve, conn, 'x=user1', {})
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, compile_group_search, {'method': 'nope', 'base': 'dc=io'})
+        self.assertRaises(ValueError, compile_group_search, {'method': 'member'})
+        self.assertRaises(ValueError, compile_group_search, {'base': 'dc=io', 'bad': 1})
+        self.assertIsNone(compile_group_search(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import unittest
 
 import flask
+import ldap
+from mock import patch
 from flask_testing import TestCase as FlaskTestCase
 
 from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.errors import DirectoryBusy, DirectoryUnavailable, ServiceBindFailed
 
 from flask_ldap_login.tests.fixture import LDAPTestFixture
 from flask_ldap_login.forms import LDAPLoginForm, Form
@@ -13,7 +16,7 @@ class TestLoginForm(LDAPTestFixture, FlaskTestCase):
 
     def create_app(self):
         app = flask.Flask(__name__)
-        LDAP = dict(BIND_DN='x=%(username)s')
+        LDAP = dict(BIND_DN='x=%(username)s', THROTTLE_THRESHOLD=1)
         app.config.update(LDAP=LDAP)
         app.config['SECRET_KEY'] = 'abc123'
 
@@ -46,6 +49,68 @@ class TestLoginForm(LDAPTestFixture, FlaskTestCase):
         # Test that save_user was called
         self.assertIsNotNone(self._user)
 
+    def test_throttled_login_form(self):
+
+        data = {'username':'user1', 'password':'bad'}
+        with self.app.test_request_context('/login', method="POST", data=data):
+
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(flask.get_flashed_messages(),
+                             ["Invalid LDAP credentials",
+                              "Too many failed login attempts, please try again later"])
+
+    def test_unavailable_login_form(self):
+
+        data = {'username':'user1', 'password':'pass1'}
+        manager = self.app.ldap_login_manager
+        with self.app.test_request_context('/login', method="POST", data=data), \
+                patch.object(manager, 'ldap_login', side_effect=DirectoryUnavailable("down")):
+
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(flask.get_flashed_messages(),
+                             ["The login directory is unavailable, please try again later"])
+
+    def test_timeout_login_form(self):
+
+        data = {'username':'user1', 'password':'pass1'}
+        manager = self.app.ldap_login_manager
+        with self.app.test_request_context('/login', method="POST", data=data), \
+                patch.object(manager, 'ldap_login',
+                             side_effect=ldap.TIMEOUT({'desc': 'Timed out'})):
+
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(flask.get_flashed_messages(),
+                             ["The login directory is unavailable, please try again later"])
+
+    def test_error_login_form(self):
+
+        data = {'username':'user1', 'password':'pass1'}
+        manager = self.app.ldap_login_manager
+        with self.app.test_request_context('/login', method="POST", data=data), \
+                patch.object(manager, 'ldap_login',
+                             side_effect=ServiceBindFailed("Could not bind")):
+
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(flask.get_flashed_messages(), ["Could not bind"])
+
+    def test_busy_login_form(self):
+
+        data = {'username':'user1', 'password':'pass1'}
+        manager = self.app.ldap_login_manager
+        with self.app.test_request_context('/login', method="POST", data=data), \
+                patch.object(manager, 'ldap_login', side_effect=DirectoryBusy("busy")):
+
+            form = LDAPLoginForm(flask.request.form, csrf_enabled=False)
+            self.assertFalse(form.validate_on_submit())
+            self.assertEqual(flask.get_flashed_messages(),
+                             ["Too many logins in progress, please try again in a moment"])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,23 @@
+import os
+import re
+import shutil
+import tempfile
+import threading
 import unittest
 
 import flask
 from flask_testing import TestCase as FlaskTestCase
+from mock import call, MagicMock, Mock, patch
 
 from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.errors import (AmbiguousUser, DirectoryBusy, DirectoryUnavailable,
+                                     LoginThrottled, ServiceBindFailed)
 
-from flask_ldap_login.tests.fixture import LDAPTestFixture
+import ldap
+
+from flask_ldap_login.tests.fixture import (LDAPTestFixture, MOCK_LDAP_USERS, project,
+                                          search_ext_s, search_s, simple_bind_s,
+                                          SimulatedConnection, SimulatedDirectory)
 
 
 class TestLoginManager(LDAPTestFixture, FlaskTestCase):
@@ -25,7 +37,7 @@ class TestLoginManager(LDAPTestFixture, FlaskTestCase):
 
         result = loginmanager.direct_bind('user1', 'pass1')
         self.assertIsNotNone(result)
-        self.assertEqual(result, {'dn': 'x=user1', 'key': 'value1', 'uid': 'user1'})
+        self.assertEqual(result, {'dn': 'x=user1', 'uid': 'user1'})
 
     def test_direct_bind_keymap(self):
 
@@ -56,7 +68,7 @@ class TestLoginManager(LDAPTestFixture, FlaskTestCase):
 
         result = loginmanager.bind_search('user1', 'pass1')
         self.assertIsNotNone(result)
-        self.assertEqual(result, {'dn': 'x=user1', 'key': 'value1', 'uid': 'user1'})
+        self.assertEqual(result, {'dn': 'x=user1', 'uid': 'user1'})
 
     def test_bind_search_keymap(self):
 
@@ -72,6 +84,490 @@ class TestLoginManager(LDAPTestFixture, FlaskTestCase):
         self.assertIsNotNone(result)
         self.assertEqual(result, {'transformed_key': 'value1'})
 
+    def test_ldap_login_pooled(self):
+        LDAP = dict(BIND_DN='x=%(username)s')
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        self._ldap_init.reset_mock()
+
+        result = loginmanager.ldap_login('user1', 'pass1')
+        self.assertEqual(result, {'dn': 'x=user1', 'uid': 'user1'})
+        self.assertIsNone(loginmanager.ldap_login('user2', 'pass1'))
+
+        # Both logins share a single pooled connection
+        self.assertEqual(self._ldap_init.call_count, 1)
+        self.assertEqual(self._ldap_init.return_value.unbind_s.call_count, 0)
+
+    def test_persistent_search(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', PERSISTENT_SEARCH=True,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        bind = self._ldap_init().simple_bind_s = Mock(side_effect=simple_bind_s)
+
+        self.assertIsNone(loginmanager.ldap_login('user1', 'pass2'))
+        result = loginmanager.ldap_login('user1', 'pass1')
+        self.assertEqual(result, {'dn': 'x=user1', 'uid': 'user1'})
+
+        # The service account is bound once and never rebound after a failed user bind
+        self.assertEqual(bind.call_args_list, [call('x=user2', 'pass2'),
+                                               call('x=user1', 'pass2'),
+                                               call('x=user1', 'pass1')])
+
+    def test_login_cache(self):
+        LDAP = dict(BIND_DN='x=%(username)s', LOGIN_CACHE_TTL=60, CACHE_HASH_ITERATIONS=1)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        bind = self._ldap_init().simple_bind_s = Mock(side_effect=simple_bind_s)
+
+        expected = {'dn': 'x=user1', 'uid': 'user1'}
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(bind.call_count, 1)
+
+        # A different password is never served from the cache
+        self.assertIsNone(loginmanager.ldap_login('user1', 'pass2'))
+        self.assertEqual(bind.call_count, 2)
+
+        loginmanager.invalidate('user1')
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(bind.call_count, 3)
+
+    def test_dn_cache(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', DN_CACHE_TTL=60,
+                    USER_SEARCH=[{'base':'base1', 'filter':'uid=nobody-%(username)s'},
+                                 {'base':'base2', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        search = self._ldap_init().search_ext_s = Mock(side_effect=search_ext_s)
+
+        expected = {'dn': 'x=user1', 'uid': 'user1'}
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(search.call_count, 2)
+        self.assertEqual(loginmanager.dn_cache.get('user1'), ('x=user1', 1))
+
+        search.reset_mock()
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        search.assert_called_once_with('x=user1', ldap.SCOPE_BASE, 'uid=user1',
+                                       attrlist=loginmanager.attrlist, timeout=10, sizelimit=2)
+
+    def test_dn_cache_operations(self):
+        LDAP = dict(BIND_DN='uid=user0,ou=people', BIND_AUTH='pass0', DN_CACHE_TTL=60,
+                    USER_SEARCH=[{'base':'ou=people', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1')['uid'], b'user1')
+        self.assertEqual((directory.operations['bind'], directory.operations['search']), (2, 1))
+
+        # A cache hit binds as the user and reads the entry on that connection
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1')['uid'], b'user1')
+        self.assertEqual((directory.operations['bind'], directory.operations['search']), (3, 2))
+
+        # A stale DN falls back to the search and is dropped from the cache
+        loginmanager.dn_cache.set('user1', ('uid=gone,ou=people', 0))
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1')['uid'], b'user1')
+        self.assertEqual(loginmanager.dn_cache.get('user1'), ('uid=user1,ou=people', 0))
+
+    def test_failure_cache(self):
+        LDAP = dict(BIND_DN='x=%(username)s', FAILURE_CACHE_TTL=60, CACHE_HASH_ITERATIONS=1)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        bind = self._ldap_init().simple_bind_s = Mock(side_effect=simple_bind_s)
+
+        self.assertIsNone(loginmanager.ldap_login('user1', 'pass2'))
+        self.assertIsNone(loginmanager.ldap_login('user1', 'pass2'))
+        self.assertEqual(bind.call_count, 1)
+
+        self.assertIsNotNone(loginmanager.ldap_login('user1', 'pass1'))
+        self.assertEqual(bind.call_count, 2)
+
+    def test_throttle(self):
+        LDAP = dict(BIND_DN='x=%(username)s', THROTTLE_THRESHOLD=2, THROTTLE_SOURCE_THRESHOLD=3)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        self.assertIsNone(loginmanager.ldap_login('user1', 'bad', source='1.2.3.4'))
+        self.assertIsNone(loginmanager.ldap_login('user1', 'bad', source='1.2.3.4'))
+        self.assertRaises(LoginThrottled, loginmanager.ldap_login, 'user1', 'pass1')
+
+        # A successful login resets the per-user counter but not the source's
+        self.assertIsNone(loginmanager.ldap_login('user2', 'bad', source='1.2.3.4'))
+        self.assertRaises(LoginThrottled, loginmanager.ldap_login, 'user2', 'pass2',
+                          source='1.2.3.4')
+        self.assertIsNotNone(loginmanager.ldap_login('user2', 'pass2', source='5.6.7.8'))
+
+        loginmanager.invalidate('user1')
+        self.assertIsNotNone(loginmanager.ldap_login('user1', 'pass1'))
+
+    def test_service_bind_failed(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='expired', METRICS='memory',
+                    USER_SEARCH=[{'base': 'base', 'filter': 'uid=%(username)s'}],
+                    FAILURE_CACHE_TTL=60, CACHE_HASH_ITERATIONS=1,
+                    THROTTLE_THRESHOLD=1, THROTTLE_SOURCE_THRESHOLD=1)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        # Not held against the user: no failure cached, nobody throttled
+        for _ in range(2):
+            self.assertRaises(ServiceBindFailed, loginmanager.ldap_login, 'user1', 'pass1',
+                              source='1.2.3.4')
+        self.assertEqual(len(loginmanager.failure_cache), 0)
+        self.assertFalse(loginmanager._user_throttle.blocked('user1'))
+        self.assertFalse(loginmanager._source_throttle.blocked('1.2.3.4'))
+        self.assertEqual(loginmanager.metrics.snapshot()['outcomes'],
+                         [{'outcome': 'server_error', 'count': 2}])
+
+        self.app.config['LDAP']['BIND_AUTH'] = 'pass2'
+        self.assertIsNotNone(loginmanager.ldap_login('user1', 'pass1', source='1.2.3.4'))
+
+    def test_parallel_search(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', PARALLEL_SEARCH=True,
+                    USER_SEARCH=[{'base':'base1', 'filter':'uid=nobody-%(username)s'},
+                                 {'base':'base2', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        search = self._ldap_init().search_ext_s = Mock(side_effect=search_ext_s)
+
+        self.assertIsNone(loginmanager.ldap_login('user1', 'pass2'))
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'),
+                         {'dn': 'x=user1', 'uid': 'user1'})
+        self.assertEqual(search.call_count, 0)
+
+    def test_adaptive_search_order(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', ADAPTIVE_SEARCH_ORDER=True,
+                    USER_SEARCH=[{'base':'base1', 'filter':'uid=nobody-%(username)s'},
+                                 {'base':'base2', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        search = self._ldap_init().search_ext_s = Mock(side_effect=search_ext_s)
+
+        expected = {'dn': 'x=user1', 'uid': 'user1'}
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(search.call_count, 2)
+
+        # The base that found the user is now searched first
+        search.reset_mock()
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        search.assert_called_once_with('base2', ldap.SCOPE_SUBTREE, 'uid=user1',
+                                       attrlist=loginmanager.attrlist, timeout=10, sizelimit=2)
+
+        stats = loginmanager.search_stats()
+        self.assertEqual([(s['base'], s['searches'], s['hits']) for s in stats],
+                         [('base1', 1, 0), ('base2', 2, 2)])
+
+    def test_server_failover(self):
+        LDAP = dict(BIND_DN='x=%(username)s', SERVERS=['ldap://a', 'ldap://b'],
+                    SERVER_BACKOFF=60)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        def initialize(uri):
+            conn = MagicMock(_uri=uri)
+            if uri == 'ldap://a':
+                conn.simple_bind_s.side_effect = ldap.SERVER_DOWN()
+            else:
+                conn.simple_bind_s = simple_bind_s
+                conn.search_s = search_s
+            return conn
+        self._ldap_init.side_effect = initialize
+
+        expected = {'dn': 'x=user1', 'uid': 'user1'}
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual([s['up'] for s in loginmanager.server_stats()], [False, True])
+
+        self._ldap_init.reset_mock()
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), expected)
+        self.assertEqual(self._ldap_init.call_count, 0)
+
+    def test_persistent_search_requires_static_bind_dn(self):
+        LDAP = dict(BIND_DN='x=%(username)s', PERSISTENT_SEARCH=True,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        self.assertRaises(ValueError, LDAPLoginManager, self.app)
+
+    def test_iter_users(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', KEY_MAP={'key': 'key'},
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        self.assertEqual(list(loginmanager.iter_users()),
+                         [{'key': 'value1'}, {'key': 'value2'}])
+
+    def test_sync_users(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', EXPORT_BATCH_SIZE=1,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        save_users = loginmanager.save_users(Mock())
+
+        self.assertEqual(loginmanager.sync_users(), 2)
+        self.assertEqual(save_users.call_args_list, [
+            call([('user1', {'dn': 'x=user1', 'uid': 'user1'})]),
+            call([('user2', {'dn': 'x=user2', 'uid': 'user2'})])])
+
+    def test_group_search(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', KEY_MAP={'key': 'key'},
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}],
+                    GROUP_SEARCH={'method': 'memberOf', 'key': 'memberships'})
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        self.assertEqual(loginmanager.attrlist, ['key', 'memberOf'])
+
+        def search(base, scope, filterstr=None, attrlist=None):
+            if base == 'cn=devs':
+                return [('cn=devs', {'memberOf': [b'cn=staff']})]
+            if base == 'cn=staff':
+                return [('cn=staff', {})]
+            return [('x=user1', {'key': ['value1'], 'memberOf': [b'cn=devs']})]
+        def search_ext_s(base, scope, filterstr=None, attrlist=None, **kwargs):
+            return search(base, scope, filterstr, attrlist)
+        self._ldap_init().search_s = search
+        self._ldap_init().search_ext_s = search_ext_s
+
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'),
+                         {'key': 'value1', 'memberships': ['cn=devs', 'cn=staff']})
+        self.assertEqual(loginmanager.group_cache.get('cn=devs'), ('cn=staff',))
+
+    def test_group_search_as_service(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', METRICS='memory', GROUP_CACHE_TTL=0,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}],
+                    GROUP_SEARCH={'method': 'member', 'base': 'ou=groups'})
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        # Users may not read the groups, only the BIND_DN may
+        bound = []
+        def bind(who, cred):
+            simple_bind_s(who, cred)
+            bound.append(who)
+        def search(base, scope, filterstr=None, attrlist=None, **kwargs):
+            if base != 'ou=groups':
+                return search_ext_s(base, scope, filterstr, attrlist, **kwargs)
+            return [('cn=devs', {})] if bound[-1] == 'x=user2' else []
+        self._ldap_init().simple_bind_s = bind
+        self._ldap_init().search_ext_s = search
+
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1')['groups'], ['cn=devs'])
+        self.assertEqual(bound, ['x=user2', 'x=user1', 'x=user2'])
+        phases = set(t['phase'] for t in loginmanager.metrics.snapshot()['timings'])
+        self.assertIn('groups', phases)
+
+        # Direct binds have no service account and search as the user
+        del bound[:]
+        self.app.config.update(LDAP=dict(BIND_DN='x=%(username)s',
+                                         GROUP_SEARCH={'method': 'member', 'base': 'ou=groups'}))
+        loginmanager = LDAPLoginManager(self.app)
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1')['groups'], [])
+        self.assertEqual(bound, ['x=user1'])
+
+    def test_metrics(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', METRICS='memory',
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        loginmanager.ldap_login('user1', 'pass1')
+        loginmanager.ldap_login('user1', 'wrong')
+        loginmanager.ldap_login('nobody', 'pass1')
+
+        snapshot = loginmanager.metrics.snapshot()
+        counts = dict((t['phase'], t['count']) for t in snapshot['timings'])
+        self.assertEqual(counts, {'connect': 1, 'login': 3, 'search': 3,
+                                  'service_bind': 4, 'user_bind': 2})
+        self.assertEqual(dict((o['outcome'], o['count']) for o in snapshot['outcomes']),
+                         {'success': 1, 'bad_password': 1, 'not_found': 1})
+
+    def test_ambiguous_user(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', METRICS='memory', PARALLEL_SEARCH=True,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=*%(username)s'},
+                                 {'base':'base', 'filter':'key=*%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        # Both users match both filters, nobody logs in
+        self.assertIsNone(loginmanager.ldap_login('', 'pass1'))
+        LDAP['PARALLEL_SEARCH'] = False
+        loginmanager = LDAPLoginManager(self.app)
+        loginmanager.set_raise_errors()
+        self.assertRaises(AmbiguousUser, loginmanager.ldap_login, '', 'pass1')
+
+        # More entries than the size limit
+        users = dict((('x=user%d' % n, 'pass%d' % n), [['x=user%d' % n, {'uid': 'user%d' % n}]])
+                     for n in range(3))
+        with patch.dict(MOCK_LDAP_USERS, users, clear=True):
+            self.assertRaises(AmbiguousUser, loginmanager.ldap_login, '', 'pass1')
+        self.assertEqual(loginmanager.metrics.snapshot()['outcomes'],
+                         [{'outcome': 'ambiguous', 'count': 2}])
+
+    def test_login_timeout(self):
+        LDAP = dict(BIND_DN='uid=user0,ou=people', BIND_AUTH='pass0', LOGIN_TIMEOUT=0.08,
+                    BREAKER_THRESHOLD=1, BREAKER_RESET_TIMEOUT=60,
+                    USER_SEARCH=[{'base':'ou=people', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2, latency=0.05)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        # The service bind and search use up the budget before the user bind
+        with patch.object(SimulatedConnection, 'set_option', autospec=True) as set_option:
+            self.assertRaises(ldap.TIMEOUT, loginmanager.ldap_login, 'user1', 'pass1')
+        self.assertEqual(directory.operations['bind'], 1)
+        self.assertEqual(directory.operations['search'], 1)
+
+        # Connecting is limited to what is left of the login, then reset
+        network_timeouts = [c[0][2] for c in set_option.call_args_list
+                            if c[0][1] == ldap.OPT_NETWORK_TIMEOUT]
+        self.assertEqual(network_timeouts[0], 0.08)
+        self.assertTrue(0 < network_timeouts[1] <= 0.08)
+        self.assertTrue(network_timeouts[2] < network_timeouts[1])
+        self.assertEqual(network_timeouts[-1], 0.08)
+
+        # The breaker opened, the directory is not contacted any more
+        self.assertEqual(loginmanager.breaker_stats()['state'], 'open')
+        self.assertRaises(DirectoryUnavailable, loginmanager.ldap_login, 'user1', 'pass1')
+        self.assertEqual(directory.operations['bind'], 1)
+
+    def test_coalesce_logins(self):
+        LDAP = dict(BIND_DN='uid=%(username)s,ou=people', COALESCE_LOGINS=True)
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2, latency=0.05)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        results = []
+        def login():
+            results.append(loginmanager.ldap_login('user1', 'pass1'))
+        threads = [threading.Thread(target=login) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [results[0]] * 4)
+        self.assertEqual(results[0]['uid'], b'user1')
+        self.assertEqual(directory.operations['bind'], 1)
+        self.assertEqual(loginmanager.coalesce_stats()['coalesced'], 3)
+
+    def test_admission_control(self):
+        LDAP = dict(BIND_DN='uid=%(username)s,ou=people', MAX_CONCURRENT_LOGINS=1,
+                    LOGIN_QUEUE_SIZE=0, METRICS='memory')
+        self.app.config.update(LDAP=LDAP)
+        directory = SimulatedDirectory(users=2, latency=0.05)
+        self._ldap_init.side_effect = directory.initialize
+        loginmanager = LDAPLoginManager(self.app)
+
+        results = []
+        login = threading.Thread(target=lambda: results.append(
+            loginmanager.ldap_login('user1', 'pass1')))
+        login.start()
+        while not loginmanager.admission_stats()['in_flight']:
+            login.join(0.001)
+        # The only slot is taken and nothing may wait
+        self.assertRaises(DirectoryBusy, loginmanager.ldap_login, 'user0', 'pass0')
+        login.join()
+
+        self.assertEqual(results[0]['uid'], b'user1')
+        stats = loginmanager.admission_stats()
+        self.assertEqual((stats['in_flight'], stats['admitted'], stats['rejected']), (0, 1, 1))
+        outcomes = dict((o['outcome'], o['count'])
+                        for o in loginmanager.metrics.snapshot()['outcomes'])
+        self.assertEqual(outcomes, {'success': 1, 'rejected': 1})
+
+    def test_shared_cache_backend(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        LDAP = dict(BIND_DN='x=%(username)s', LOGIN_CACHE_TTL=60, CACHE_BACKEND='file',
+                    CACHE_PATH=os.path.join(tmpdir, 'cache.db'), CACHE_HASH_ITERATIONS=1)
+        self.app.config.update(LDAP=LDAP)
+        self.assertRaises(ValueError, LDAPLoginManager, self.app)
+
+        LDAP['CACHE_SALT'] = 'shared'
+        # Two worker processes
+        worker1, worker2 = LDAPLoginManager(self.app), LDAPLoginManager(self.app)
+        userdata = worker1.ldap_login('user1', 'pass1')
+        connections = self._ldap_init.call_count
+        self.assertEqual(worker2.ldap_login('user1', 'pass1'), userdata)
+        self.assertEqual(worker2.login_cache.stats()['hits'], 1)
+        self.assertEqual(self._ldap_init.call_count, connections)
+
+        worker2.invalidate('user1')
+        self.assertIsNone(worker1.login_cache.get('user1', worker1._hasher('user1', 'pass1')))
+
+    def test_store_user(self):
+        LDAP = dict(BIND_DN='x=%(username)s', SAVE_USER_ON_CHANGE=True)
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        saved = {}
+        save_user = Mock(side_effect=lambda username, userdata: saved.setdefault(username, userdata))
+        load_user = Mock(side_effect=saved.get)
+        loginmanager.save_user(save_user)
+        loginmanager.load_user(load_user)
+
+        userdata = loginmanager.ldap_login('user1', 'pass1')
+        self.assertEqual(loginmanager.store_user('user1', userdata), userdata)
+        self.assertEqual(save_user.call_count, 1)
+
+        # Unchanged userdata is loaded
+        userdata = loginmanager.ldap_login('user1', 'pass1')
+        self.assertEqual(loginmanager.store_user('user1', userdata), userdata)
+        self.assertEqual(save_user.call_count, 1)
+        load_user.assert_called_once_with('user1')
+
+        # Changed userdata is saved
+        userdata['key'] = 'value2'
+        loginmanager.store_user('user1', userdata)
+        self.assertEqual(save_user.call_count, 2)
+
+        # The loader can not find the user, it is saved again
+        saved.clear()
+        loginmanager.store_user('user1', userdata)
+        self.assertEqual(save_user.call_count, 3)
+
+        loginmanager.invalidate('user1')
+        loginmanager.store_user('user1', userdata)
+        self.assertEqual(save_user.call_count, 4)
+
+    def test_user_attributes(self):
+        LDAP = dict(BIND_DN='x=user1', BIND_AUTH='pass1',
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+        # 'key' is not one of the default USER_ATTRIBUTES
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'), {'dn': 'x=user1', 'uid': 'user1'})
+
+        LDAP['USER_ATTRIBUTES'] = '*'
+        loginmanager = LDAPLoginManager(self.app)
+        self.assertEqual(loginmanager.ldap_login('user1', 'pass1'),
+                         {'dn': 'x=user1', 'key': 'value1', 'uid': 'user1'})
+
+        if bytes is not str:
+            # Like python-ldap 3, the fixture rejects bytes attribute names
+            self.assertRaises(TypeError, search_s, 'base', ldap.SCOPE_SUBTREE, 'uid=user1',
+                              [b'uid'])
+
+    def test_lookup_users(self):
+        LDAP = dict(BIND_DN='x=user2', BIND_AUTH='pass2', LOOKUP_CHUNK_SIZE=2,
+                    USER_SEARCH=[{'base':'base', 'filter':'uid=%(username)s'}])
+        self.app.config.update(LDAP=LDAP)
+        loginmanager = LDAPLoginManager(self.app)
+
+        def search(base, scope, filterstr, attrlist=None):
+            uids = re.findall(r'\(uid=([^)]*)\)', filterstr)
+            return project([result for results in MOCK_LDAP_USERS.values()
+                            for result in results if result[1]['uid'] in uids], attrlist)
+        search = self._ldap_init().search_s = Mock(side_effect=search)
+
+        found, misses = loginmanager.lookup_users(['user1', 'nobody', 'user2'])
+        self.assertEqual(found, {'user1': {'dn': 'x=user1', 'uid': 'user1'},
+                                 'user2': {'dn': 'x=user2', 'uid': 'user2'}})
+        self.assertEqual(misses, ['nobody'])
+        self.assertEqual([c[0][2] for c in search.call_args_list],
+                         ['(|(uid=user1)(uid=nobody))', '(|(uid=user2))'])
+
 
 
 
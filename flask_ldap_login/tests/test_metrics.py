@@ -0,0 +1,67 @@
+import unittest
+
+from mock import Mock
+
+from flask_ldap_login.metrics import (Histogram, HistogramMetrics, Metrics, StatsdMetrics,
+                                      compile_metrics)
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram(buckets=(0.01, 0.1, 1))
+        for seconds in (0.005, 0.05, 0.05, 0.5, 5):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.counts, [1, 2, 1, 1])
+        self.assertEqual(histogram.quantile(0.5), 0.1)
+        self.assertEqual(histogram.quantile(1), 5)
+        self.assertEqual(histogram.max, 5)
+
+    def test_histogram_metrics(self):
+        metrics = HistogramMetrics()
+        metrics.timing('search', 0.002, server='ldap://a', base='ou=people')
+        metrics.timing('search', 0.003, server='ldap://a', base='ou=people')
+        metrics.timing('login', 0.01)
+        metrics.count('success')
+        metrics.count('success')
+
+        snapshot = metrics.snapshot()
+        self.assertEqual([(t['phase'], t.get('base'), t['count']) for t in snapshot['timings']],
+                         [('login', None, 1), ('search', 'ou=people', 2)])
+        self.assertEqual(snapshot['outcomes'], [{'outcome': 'success', 'count': 2}])
+
+        metrics.reset()
+        self.assertEqual(metrics.snapshot(), {'timings': [], 'outcomes': []})
+
+    def test_statsd(self):
+        client = Mock()
+        metrics = StatsdMetrics(client, prefix='app')
+        metrics.timing('user_bind', 0.25, server='ldap://a')
+        metrics.count('bad_password')
+        client.timing.assert_called_once_with('app.user_bind', 250.0)
+        client.incr.assert_called_once_with('app.bad_password')
+
+    @unittest.skipIf(prometheus_client is None, "requires prometheus_client")
+    def test_prometheus(self):
+        from flask_ldap_login.metrics import PrometheusMetrics
+        registry = prometheus_client.CollectorRegistry()
+        metrics = PrometheusMetrics(registry=registry)
+        metrics.timing('search', 0.002, server='ldap://a', base='ou=people')
+        metrics.count('success')
+        self.assertEqual(registry.get_sample_value('ldap_login_total', {'outcome': 'success'}), 1)
+
+    def test_compile(self):
+        self.assertIsNone(compile_metrics(None))
+        self.assertIsInstance(compile_metrics('memory'), HistogramMetrics)
+        metrics = Metrics()
+        self.assertIs(compile_metrics(metrics), metrics)
+        self.assertRaises(ValueError, compile_metrics, 'graphite')
+
+
+if __name__ == '__main__':
+    unittest.main()
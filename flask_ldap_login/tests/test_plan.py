@@ -0,0 +1,55 @@
+import unittest
+
+import ldap
+
+from flask_ldap_login.plan import (compile_attrlist, compile_config, compile_formatter,
+                                   compile_options, compile_searches, DEFAULT_USER_ATTRIBUTES,
+                                   UserSearch)
+
+
+class TestCompileConfig(unittest.TestCase):
+
+    def test_options(self):
+        options = compile_options({'OPT_X_TLS_NEWCTX': 0,
+                                   'OPT_X_TLS_REQUIRE_CERT': 'OPT_X_TLS_NEVER',
+                                   'OPT_X_TLS_CACERTFILE': '/path/to/certfile'})
+        self.assertEqual(options[-1], (ldap.OPT_X_TLS_NEWCTX, 0))
+        self.assertIn((ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_NEVER), options)
+        self.assertIn((ldap.OPT_X_TLS_CACERTFILE, '/path/to/certfile'), options)
+
+    def test_unknown_option(self):
+        self.assertRaises(ValueError, compile_options, {'OPT_DOES_NOT_EXIST': 1})
+        self.assertRaises(ValueError, compile_options,
+                          {'OPT_X_TLS_REQUIRE_CERT': 'OPT_X_TLS_NEVR'})
+
+    def test_searches(self):
+        searches = compile_searches([{'base': 'dc=io', 'filter': 'uid=%(username)s'}])
+        self.assertEqual(searches, (UserSearch('dc=io', ldap.SCOPE_SUBTREE, 'uid=%(username)s'),))
+
+        self.assertRaises(ValueError, compile_searches, [{'base': 'dc=io'}])
+        self.assertRaises(ValueError, compile_searches,
+                          [{'base': 'dc=io', 'filter': 'uid=%(user)s'}])
+
+    def test_attrlist(self):
+        # python-ldap takes native str attribute names: bytes on Python 2, text on Python 3
+        self.assertEqual(compile_attrlist({'name': 'cn'}, ['memberOf']), ['cn', 'memberOf'])
+        self.assertEqual(compile_attrlist(None), list(DEFAULT_USER_ATTRIBUTES))
+        self.assertEqual(compile_attrlist(None, (), [u'uid']), ['uid'])
+        self.assertTrue(all(type(attr) is str for attr in compile_attrlist(None, (), [b'uid'])))
+        self.assertIsNone(compile_attrlist(None, ['memberOf'], '*'))
+
+    def test_bad_bind_dn(self):
+        self.assertRaises(ValueError, compile_config, {'BIND_DN': 'uid=%(name)s', 'OPTIONS': {}})
+
+    def test_formatter(self):
+        userobj = {'dn': 'x=user1', 'cn': ['User One'], 'mail': ['a@b', 'c@d'],
+                   'jpegPhoto': [b'\xff\xd8']}
+
+        self.assertEqual(compile_formatter(None)(userobj),
+                         {'dn': 'x=user1', 'cn': 'User One', 'mail': ['a@b', 'c@d']})
+        self.assertEqual(compile_formatter({'name': 'cn', 'photo': 'jpegPhoto'})(userobj),
+                         {'name': 'User One'})
+
+
+if __name__ == '__main__':
+    unittest.main()
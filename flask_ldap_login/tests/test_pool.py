@@ -0,0 +1,103 @@
+import threading
+import unittest
+
+import ldap
+from mock import MagicMock
+
+from flask_ldap_login.errors import PoolExhausted
+from flask_ldap_login.pool import ConnectionPool
+
+
+class TestConnectionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.created = []
+
+    def factory(self):
+        conn = MagicMock()
+        self.created.append(conn)
+        return conn
+
+    def test_reuse(self):
+        pool = ConnectionPool(self.factory, size=2)
+
+        with pool.connection() as conn1:
+            pass
+        with pool.connection() as conn2:
+            pass
+
+        self.assertIs(conn1.conn, conn2.conn)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual(pool.idle, 1)
+
+    def test_bounded(self):
+        pool = ConnectionPool(self.factory, size=1, timeout=0.01)
+
+        conn = pool.acquire()
+        self.assertRaises(PoolExhausted, pool.acquire)
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+
+    def test_waits_for_release(self):
+        pool = ConnectionPool(self.factory, size=1, timeout=5)
+        conn = pool.acquire()
+
+        timer = threading.Timer(0.01, pool.release, [conn])
+        timer.start()
+        self.assertIs(pool.acquire(), conn)
+        timer.join()
+
+    def test_discard_on_server_down(self):
+        pool = ConnectionPool(self.factory, size=1)
+
+        with self.assertRaises(ldap.SERVER_DOWN):
+            with pool.connection():
+                raise ldap.SERVER_DOWN()
+
+        self.assertEqual(len(pool), 0)
+        self.created[0].unbind_s.assert_called_once_with()
+
+    def test_keep_on_invalid_credentials(self):
+        pool = ConnectionPool(self.factory, size=1)
+
+        with self.assertRaises(ldap.INVALID_CREDENTIALS):
+            with pool.connection():
+                raise ldap.INVALID_CREDENTIALS()
+
+        self.assertEqual(pool.idle, 1)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(self.factory, size=2, idle_timeout=60)
+
+        with pool.connection() as conn1:
+            pass
+        conn1.last_used -= 120
+        with pool.connection() as conn2:
+            pass
+
+        self.assertIsNot(conn1.conn, conn2.conn)
+        self.created[0].unbind_s.assert_called_once_with()
+
+    def test_failed_health_check(self):
+        pool = ConnectionPool(self.factory, size=1, check_interval=60)
+
+        with pool.connection() as conn1:
+            conn1.whoami_s.side_effect = ldap.SERVER_DOWN()
+        conn1.last_used -= 120
+        with pool.connection() as conn2:
+            pass
+
+        self.assertIsNot(conn1.conn, conn2.conn)
+
+    def test_unpooled(self):
+        pool = ConnectionPool(self.factory, size=0)
+
+        with pool.connection():
+            pass
+
+        self.assertEqual(len(pool), 0)
+        self.created[0].unbind_s.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import flask
+import ldap
+from mock import patch
+
+from flask_ldap_login import LDAPLoginManager
+from flask_ldap_login.replay import (ReplayDirectory, read_log, redact_results,
+                                     restore_results, run_replay, stand_in)
+from flask_ldap_login.tests.fixture import SimulatedDirectory
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'ldap.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def manager(self, **config):
+        app = flask.Flask(__name__)
+        config.setdefault('BIND_DN', 'uid=user0,ou=people')
+        config.setdefault('BIND_AUTH', 'pass0')
+        config.setdefault('USER_SEARCH', {'base': 'ou=people', 'filter': 'uid=%(username)s'})
+        app.config.update(LDAP=config)
+        return LDAPLoginManager(app)
+
+    def record(self):
+        directory = SimulatedDirectory(users=5, latency=0.002)
+        with patch('ldap.initialize', side_effect=directory.initialize):
+            manager = self.manager(RECORD_PATH=self.path)
+            self.assertIsNotNone(manager.ldap_login('user1', 'pass1'))
+            self.assertIsNone(manager.ldap_login('user2', 'wrong'))
+            self.assertIsNone(manager.ldap_login('nobody', 'pass'))
+            manager._recorder.close()
+        return read_log(self.path)
+
+    def test_redaction(self):
+        results = [('uid=user1,ou=people', {'uid': [b'user1'], 'mail': b'u@example.com'}),
+                   (None, ['ldap://other/'])]
+        entries = redact_results(results)
+        self.assertEqual(entries, [['uid=user1,ou=people', {'uid': [5], 'mail': [13]}],
+                                   [None, 1]])
+        self.assertEqual(restore_results(entries),
+                         [('uid=user1,ou=people', {'uid': [b'xxxxx'], 'mail': [b'x' * 13]}),
+                          (None, ['ldap:///'])])
+
+    def test_record(self):
+        events = self.record()
+
+        self.assertEqual([e['username'] for e in events if e['op'] == 'login'],
+                         ['user1', 'user2', 'nobody'])
+        self.assertNotIn('pass1', open(self.path).read())
+
+        searches = [e for e in events if e['op'] == 'search']
+        self.assertEqual(searches[0]['filter'], 'uid=user1')
+        self.assertEqual(searches[0]['results'][0][0], 'uid=user1,ou=people')
+        self.assertEqual(searches[-1]['results'], [])
+
+        binds = [e for e in events if e['op'] == 'bind' and e['who'] == 'uid=user2,ou=people']
+        self.assertEqual(binds[0]['error'], 'INVALID_CREDENTIALS')
+        self.assertTrue(all(e['elapsed'] >= 0 for e in events if 'elapsed' in e))
+
+    def test_replay(self):
+        directory = ReplayDirectory(self.record(), latency_scale=0)
+        self.assertEqual([username for _, username in directory.logins],
+                         ['user1', 'user2', 'nobody'])
+
+        initialize = ldap.initialize
+        with stand_in(directory):
+            manager = self.manager()
+            self.assertEqual(manager.ldap_login('user1', 'replay')['uid'], b'xxxxx')
+            self.assertIsNone(manager.ldap_login('user2', 'replay'))
+            self.assertIsNone(manager.ldap_login('nobody', 'replay'))
+            self.assertEqual(directory.misses, 0)
+
+            result = run_replay(manager.ldap_login, directory.logins, threads=2, speed=0)
+        self.assertIs(ldap.initialize, initialize)
+
+        self.assertEqual(result['failures'], 2)
+        self.assertEqual(result['errors'], {})
+        self.assertEqual(directory.misses, 0)
+        self.assertEqual(directory.stats()['search'], 6)
+
+    def test_unrecorded(self):
+        directory = ReplayDirectory([], latency_scale=0)
+        with stand_in(directory):
+            self.assertIsNone(self.manager().ldap_login('user1', 'pass1'))
+        self.assertEqual(directory.misses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
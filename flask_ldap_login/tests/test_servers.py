@@ -0,0 +1,39 @@
+import unittest
+
+from flask_ldap_login.servers import ServerSet
+
+
+class TestServerSet(unittest.TestCase):
+
+    def test_select_by_latency(self):
+        servers = ServerSet(['ldap://a', 'ldap://b'])
+        servers.record_success('ldap://a', 0.5)
+        self.assertEqual(servers.select(), 'ldap://b')
+
+        servers.record_success('ldap://b', 1.0)
+        self.assertEqual(servers.select(), 'ldap://a')
+
+    def test_backoff(self):
+        servers = ServerSet(['ldap://a', 'ldap://b'], backoff=60)
+        servers.record_failure('ldap://a')
+
+        self.assertFalse(servers.available('ldap://a'))
+        self.assertEqual(servers.select(), 'ldap://b')
+
+        servers.record_failure('ldap://a')
+        servers.record_failure('ldap://b')
+        # Everything is down: use the server coming back first
+        self.assertEqual(servers.select(), 'ldap://b')
+
+        servers.record_success('ldap://a')
+        self.assertEqual([s['up'] for s in servers.stats()], [True, False])
+
+    def test_unknown_uri(self):
+        servers = ServerSet(['ldap://a'])
+        servers.record_failure('ldap://other')
+        self.assertTrue(servers.available('ldap://other'))
+        self.assertTrue(servers.available('ldap://a'))
+
+
+if __name__ == '__main__':
+    unittest.main()
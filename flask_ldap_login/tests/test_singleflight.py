@@ -0,0 +1,86 @@
+import threading
+import unittest
+
+from flask_ldap_login.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def run_concurrently(self, flight, func, followers=3):
+        'Call ``flight.do`` from a leader and `followers` threads, return the results'
+        results = []
+
+        def call():
+            try:
+                results.append(flight.do('key', func))
+            except Exception as err:
+                results.append(err)
+
+        threads = [threading.Thread(target=call) for _ in range(followers + 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def blocking(self, flight, followers, result):
+        'A function returning `result` once `followers` calls joined it'
+        calls = []
+
+        def func():
+            calls.append(1)
+            while flight.coalesced < followers:
+                threading.Event().wait(0.001)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        return func, calls
+
+    def test_shared_result(self):
+        flight = SingleFlight(timeout=5)
+        func, calls = self.blocking(flight, 3, {'uid': ['user1']})
+        results = self.run_concurrently(flight, func)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'uid': ['user1']}] * 4)
+        # Followers get copies
+        self.assertEqual(len(set(id(r) for r in results)), 4)
+        self.assertEqual(flight.stats(), {'in_flight': 0, 'coalesced': 3, 'timeouts': 0})
+
+    def test_shared_error(self):
+        flight = SingleFlight(timeout=5)
+        error = ValueError('down')
+        func, calls = self.blocking(flight, 3, error)
+        self.assertEqual(self.run_concurrently(flight, func), [error] * 4)
+        self.assertEqual(len(calls), 1)
+
+    def test_follower_timeout(self):
+        flight = SingleFlight(timeout=0.01)
+        release = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(1)
+            if len(calls) == 1:
+                release.wait(5)
+            return len(calls)
+
+        leader = threading.Thread(target=flight.do, args=('key', func))
+        leader.start()
+        while not calls:
+            release.wait(0.001)
+        # The stuck leader does not hang the follower
+        self.assertEqual(flight.do('key', func), 2)
+        release.set()
+        leader.join()
+        self.assertEqual(flight.timeouts, 1)
+
+    def test_key(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.key('user1', 'pass1'), flight.key(u'user1', u'pass1'))
+        self.assertNotEqual(flight.key('user1', 'pass1'), flight.key('user1', 'pass2'))
+        self.assertNotEqual(SingleFlight().key('user1', 'pass1'), flight.key('user1', 'pass1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
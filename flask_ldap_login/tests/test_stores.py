@@ -0,0 +1,135 @@
+import fnmatch
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import patch
+
+from flask_ldap_login.cache import TTLCache
+from flask_ldap_login.stores import (compile_cache_backend, FileBackend, FileCache,
+                                     memory_backend, RedisBackend, RedisCache)
+
+
+class TestFileCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_shared(self):
+        store = FileCache(self.path, 'login', ttl=60, secret='secret')
+        store.set('user1', (b'hash', {'uid': b'user1'}))
+        # Another process opens the same file
+        other = FileCache(self.path, 'login', ttl=60, secret='secret')
+        self.assertEqual(other.get('user1'), (b'hash', {'uid': b'user1'}))
+        other.delete('user1')
+        self.assertIsNone(store.get('user1'))
+        # Stores are namespaced by name
+        FileCache(self.path, 'dn', secret='secret').set('user1', ('uid=user1', 0))
+        self.assertEqual(store.get('user1', 'missing'), 'missing')
+
+    def test_permissions(self):
+        umask = os.umask(0o022)
+        try:
+            store = FileCache(self.path, ttl=60, secret='secret')
+            store.set('user1', 'value')
+        finally:
+            os.umask(umask)
+        for suffix in ('', '-wal', '-shm'):
+            self.assertEqual(os.stat(self.path + suffix).st_mode & 0o777, 0o600)
+
+    def test_signature(self):
+        store = FileCache(self.path, ttl=60, secret='secret')
+        store.set('user1', 'value')
+        store.set('user2', 'other')
+        # Entries written with another secret or moved to another key are ignored
+        self.assertIsNone(FileCache(self.path, ttl=60, secret='other').get('user1'))
+        store._execute('UPDATE entries SET value = (SELECT value FROM entries '
+                       "WHERE key = 'user1') WHERE key = 'user2'")
+        self.assertIsNone(store.get('user2'))
+        self.assertEqual(store.get('user1'), 'value')
+        self.assertRaises(ValueError, FileCache, self.path)
+
+    def test_expiry(self):
+        store = FileCache(self.path, ttl=60, secret='secret')
+        with patch('time.time', return_value=1000):
+            store.set('user1', 'value')
+            store.set('user2', 'value', ttl=10)
+        with patch('time.time', return_value=1020):
+            self.assertIsNone(store.get('user2'))
+            self.assertEqual(store.get('user1'), 'value')
+        self.assertEqual(store.expirations, 1)
+
+    def test_prune(self):
+        store = FileCache(self.path, maxsize=2, ttl=60, secret='secret')
+        for n, ttl in enumerate([30, 10, 20]):
+            store.set('user%d' % n, n, ttl=ttl)
+        store.prune()
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('user1'))
+        self.assertEqual(store.stats()['evictions'], 1)
+        store.clear()
+        self.assertEqual(len(store), 0)
+
+
+class FakeRedis(object):
+    'The subset of redis.Redis used by RedisCache'
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, px=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
+class TestRedisCache(unittest.TestCase):
+
+    def test_redis(self):
+        client = FakeRedis()
+        backend = compile_cache_backend(RedisBackend(client, prefix='app'), secret='secret')
+        login, dn = backend('login', 1024, 60), backend('dn', 1024, 60)
+        login.set('user1', (b'hash', {'uid': b'user1'}))
+        dn.set('user1', ('uid=user1', 0))
+        self.assertEqual(sorted(client.data), ['app:dn:user1', 'app:login:user1'])
+        self.assertEqual(login.get('user1'), (b'hash', {'uid': b'user1'}))
+        login.clear()
+        self.assertIsNone(login.get('user1'))
+        self.assertEqual(dn.get('user1'), ('uid=user1', 0))
+
+        # Only entries signed with the secret are unpickled
+        client.data['app:dn:user2'] = b'\x80\x02cos\nsystem\nq\x00.'
+        with patch('pickle.loads') as loads:
+            self.assertIsNone(dn.get('user2'))
+        self.assertFalse(loads.called)
+        self.assertIsNone(RedisCache(client, 'dn', prefix='app', secret='other').get('user1'))
+
+
+class TestCompileCacheBackend(unittest.TestCase):
+
+    def test_compile(self):
+        self.assertIs(compile_cache_backend('memory'), memory_backend)
+        self.assertIsInstance(memory_backend('login', 10, 60), TTLCache)
+        backend = compile_cache_backend('file', '/tmp/x.db', secret='secret')
+        self.assertIsInstance(backend, FileBackend)
+        self.assertEqual(backend.secret, 'secret')
+        redis = RedisBackend(FakeRedis(), secret='own')
+        self.assertIs(compile_cache_backend(redis, secret='secret'), redis)
+        self.assertRaises(ValueError, compile_cache_backend, 'file')
+        self.assertRaises(ValueError, compile_cache_backend, 'redis')
+
+
+if __name__ == '__main__':
+    unittest.main()
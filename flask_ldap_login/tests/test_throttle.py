@@ -0,0 +1,44 @@
+import threading
+import time
+import unittest
+
+from mock import patch
+
+from flask_ldap_login.throttle import FailureThrottle
+
+
+class TestFailureThrottle(unittest.TestCase):
+
+    def test_threshold(self):
+        throttle = FailureThrottle(threshold=2, window=60)
+        throttle.record('user1')
+        self.assertFalse(throttle.blocked('user1'))
+        throttle.record('user1')
+        self.assertTrue(throttle.blocked('user1'))
+        self.assertFalse(throttle.blocked('user2'))
+        throttle.reset('user1')
+        self.assertFalse(throttle.blocked('user1'))
+
+    def test_concurrent_failures(self):
+        throttle = FailureThrottle(threshold=40, window=60)
+        get = throttle._failures.get
+
+        def slow_get(key, default=None):
+            # Let the other threads read the same count in between
+            value = get(key, default)
+            time.sleep(0.001)
+            return value
+
+        threads = [threading.Thread(target=lambda: [throttle.record('user1') for _ in range(5)])
+                   for _ in range(8)]
+        with patch.object(throttle._failures, 'get', side_effect=slow_get):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertTrue(throttle.blocked('user1'))
+        self.assertEqual(throttle._failures.get('user1')[0], 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
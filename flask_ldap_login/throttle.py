@@ -0,0 +1,40 @@
+"""
+Local rejection of repeated failed logins.
+"""
+import threading
+import time
+
+from .cache import TTLCache
+
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class FailureThrottle(object):
+    '''
+    Count failures per key over a fixed window of `window` seconds starting at
+    the first failure. Once a key reached `threshold` failures it is blocked
+    until the window ends. Failures recorded concurrently are all counted.
+    '''
+
+    def __init__(self, threshold, window=300, maxsize=10000):
+        self.threshold = threshold
+        self.window = window
+        self._failures = TTLCache(maxsize=maxsize, ttl=window)
+        self._lock = threading.Lock()
+
+    def blocked(self, key):
+        'Return True if `key` has reached the failure threshold'
+        count, _ = self._failures.get(key, (0, None))
+        return count >= self.threshold
+
+    def record(self, key):
+        'Record a failure for `key`'
+        with self._lock:
+            now = _clock()
+            count, start = self._failures.get(key, (0, now))
+            self._failures.set(key, (count + 1, start), ttl=self.window - (now - start))
+
+    def reset(self, key):
+        'Forget the failures of `key`'
+        with self._lock:
+            self._failures.delete(key)